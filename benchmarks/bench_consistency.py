@@ -0,0 +1,111 @@
+"""Measure the label consistency pass of `consistency.py` on long documents
+made of the sentences of the HIPE corpora.
+
+The model is left out: predictions are the gold entities, each of which is
+missed with probability `--miss-rate`. The pass is timed with the Python
+automaton and, when it is installed, with pyahocorasick, and the precision
+and recall of entities are given before and after it.
+"""
+
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "with_simpletransformers"))
+
+import consistency  # noqa: E402
+import standoff  # noqa: E402
+from readers import read_conll, to_sentences  # noqa: E402
+
+
+def entity_set(tagss):
+    tags = [tag for sentence_tags in tagss for tag in sentence_tags]
+    bounds = np.cumsum([0] + [len(sentence_tags) for sentence_tags in tagss])
+    first, last, types = standoff.decode_entities(tags, bounds)
+    return set(zip(first.tolist(), last.tolist(), types.tolist()))
+
+
+def miss_entities(tagss, miss_rate, rng):
+    """Return a copy of `tagss` where every entity is replaced by O tags with
+    probability `miss_rate`.
+    """
+
+    missed = []
+    for tags in tagss:
+        tags = list(tags)
+        bounds = np.array([0, len(tags)])
+        for first, last, _ in zip(*standoff.decode_entities(tags, bounds)):
+            if rng.random() < miss_rate:
+                tags[first: last + 1] = ["O"] * (last + 1 - first)
+        missed.append(tags)
+    return missed
+
+
+def scores(gold, predicted):
+    correct = len(gold & predicted)
+    return correct / len(predicted) if predicted else 0.0, correct / len(gold) if gold else 0.0
+
+
+def main(paths, sentences_per_document=(100, 1000, 0), miss_rate=0.3, resolution="majority", repeat=3, seed=0):
+    sentences, tagss = [], []
+    for path in paths:
+        corpus_sentences, corpus_tagss = to_sentences(read_conll(path))
+        sentences.extend(corpus_sentences)
+        tagss.extend(corpus_tagss)
+    rng = np.random.default_rng(seed)
+    predicted = miss_entities(tagss, miss_rate, rng)
+    n_words = sum(map(len, sentences))
+    print(f"{len(sentences)} sentences, {n_words} words, {miss_rate:.0%} of entities missed")
+
+    backends = ["python"] + ([] if consistency.ahocorasick is None else ["pyahocorasick"])
+    if consistency.ahocorasick is None:
+        print("pyahocorasick is not installed, only the Python automaton is measured")
+    module = consistency.ahocorasick
+    print(
+        f"{'sentences/doc':>13} {'backend':<14} {'time (s)':>9} {'words/s':>10} {'added':>7}"
+        f" {'P before':>9} {'R before':>9} {'P after':>8} {'R after':>8}"
+    )
+    for size in sentences_per_document:
+        size = size or len(sentences)
+        documents = [(start, min(start + size, len(sentences))) for start in range(0, len(sentences), size)]
+        for backend in backends:
+            consistency.ahocorasick = module if backend == "pyahocorasick" else None
+            timings = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                results = [
+                    consistency.propagate(sentences[start: end], predicted[start: end], resolution=resolution)
+                    for start, end in documents
+                ]
+                timings.append(time.perf_counter() - start_time)
+            seconds = min(timings)
+
+            gold = entity_set(tagss)
+            before = entity_set(predicted)
+            after = entity_set([tags for propagated, _ in results for tags in propagated])
+            precision_before, recall_before = scores(gold, before)
+            precision_after, recall_after = scores(gold, after)
+            print(
+                f"{size:>13} {backend:<14} {seconds:>9.3f} {n_words / seconds:>10.0f}"
+                f" {sum(added for _, added in results):>7} {precision_before:>9.1%} {recall_before:>9.1%}"
+                f" {precision_after:>8.1%} {recall_after:>8.1%}"
+            )
+    consistency.ahocorasick = module
+
+
+if __name__ == "__main__":
+    hipe = ROOT / "with_transformers" / "hipe"
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("paths", nargs="*", default=[f"{hipe}/train.conll", f"{hipe}/dev.conll"], help="CoNLL files with gold entities (default: HIPE train and dev).")
+    parser.add_argument("-s", "--sentences-per-document", type=lambda value: tuple(int(size) for size in value.split(",")), default=(100, 1000, 0), help="Comma-separated numbers of sentences per document, 0 for a single document (default: 100,1000,0).")
+    parser.add_argument("-m", "--miss-rate", type=float, default=0.3, help="Probability that an entity is missed (default: %(default)s).")
+    parser.add_argument("--resolution", choices=consistency.RESOLUTIONS, default="majority", help="Type of forms seen with several types (default: %(default)s).")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of timed runs, the best is kept (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the missed entities (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,118 @@
+"""Run the benchmarks of the tutorial pipelines and store their results as
+JSON, optionally comparing them with the results of another commit.
+
+    python benchmarks/run.py
+    python benchmarks/run.py -b readers -b inference --compare benchmarks/results/<commit>.json
+
+Results are written to `benchmarks/results/<commit>.json` by default, with the
+versions of the libraries and the number of threads they were measured with.
+Timings only compare on the same machine.
+"""
+
+import argparse
+import datetime
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+
+import torch
+import transformers
+
+from suite import BENCHMARKS, ROOT, Context
+
+
+def current_commit():
+    """Return the short hash of the current commit (with a "-dirty" suffix if
+    the tree has changes), or "unknown" outside of git.
+    """
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def metadata():
+    return {
+        "commit": current_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "threads": torch.get_num_threads(),
+    }
+
+
+def compare(results, reference, threshold=0.1):
+    """Print the ratio of every timing and throughput of `results` to that of
+    `reference` and return the cases more than `threshold` slower.
+    """
+
+    regressions = []
+    print(f"{'case':<40} {'metric':<22} {'reference':>11} {'current':>11} {'ratio':>7}")
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            old = reference.get(case, {}).get(metric)
+            if not old or not (metric.endswith("seconds") or metric.endswith("per_second")):
+                continue
+            ratio = value / old
+            slower = ratio > 1 + threshold if metric.endswith("seconds") else ratio < 1 / (1 + threshold)
+            if slower:
+                regressions.append((case, metric))
+            print(f"{case:<40} {metric:<22} {old:>11.4g} {value:>11.4g} {ratio:>7.2f}{' !' if slower else ''}")
+    return regressions
+
+
+def main(benchmarks=None, output=None, compare_with=None, threshold=0.1, repeat=5, batch_sizes=(1, 8, 32, 64), n_sentences=256):
+    transformers.logging.set_verbosity_error()
+    context = Context(repeat=repeat, batch_sizes=batch_sizes, n_sentences=n_sentences)
+    results = {}
+    for name in benchmarks or BENCHMARKS:
+        print(f"# {name}", flush=True)
+        for case, metrics in BENCHMARKS[name](context).items():
+            results[case] = metrics
+            print(f"{case:<40} {metrics['seconds']:>9.4f} s")
+
+    meta = metadata()
+    if output is None:
+        output = pathlib.Path(__file__).resolve().parent / "results" / f"{meta['commit']}.json"
+    output = pathlib.Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_stream:
+        json.dump({"meta": meta, "results": results}, output_stream, indent=2)
+    print(f"results written to {output}")
+
+    if compare_with:
+        with open(compare_with, encoding="utf-8") as input_stream:
+            reference = json.load(input_stream)
+        print()
+        print(f"compared with {reference['meta']['commit']} ({compare_with}):")
+        regressions = compare(results, reference["results"], threshold=threshold)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {threshold * 100:.0f}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-b", "--benchmark", dest="benchmarks", action="append", choices=list(BENCHMARKS), help="Benchmark to run, may be repeated (default: all).")
+    parser.add_argument("-o", "--output", help="JSON file of the results (default: benchmarks/results/<commit>.json).")
+    parser.add_argument("--compare", dest="compare_with", help="JSON results of a previous run to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as a regression (default: %(default)s).")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of timed runs, the best is kept (default: %(default)s).")
+    parser.add_argument("--batch-sizes", type=lambda value: tuple(int(size) for size in value.split(",")), default=(1, 8, 32, 64), help="Comma-separated batch sizes of the inference benchmark (default: 1,8,32,64).")
+    parser.add_argument("--n-sentences", type=int, default=256, help="Number of sentences of the inference benchmark (default: %(default)s).")
+    args = parser.parse_args()
+
+    sys.exit(main(**vars(args)))
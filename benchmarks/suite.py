@@ -0,0 +1,360 @@
+"""Benchmarks of the tutorial pipelines on the bundled corpora.
+
+Every benchmark is a function taking a `Context` (the shared fixtures) and
+returning its cases, as a dictionary mapping the name of a case to its
+metrics. Metrics ending in "seconds" are lower-is-better timings, metrics
+ending in "per_second" higher-is-better throughputs; others are informative.
+"""
+
+import gc
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "with_transformers"))
+sys.path.append(str(ROOT / "with_simpletransformers"))
+
+from transformers import DataCollatorForTokenClassification  # noqa: E402
+
+from batching import LengthBucketBatchSampler  # noqa: E402
+from bench_consistency import entity_set, miss_entities  # noqa: E402
+from bench_pretokenized import read_examples, tokenize_and_align_labels  # noqa: E402
+import decoding  # noqa: E402
+from pretokenized import PretokenizedDataset, tokenize_corpus  # noqa: E402
+import consistency  # noqa: E402
+import readers  # noqa: E402
+import standoff  # noqa: E402
+from tiny import tiny_model, train_tokenizer  # noqa: E402
+
+
+HIPE = ROOT / "with_transformers" / "hipe"
+CORPORA = {
+    "hipe-train": (HIPE / "train.conll", "conll"),
+    "hipe-dev": (HIPE / "dev.conll", "conll"),
+    "hipe-test": (HIPE / "test.conll", "conll"),
+    "presto-sample": (ROOT / "with_transformers" / "presto" / "sample.conll", "presto"),
+    "exemple": (ROOT / "sample_data" / "exemple.conll", "conll"),
+}
+
+
+def best_of(function, repeat):
+    """Return the result of `function` and the best and median of its wall
+    times over `repeat` runs.
+    """
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, {"seconds": min(timings), "median_seconds": float(np.median(timings))}
+
+
+class Context:
+    """The fixtures shared by benchmarks, built on first use: a tokenizer
+    trained on the HIPE train set, the HIPE dev set as tokens and label ids,
+    and a tiny CamemBERT.
+    """
+
+    def __init__(self, repeat=5, batch_sizes=(1, 8, 32, 64), n_sentences=256):
+        self.repeat = repeat
+        self.batch_sizes = batch_sizes
+        self.n_sentences = n_sentences
+        self._tokenizer = None
+        self._examples = None
+        self._model = None
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = train_tokenizer(HIPE / "train.conll")
+        return self._tokenizer
+
+    @property
+    def examples(self):
+        if self._examples is None:
+            self._examples = read_examples(HIPE / "dev.conll")
+        return self._examples
+
+    @property
+    def n_labels(self):
+        return int(max(max(sentence_tags) for sentence_tags in self.examples[1] if sentence_tags)) + 1
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = tiny_model(self.tokenizer, self.n_labels)
+        return self._model
+
+    def dataset(self):
+        tokens, tags = self.examples
+        return PretokenizedDataset(tokenize_corpus(self.tokenizer, tokens, tags), max_length=512, overlap=64)
+
+
+def bench_readers(context):
+    """Throughput of `read_conll` and `read_presto` on every bundled corpus."""
+
+    cases = {}
+    for name, (path, data_format) in CORPORA.items():
+        reader = readers.format2function[data_format]
+        df, metrics = best_of(lambda: reader(path), context.repeat)
+        metrics["tokens_per_second"] = len(df) / metrics["seconds"]
+        metrics["tokens"] = len(df)
+        cases[f"read_{data_format}/{name}"] = metrics
+    return cases
+
+
+def bench_builders(context):
+    """Time of the `conll.py` builder writing the Arrow cache of a corpus, in a
+    new cache folder for every run.
+    """
+
+    import datasets
+
+    import conll
+
+    datasets.disable_progress_bar()
+    configs = {
+        "HIPE": {
+            "train": str(HIPE / "train.conll"),
+            "validation": str(HIPE / "dev.conll"),
+            "test": str(HIPE / "test.conll"),
+        },
+        "conll": {"train": str(HIPE / "train.conll")},  # labels inferred from the data
+        "Presto": {"train": str(CORPORA["presto-sample"][0])},
+    }
+    cases = {}
+    for config_name, data_files in configs.items():
+        def build():
+            with tempfile.TemporaryDirectory() as cache_dir:
+                builder = conll.Conll(
+                    cache_dir=cache_dir,
+                    config_name=config_name,
+                    data_files=data_files,
+                    num_workers=1,
+                )
+                builder.download_and_prepare()
+                return sum(len(builder.as_dataset(split=split)) for split in data_files)
+
+        n_sentences, metrics = best_of(build, context.repeat)
+        metrics["sentences_per_second"] = n_sentences / metrics["seconds"]
+        metrics["sentences"] = n_sentences
+        cases[f"conll/{config_name}"] = metrics
+    return cases
+
+
+def bench_tokenization(context):
+    """Tokenization and label alignment of the HIPE dev set, by the notebook
+    loop and by `pretokenized.tokenize_corpus`.
+    """
+
+    tokens, tags = context.examples
+    n_words = sum(map(len, tokens))
+    cases = {}
+    for name, function in (
+        ("notebook_loop", lambda: tokenize_and_align_labels(context.tokenizer, tokens, tags)),
+        ("tokenize_corpus", lambda: tokenize_corpus(context.tokenizer, tokens, tags)),
+    ):
+        _, metrics = best_of(function, context.repeat)
+        metrics["words_per_second"] = n_words / metrics["seconds"]
+        cases[f"tokenize_align/{name}"] = metrics
+    return cases
+
+
+def bench_features(context):
+    """Conversion of the HIPE train set to features with `datasets.map`, as in
+    the notebook, in a single process and with `num_proc` processes.
+    """
+
+    import datasets
+
+    datasets.disable_progress_bar()
+    tokens, tags = read_examples(HIPE / "train.conll")
+    dataset = datasets.Dataset.from_dict({"tokens": tokens, "ner_tags": tags})
+    tokenizer = context.tokenizer
+
+    def align(examples):
+        input_ids, labels = tokenize_and_align_labels(tokenizer, examples["tokens"], examples["ner_tags"])
+        return {"input_ids": input_ids, "labels": labels}
+
+    cases = {}
+    for num_proc in sorted({1, os.cpu_count() or 1}):
+        _, metrics = best_of(
+            lambda: dataset.map(align, batched=True, num_proc=num_proc if num_proc > 1 else None, load_from_cache_file=False),
+            min(context.repeat, 3),
+        )
+        metrics["sentences_per_second"] = len(tokens) / metrics["seconds"]
+        cases[f"features/num_proc={num_proc}"] = metrics
+    if len(cases) > 1:
+        single, parallel = cases.values()
+        parallel["speedup"] = single["seconds"] / parallel["seconds"]
+    return cases
+
+
+def bench_segmentation(context):
+    """Regex segmentation of the HIPE dev set as running text and decoding of
+    tags (capitalized words within sentences) into entities, by `standoff.py`.
+    """
+
+    tokens, _ = context.examples
+    text = "\n\n".join(" ".join(words) for words in tokens)
+    doc, metrics = best_of(lambda: standoff.Document("dev", text), context.repeat)
+    metrics["tokens_per_second"] = doc.n_tokens / metrics["seconds"]
+    metrics["sentences"] = len(doc.sentence_bounds) - 1
+    cases = {"segment/regex": metrics}
+
+    sentences = doc.sentences()
+    tagss = [["B-pers" if i and word[:1].isupper() else "O" for i, word in enumerate(words)] for words in sentences]
+    _, metrics = best_of(lambda: (doc.add_predictions(tagss), doc.to_json()), context.repeat)
+    metrics["tokens_per_second"] = doc.n_tokens / metrics["seconds"]
+    metrics["entities"] = len(doc.entity_starts)
+    cases["entities/regex"] = metrics
+    return cases
+
+
+def bench_decoding(context):
+    """Decoding of tags from random logits of the words of the HIPE dev set,
+    by per-word argmax and by the constrained Viterbi of `decoding.py`, and
+    grouping of the tags into entities, with the number of I- tags that do
+    not continue an entity.
+    """
+
+    labels = sorted(readers.read_conll(HIPE / "train.conll")["labels"].unique())
+    tokens, _ = context.examples
+    lengths = [len(words) for words in tokens]
+    bounds = np.r_[0, np.cumsum(lengths)]
+    rng = np.random.default_rng(0)
+    logits = [rng.normal(size=(length, len(labels))).astype(np.float32) for length in lengths]
+    names = np.asarray(labels, dtype=object)
+    decoders = {
+        "argmax": lambda: [names[sentence_logits.argmax(axis=1)].tolist() for sentence_logits in logits],
+        "viterbi": lambda: decoding.decode_tags(logits, labels),
+    }
+    cases = {}
+    for name, decode in decoders.items():
+        def decode_entities():
+            tags = [tag for sentence_tags in decode() for tag in sentence_tags]
+            return tags, standoff.decode_entities(tags, bounds)
+
+        (tags, (first, _, _)), metrics = best_of(decode_entities, context.repeat)
+        previous = np.asarray(["O"] + tags[:-1], dtype=object)
+        previous[bounds[:-1][bounds[:-1] < len(tags)]] = "O"
+        metrics["words_per_second"] = len(tags) / metrics["seconds"]
+        metrics["entities"] = len(first)
+        metrics["invalid_tags"] = sum(
+            tag.startswith("I-") and before[2:] != tag[2:] for before, tag in zip(previous.tolist(), tags)
+        )
+        cases[f"decode/{name}"] = metrics
+    return cases
+
+
+def bench_consistency(context):
+    """Label consistency pass of `consistency.py` on the HIPE train set as
+    one long document whose gold entities are missed with probability 0.3,
+    with the Python automaton and pyahocorasick (if installed), and the
+    recall of entities before and after it.
+    """
+
+    sentences, tagss = readers.to_sentences(readers.read_conll(HIPE / "train.conll"))
+    predicted = miss_entities(tagss, 0.3, np.random.default_rng(0))
+    gold, before = entity_set(tagss), entity_set(predicted)
+    n_words = sum(map(len, sentences))
+    module = consistency.ahocorasick
+    cases = {}
+    for name in ["python"] + ([] if module is None else ["pyahocorasick"]):
+        consistency.ahocorasick = module if name == "pyahocorasick" else None
+        try:
+            (propagated, added), metrics = best_of(lambda: consistency.propagate(sentences, predicted), context.repeat)
+        finally:
+            consistency.ahocorasick = module
+        after = entity_set(propagated)
+        metrics["words_per_second"] = n_words / metrics["seconds"]
+        metrics["added"] = added
+        metrics["recall_before"] = len(gold & before) / len(gold)
+        metrics["recall_after"] = len(gold & after) / len(gold)
+        metrics["precision_after"] = len(gold & after) / len(after)
+        cases[f"consistency/{name}"] = metrics
+    return cases
+
+
+def bench_collation(context):
+    """Collation of the HIPE dev set into padded batches of 32 sentences, in
+    random order and length-bucketed, with the padding ratio of each.
+    """
+
+    dataset = context.dataset()
+    features = [dataset[i] for i in range(len(dataset))]
+    collator = DataCollatorForTokenClassification(context.tokenizer)
+    order = np.random.default_rng(0).permutation(len(features))
+    samplers = {
+        "random": [order[i: i + 32].tolist() for i in range(0, len(order), 32)],
+        "bucket": list(LengthBucketBatchSampler(dataset.lengths, batch_size=32, shuffle=False)),
+        "tokens": list(LengthBucketBatchSampler(dataset.lengths, max_tokens=4096, shuffle=False)),
+    }
+    cases = {}
+    for name, batches in samplers.items():
+        def collate():
+            return [collator([features[i] for i in batch])["attention_mask"] for batch in batches]
+
+        masks, metrics = best_of(collate, context.repeat)
+        n_tokens = sum(int(mask.sum()) for mask in masks)
+        n_padded = sum(mask.numel() for mask in masks)
+        metrics["batches_per_second"] = len(batches) / metrics["seconds"]
+        metrics["padding_ratio"] = 1.0 - n_tokens / n_padded
+        cases[f"collate/{name}"] = metrics
+    return cases
+
+
+def bench_inference(context):
+    """CPU inference of the tiny CamemBERT on the first sentences of the HIPE
+    dev set, for every batch size: latency of a batch and throughput.
+    """
+
+    dataset = context.dataset()
+    collator = DataCollatorForTokenClassification(context.tokenizer)
+    items = [dataset[i] for i in range(min(context.n_sentences, len(dataset)))]
+    n_tokens = sum(len(item["input_ids"]) for item in items)
+    model = context.model
+    cases = {}
+    with torch.inference_mode():
+        for batch_size in context.batch_sizes:
+            batches = [
+                {key: value for key, value in collator(items[i: i + batch_size]).items() if key != "labels"}
+                for i in range(0, len(items), batch_size)
+            ]
+            model(**batches[0])  # warm-up
+            latencies = []
+            start = time.perf_counter()
+            for batch in batches:
+                batch_start = time.perf_counter()
+                model(**batch)
+                latencies.append(time.perf_counter() - batch_start)
+            elapsed = time.perf_counter() - start
+            cases[f"inference/batch_size={batch_size}"] = {
+                "seconds": elapsed,
+                "latency_seconds": float(np.median(latencies)),
+                "p90_latency_seconds": float(np.percentile(latencies, 90)),
+                "sentences_per_second": len(items) / elapsed,
+                "tokens_per_second": n_tokens / elapsed,
+            }
+    return cases
+
+
+BENCHMARKS = {
+    "readers": bench_readers,
+    "builders": bench_builders,
+    "tokenization": bench_tokenization,
+    "features": bench_features,
+    "segmentation": bench_segmentation,
+    "decoding": bench_decoding,
+    "consistency": bench_consistency,
+    "collation": bench_collation,
+    "inference": bench_inference,
+}
@@ -0,0 +1,80 @@
+"""A tiny randomly initialized CamemBERT and its tokenizer, built from the
+bundled corpora, so that benchmarks need no download.
+
+The tokenizer is a BPE model trained on the words of a CoNLL file (BPE
+training is fast and deterministic, unlike unigram training), with the
+SentencePiece-like pre-tokenization, the special tokens and the `<s> ... </s>`
+template of CamemBERT. The model has the architecture of
+CamemBERT with a few small layers; its weights are random but seeded, so its
+timings only depend on its size.
+"""
+
+import torch
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, processors, trainers
+from transformers import CamembertConfig, CamembertForTokenClassification, PreTrainedTokenizerFast
+
+
+SPECIAL_TOKENS = ["<s>", "<pad>", "</s>", "<unk>", "<mask>"]
+
+
+def iter_words(path, batch_size=1000):
+    """Yield the words of a CoNLL file by batches."""
+
+    batch = []
+    with open(path, encoding="utf-8") as input_stream:
+        for line in input_stream:
+            line = line.strip()
+            if not line or line.startswith("-DOCSTART-"):
+                continue
+            batch.append(line.split("\t")[0])
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def train_tokenizer(path, vocab_size=8000):
+    """Return a CamemBERT-like fast tokenizer trained on the words of `path`."""
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.normalizer = normalizers.NFKC()
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+    tokenizer.decoder = decoders.Metaspace()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=SPECIAL_TOKENS, show_progress=False)
+    tokenizer.train_from_iterator(iter_words(path), trainer=trainer)
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B </s>",
+        special_tokens=[("<s>", tokenizer.token_to_id("<s>")), ("</s>", tokenizer.token_to_id("</s>"))],
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token="<s>",
+        eos_token="</s>",
+        sep_token="</s>",
+        cls_token="<s>",
+        unk_token="<unk>",
+        pad_token="<pad>",
+        mask_token="<mask>",
+        model_max_length=512,
+    )
+
+
+def tiny_model(tokenizer, num_labels, hidden_size=128, num_layers=2, num_heads=2, seed=0):
+    """Return a randomly initialized CamemBERT token classifier in eval mode."""
+
+    config = CamembertConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        num_hidden_layers=num_layers,
+        num_attention_heads=num_heads,
+        intermediate_size=4 * hidden_size,
+        max_position_embeddings=tokenizer.model_max_length + 2,
+        pad_token_id=tokenizer.pad_token_id,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        num_labels=num_labels,
+    )
+    torch.manual_seed(seed)
+    return CamembertForTokenClassification(config).eval()
@@ -0,0 +1,59 @@
+"""Compare the conversion of a corpus to simpletransformers features by the
+TrainingNERModel of the training script in a single process and in a pool of
+processes.
+"""
+
+import argparse
+import os
+import time
+
+import torch
+from simpletransformers.ner import NERArgs
+
+from readers import read_conll
+from training import TrainingNERModel
+
+
+def convert(model, df, process_count):
+    model.args.process_count = process_count
+    model.args.use_multiprocessing = process_count > 1
+    start = time.perf_counter()
+    dataset = model.load_and_cache_examples(df)
+    return dataset, time.perf_counter() - start
+
+
+def main(path, model_name="camembert-base", process_count=None, max_seq_length=128):
+    process_count = process_count or os.cpu_count() or 1
+    df = read_conll(path)
+    args = NERArgs()
+    args.labels_list = sorted(df["labels"].unique())
+    args.max_seq_length = max_seq_length
+    args.multiprocessing_chunksize = -1  # see training.feature_chunksize
+    args.use_multiprocessing = True
+    args.silent = True
+    model = TrainingNERModel("camembert", model_name, args=args, use_cuda=False)
+    print(f"{df['sentence_id'].nunique()} sentences, {len(df)} words")
+
+    reference, reference_time = convert(model, df, 1)
+    print(f"1 process:    {reference_time:.3f} s")
+    dataset, parallel_time = convert(model, df, process_count)
+    print(f"{process_count} processes: {parallel_time:.3f} s (x{reference_time / parallel_time:.1f})")
+
+    assert all(torch.equal(a, b) for a, b in zip(dataset.tensors, reference.tensors))
+    print("features are identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default="../with_transformers/hipe/train.conll",
+        help="Path to the CoNLL file to convert (default: %(default)s).",
+    )
+    parser.add_argument("-m", "--model-name", default="camembert-base", help="Model whose tokenizer is used (default: %(default)s).")
+    parser.add_argument("-p", "--process-count", type=int, help="Number of processes (default: all CPUs).")
+    parser.add_argument("--max-seq-length", type=int, default=128, help="Maximum number of subword tokens per sentence (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
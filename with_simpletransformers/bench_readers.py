@@ -0,0 +1,80 @@
+"""Compare the streaming columnar CoNLL reader with the previous list-of-lists
+reader in terms of time and peak memory.
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+import pandas as pd
+
+from readers import read_conll
+
+
+def read_conll_lists(path, columns=None):
+    """The previous implementation of `read_conll`, kept as a reference."""
+
+    columns = columns or [0, -1]
+    data = []
+    sent_id = 0
+    with open(path) as input_stream:
+        for line in input_stream:
+            line = line.strip()
+            if not line:
+                sent_id += 1
+                continue
+            parts = line.split("\t")
+            relevant = [parts[column] for column in columns]
+            data.append([sent_id] + relevant)
+    df = pd.DataFrame(data, columns=["sentence_id", "words", "labels"])
+    return data, df
+
+
+def measure(func, path, repeat):
+    """Return the best wall time over `repeat` runs and the peak memory of a
+    single traced run of `func` on `path`.
+    """
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func(path)
+        timings.append(time.perf_counter() - start)
+        del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return min(timings), peak
+
+
+def main(path, repeat=3):
+    readers = [
+        ("lists + DataFrame", read_conll_lists),
+        ("columnar", read_conll),
+        ("columnar + lists", lambda p: read_conll(p, return_data=True)),
+    ]
+    print(f"{'reader':<20} {'time (s)':>10} {'peak (MiB)':>12}")
+    for name, func in readers:
+        best, peak = measure(func, path, repeat)
+        print(f"{name:<20} {best:>10.3f} {peak / 2**20:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default="../with_transformers/hipe/train.conll",
+        help="Path to the CoNLL file to read (default: %(default)s).",
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of timed runs (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
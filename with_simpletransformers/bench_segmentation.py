@@ -0,0 +1,127 @@
+"""Compare the pre- and post-processing of `ner_french_predict.py` with SEM and
+with the regex segmenter of `standoff.py` on a large French text.
+
+The model is left out: tags are given by a stand-in that tags capitalized
+words within sentences as persons, so that both pipelines have entities to
+decode and write. Without a text file, the text is rebuilt from the HIPE
+corpora.
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from ner_french_predict import add_predictions, count_tokens, entities, segment, sem, to_json
+from readers import read_conll, to_sentences
+
+
+NO_SPACE_BEFORE = frozenset(",.;:!?)]»…")
+NO_SPACE_AFTER = frozenset("([«'’")
+
+
+def detokenize(words):
+    parts = []
+    for i, word in enumerate(words):
+        if i and word not in NO_SPACE_BEFORE and words[i - 1][-1] not in NO_SPACE_AFTER:
+            parts.append(" ")
+        parts.append(word)
+    return "".join(parts)
+
+
+def hipe_text(paths, sentences_per_paragraph=10):
+    """Return the sentences of CoNLL files as running text, with a blank line
+    every `sentences_per_paragraph` sentences.
+    """
+
+    sentences = []
+    for path in paths:
+        sentences.extend(to_sentences(read_conll(path))[0])
+    paragraphs = [
+        " ".join(detokenize(words) for words in sentences[i: i + sentences_per_paragraph])
+        for i in range(0, len(sentences), sentences_per_paragraph)
+    ]
+    return "\n\n".join(paragraphs) + "\n"
+
+
+def stand_in_tags(sentences):
+    tagss = []
+    for sentence in sentences:
+        tags = []
+        for i, word in enumerate(sentence):
+            if i and word[:1].isupper():
+                tags.append("I-pers" if tags[-1] != "O" else "B-pers")
+            else:
+                tags.append("O")
+        tagss.append(tags)
+    return tagss
+
+
+def run(text, segmenter_name):
+    """Return the time of every stage of a pipeline on `text` and the number
+    of tokens, sentences and entities it found.
+    """
+
+    start = time.perf_counter()
+    doc, sentences = segment(text, segmenter_name=segmenter_name)
+    segmented = time.perf_counter()
+    tagss = stand_in_tags(sentences)
+    tagged = time.perf_counter()
+    add_predictions(doc, tagss)
+    to_json(doc)
+    end = time.perf_counter()
+    return {
+        "segment": segmented - start,
+        "entities": end - tagged,
+        "total": end - start - (tagged - segmented),
+        "n_tokens": count_tokens(doc),
+        "n_sentences": len(sentences),
+        "n_entities": len(entities(doc)),
+    }
+
+
+def main(path=None, copies=1, repeat=3):
+    if path:
+        with open(path, encoding="utf-8") as input_stream:
+            text = input_stream.read()
+    else:
+        hipe = "../with_transformers/hipe"
+        text = hipe_text([f"{hipe}/train.conll", f"{hipe}/dev.conll", f"{hipe}/test.conll"])
+    text *= copies
+    print(f"{len(text)} characters")
+
+    segmenters = ["regex"] if sem is None else ["sem", "regex"]
+    if sem is None:
+        print("SEM is not installed, only the regex segmenter is measured")
+    print(
+        f"{'segmenter':<10} {'segment (s)':>12} {'entities (s)':>13} {'total (s)':>10}"
+        f" {'tokens/s':>10} {'peak (MiB)':>11} {'tokens':>9} {'sentences':>10} {'entities':>9}"
+    )
+    for segmenter_name in segmenters:
+        runs = []
+        for _ in range(repeat):
+            gc.collect()
+            runs.append(run(text, segmenter_name))
+        best = {key: min(result[key] for result in runs) for key in ("segment", "entities", "total")}
+
+        gc.collect()
+        tracemalloc.start()
+        result = run(text, segmenter_name)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"{segmenter_name:<10} {best['segment']:>12.3f} {best['entities']:>13.3f} {best['total']:>10.3f}"
+            f" {result['n_tokens'] / best['total']:>10.0f} {peak / 2**20:>11.1f} {result['n_tokens']:>9}"
+            f" {result['n_sentences']:>10} {result['n_entities']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", nargs="?", help="Path to a French text file (default: the text of the HIPE corpora).")
+    parser.add_argument("-c", "--copies", type=int, default=1, help="Number of times the text is repeated (default: %(default)s).")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of timed runs, the best is kept (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
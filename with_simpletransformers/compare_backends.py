@@ -0,0 +1,82 @@
+"""Compare the accuracy and speed of inference backends on a CoNLL file.
+
+Each model is applied to the sentences of the file and scored with the
+precision, recall and F1-score of seqeval, the metrics `evaluate` reports.
+"""
+
+import argparse
+import json
+import time
+
+from ner_french_predict import load_model, predict_tags
+from readers import read_data, to_sentences
+from scorer import score_tags
+
+
+def run(model, sentences, labels, batch_size):
+    start = time.perf_counter()
+    tagss = predict_tags(model, sentences, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    # words beyond max_seq_length get no prediction, count them as "O"
+    tagss = [tags + ["O"] * (len(gold) - len(tags)) for tags, gold in zip(tagss, labels)]
+    n_tokens = sum(len(sentence) for sentence in sentences)
+    scores = score_tags(labels, tagss)
+    return {
+        "precision": scores["overall_precision"],
+        "recall": scores["overall_recall"],
+        "f1_score": scores["overall_f1"],
+        "seconds": elapsed,
+        "tokens_per_second": n_tokens / elapsed,
+    }
+
+
+def main(model_path, eval_path, int8_path=None, onnx_path=None, data_format="conll", batch_size=64, output=None):
+    df = read_data(eval_path, data_format)
+    sentences, labels = to_sentences(df)
+
+    runs = [("torch", model_path, "torch"), ("int8", int8_path or model_path, "int8")]
+    if onnx_path:
+        runs += [("onnx", onnx_path, "onnx"), ("onnx-int8", onnx_path, "onnx-int8")]
+
+    results = {}
+    for name, path, backend in runs:
+        start = time.perf_counter()
+        model = load_model(path, backend=backend)
+        load_time = time.perf_counter() - start
+        results[name] = run(model, sentences, labels, batch_size)
+        results[name]["load_seconds"] = load_time
+        del model
+
+    reference = results["torch"]
+    print(f"{'backend':<10} {'P':>6} {'R':>6} {'F':>6} {'dF':>6} {'tokens/s':>10} {'speedup':>8} {'load (s)':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<10}"
+            f" {result['precision'] * 100:>6.2f}"
+            f" {result['recall'] * 100:>6.2f}"
+            f" {result['f1_score'] * 100:>6.2f}"
+            f" {(result['f1_score'] - reference['f1_score']) * 100:>+6.2f}"
+            f" {result['tokens_per_second']:>10.1f}"
+            f" {reference['seconds'] / result['seconds']:>7.2f}x"
+            f" {result['load_seconds']:>9.1f}"
+        )
+
+    if output:
+        with open(output, "w", encoding="utf-8") as output_stream:
+            json.dump(results, output_stream, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("model_path", help="Path to the trained (fp32) model folder.")
+    parser.add_argument(
+        "eval_path", nargs="?", default="../with_transformers/hipe/dev.conll", help="Path to the evaluation file (default: %(default)s)."
+    )
+    parser.add_argument("--int8-path", help="Model exported with 'export_model.py --to int8' (default: quantize model_path when loading).")
+    parser.add_argument("--onnx-path", help="Model exported with 'export_model.py --to onnx', ONNX backends are skipped if not given.")
+    parser.add_argument("-f", "--data-format", choices=("conll", "presto"), default="conll", help="Format of the data (default: %(default)s).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Number of sentences given to the model at once (default: %(default)s).")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    main(**vars(args))
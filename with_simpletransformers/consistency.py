@@ -0,0 +1,181 @@
+"""Document-level label consistency: an entity predicted once in a document is
+also tagged where the model missed it.
+
+The surface forms (sequences of words) of the entities predicted in a document
+are put in an Aho-Corasick automaton, which finds all their occurrences in a
+single scan of the words of the document. Occurrences whose words are all
+tagged O are then tagged with the type of their form, the longest occurrence
+winning when several overlap (and the leftmost one between occurrences of the
+same length). pyahocorasick is used when it is installed, otherwise an
+automaton over words written in Python.
+
+To share the forms of several documents, give their sentences at once: no
+occurrence spans two sentences.
+"""
+
+import collections
+
+import numpy as np
+
+try:
+    import ahocorasick
+except ImportError:  # the Python automaton is used
+    ahocorasick = None
+
+import standoff
+
+
+# how the type of a form predicted with several types is chosen
+RESOLUTIONS = ("majority", "first", "unambiguous")
+
+SEPARATOR = "\x1f"
+
+
+class WordAutomaton:
+    """Aho-Corasick automaton over the words of a list of `forms`, each a
+    tuple of words.
+    """
+
+    def __init__(self, forms):
+        self.goto = [{}]
+        self.outputs = [[]]  # indices of the forms ending in every state
+        for index, form in enumerate(forms):
+            state = 0
+            for word in form:
+                next_state = self.goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][word] = next_state
+                    self.goto.append({})
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append(index)
+
+        # failure links, breadth first: the state of the longest proper
+        # suffix of every state that is also a prefix of a form
+        self.fail = [0] * len(self.goto)
+        queue = collections.deque([0])
+        while queue:
+            state = queue.popleft()
+            for word, child in self.goto[state].items():
+                queue.append(child)
+                if state:
+                    fallback = self.fail[state]
+                    while fallback and word not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[child] = self.goto[fallback].get(word, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def iter(self, words):
+        """Yield the (end, form index) of every occurrence of a form in
+        `words`, `end` being the index after its last word.
+        """
+
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        state = 0
+        for end, word in enumerate(words, 1):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for index in outputs[state]:
+                yield end, index
+
+
+def find_occurrences(forms, words):
+    """Return the start, end and form index of every occurrence of `forms` in
+    `words`, as arrays.
+    """
+
+    if not forms or not words:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    lengths = np.array([len(form) for form in forms], dtype=np.int64)
+    if ahocorasick is None:
+        matches = list(WordAutomaton(forms).iter(words))
+        ends, indices = np.array(matches, dtype=np.int64).reshape(-1, 2).T
+        return ends - lengths[indices], ends, indices
+
+    # forms and words are joined by a separator, also around every form, so
+    # that occurrences start and end on word boundaries
+    automaton = ahocorasick.Automaton()
+    for index, form in enumerate(forms):
+        automaton.add_word(SEPARATOR + SEPARATOR.join(form) + SEPARATOR, index)
+    automaton.make_automaton()
+    text = SEPARATOR + SEPARATOR.join(words) + SEPARATOR
+    separators = np.cumsum([0] + [len(word) + 1 for word in words])
+    matches = np.fromiter(
+        (value for end, index in automaton.iter(text) for value in (end, index)), dtype=np.int64
+    ).reshape(-1, 2)
+    ends = np.searchsorted(separators, matches[:, 0])
+    return ends - lengths[matches[:, 1]], ends, matches[:, 1]
+
+
+def resolve_types(forms, types, resolution="majority"):
+    """Return the forms to propagate and their type given the `types` of the
+    entities of every form, in order: the most frequent one ("majority"), the
+    first one ("first"), or the only one, forms predicted with several types
+    being left out ("unambiguous").
+    """
+
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"unknown resolution {resolution}, expected one of {RESOLUTIONS}")
+    form_types = {}
+    for form, entity_type in zip(forms, types):
+        form_types.setdefault(form, []).append(entity_type)
+    resolved = {}
+    for form, candidates in form_types.items():
+        if resolution == "first":
+            resolved[form] = candidates[0]
+        elif resolution == "majority":
+            # ties go to the type predicted first
+            resolved[form] = max(candidates, key=collections.Counter(candidates).__getitem__)
+        elif len(set(candidates)) == 1:
+            resolved[form] = candidates[0]
+    return resolved
+
+
+def propagate(sentences, tagss, resolution="majority"):
+    """Return the tags of every sentence, where occurrences of the predicted
+    entities of `sentences` that the model left untagged are tagged, and the
+    number of entities added.
+
+    Forms without any capital letter or digit (e.g. a common noun tagged
+    once) are not propagated, and neither is any form whose words are not
+    all tagged O.
+    """
+
+    words = [word for sentence in sentences for word in sentence]
+    tags = [tag for sentence_tags in tagss for tag in sentence_tags]
+    bounds = np.cumsum([0] + [len(sentence) for sentence in sentences])
+    first, last, types = standoff.decode_entities(tags, bounds)
+    forms = [tuple(words[start: end + 1]) for start, end in zip(first.tolist(), last.tolist())]
+    resolved = resolve_types(forms, types.tolist(), resolution=resolution)
+    resolved = {
+        form: entity_type
+        for form, entity_type in resolved.items()
+        if any(character.isupper() or character.isdigit() for word in form for character in word)
+    }
+    forms = list(resolved)
+    starts, ends, indices = find_occurrences(forms, words)
+
+    # occurrences within a sentence, on words tagged O
+    tagged = np.cumsum([0] + [tag != "O" for tag in tags])
+    sentence_of = np.repeat(np.arange(len(sentences)), np.diff(bounds))
+    keep = (tagged[ends] == tagged[starts]) & (sentence_of[starts] == sentence_of[ends - 1])
+    starts, ends, indices = starts[keep], ends[keep], indices[keep]
+
+    # the longest and then leftmost occurrences win
+    order = np.lexsort((starts, starts - ends))
+    beginning = "B-" if any(tag.startswith("B-") for tag in tags) else "I-"
+    added = 0
+    covered = np.zeros(len(words), dtype=bool)
+    for start, end, index in zip(starts[order].tolist(), ends[order].tolist(), indices[order].tolist()):
+        if covered[start: end].any():
+            continue
+        entity_type = resolved[forms[index]]
+        tags[start: end] = [beginning + entity_type] + ["I-" + entity_type] * (end - start - 1)
+        covered[start: end] = True
+        added += 1
+
+    bounds = bounds.tolist()
+    return [tags[start: end] for start, end in zip(bounds[:-1], bounds[1:])], added
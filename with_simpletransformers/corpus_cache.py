@@ -0,0 +1,143 @@
+"""On-disk cache of parsed corpora.
+
+A parsed corpus is stored as a directory of `.npy` arrays (sentence ids, word
+codes and label codes) along with a `meta.json` file holding the word
+vocabulary, the label set and the signature of the source file. Arrays are
+loaded memory-mapped on a cache hit.
+
+Entries are keyed on the absolute path of the corpus, its format and the
+selected columns. An entry is valid as long as the size and modification time
+of the file are unchanged or, failing that, as long as its content hash is.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+
+
+ARRAYS = ("sentence_ids", "word_codes", "label_codes")
+META_KEYS = {"signature", "digest", "vocabulary", "labels"}
+FORMAT_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the SHA-1 hex digest of the content of the file at `path`."""
+
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as input_stream:
+        for chunk in iter(lambda: input_stream.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def cache_key(path, data_format, columns=None):
+    """Return the name of the cache entry for a corpus read with the given
+    format and columns.
+    """
+
+    description = [
+        str(pathlib.Path(path).resolve()),
+        data_format.lower(),
+        list(columns or [0, -1]),
+        FORMAT_VERSION,
+    ]
+    return hashlib.sha1(json.dumps(description).encode("utf-8")).hexdigest()
+
+
+def stat_signature(path):
+    """Return the size and modification time of a file."""
+
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load(cache_dir, key, path):
+    """Return the cached columns of the corpus at `path`, or None if there is
+    no valid entry for it.
+    """
+
+    entry = pathlib.Path(cache_dir) / key
+    try:
+        with open(entry / "meta.json", encoding="utf-8") as input_stream:
+            meta = json.load(input_stream)
+    except (OSError, ValueError):
+        return None
+    # a truncated meta.json or one written by an older version is a miss
+    if not isinstance(meta, dict) or not META_KEYS <= meta.keys():
+        return None
+
+    signature = stat_signature(path)
+    if signature != meta["signature"]:
+        if file_digest(path) != meta["digest"]:
+            return None
+        # same content, only the file metadata changed (e.g. a fresh copy)
+        meta["signature"] = signature
+        try:
+            _write_meta(entry, meta)
+        except OSError:  # read-only cache, or the entry was replaced meanwhile
+            pass
+
+    try:
+        columns = {name: np.load(entry / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+    except (OSError, ValueError):  # the entry was replaced meanwhile
+        return None
+    columns["vocabulary"] = meta["vocabulary"]
+    columns["labels"] = meta["labels"]
+    return columns
+
+
+def save(cache_dir, key, path, columns):
+    """Store the columns of the corpus at `path` in the cache. The entry is
+    written in a temporary directory first so that concurrent runs never see a
+    partial entry; if another run writes the same entry meanwhile, its entry
+    is kept.
+    """
+
+    cache_dir = pathlib.Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "path": str(pathlib.Path(path).resolve()),
+        "signature": stat_signature(path),
+        "digest": file_digest(path),
+        "vocabulary": list(columns["vocabulary"]),
+        "labels": list(columns["labels"]),
+    }
+
+    tmp_entry = pathlib.Path(tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}-"))
+    try:
+        for name in ARRAYS:
+            np.save(tmp_entry / f"{name}.npy", np.asarray(columns[name], dtype=np.int32))
+        _write_meta(tmp_entry, meta)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        raise
+
+    # an outdated entry is moved aside first, as a directory cannot be
+    # renamed over a non-empty one
+    entry = cache_dir / key
+    stale_entry = tmp_entry.with_name(tmp_entry.name + ".stale")
+    try:
+        try:
+            os.rename(entry, stale_entry)
+        except FileNotFoundError:  # no entry, or another run moved it aside
+            pass
+        os.replace(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        if not entry.exists():
+            raise
+        # another run wrote the entry in the meantime
+    finally:
+        shutil.rmtree(stale_entry, ignore_errors=True)
+
+
+def _write_meta(entry, meta):
+    tmp_path = entry / f"meta.json.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as output_stream:
+        json.dump(meta, output_stream, ensure_ascii=False)
+    os.replace(tmp_path, entry / "meta.json")
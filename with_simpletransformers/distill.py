@@ -0,0 +1,302 @@
+"""Distill a trained NER model (e.g. the `best_model` folder written by
+`named_entity_recognition_french.py`) into a smaller CamemBERT for faster CPU
+inference.
+
+The student has fewer layers and, optionally, a smaller hidden size. With the
+hidden size of the teacher, it starts from the embeddings, the classifier and
+evenly spaced layers of the teacher; otherwise it starts from random weights.
+It learns the output distribution of the teacher (its logits softened by a
+temperature) on the first subword of every word of the training data and of
+unlabelled text files, segmented with `standoff.py`, along with the gold labels
+of the training data. The student is saved with the tokenizer and the model
+args of the teacher, so that `ner_french_predict.py` loads it like the teacher.
+Both models are then compared on a CoNLL file: F1-score against the gold labels
+and against the predictions of the teacher, and speed.
+"""
+
+import argparse
+import copy
+import math
+import os
+import pathlib
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import TensorDataset
+from transformers import get_linear_schedule_with_warmup
+
+import standoff
+from ner_french_predict import load_model, predict_tags
+from readers import read_data, to_sentences
+from training import CountingDataLoader, PaddingTrimmer, split_long_sentences
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "with_transformers"))
+
+from batching import BatchStats, LengthBucketBatchSampler  # noqa: E402
+from scorer import score_tags  # noqa: E402
+
+
+HIPE = pathlib.Path(__file__).resolve().parent.parent / "with_transformers" / "hipe"
+
+
+def make_student(teacher, num_layers=4, hidden_size=None):
+    """Return a copy of the token classifier `teacher` with `num_layers`
+    layers. With the hidden size of the teacher, the student gets its weights
+    and those of evenly spaced layers of the teacher, from the first to the
+    last one; with another `hidden_size`, it is randomly initialized.
+    """
+
+    config = copy.deepcopy(teacher.config)
+    config.num_hidden_layers = num_layers
+    if hidden_size and hidden_size != teacher.config.hidden_size:
+        config.hidden_size = hidden_size
+        config.intermediate_size = 4 * hidden_size
+        config.num_attention_heads = max(1, hidden_size // 64)
+        return type(teacher)(config)
+
+    student = type(teacher)(config)
+    layers = np.linspace(0, teacher.config.num_hidden_layers - 1, num_layers).round().astype(int)
+    teacher_state = teacher.state_dict()
+    state = {
+        key: teacher_state[re.sub(r"\.layer\.(\d+)\.", lambda match: f".layer.{layers[int(match.group(1))]}.", key, count=1)]
+        for key in student.state_dict()
+    }
+    student.load_state_dict(state)
+    print(f"student initialized from layers {layers.tolist()} of the teacher")
+    return student
+
+
+def read_texts(paths, sentence_offset=0):
+    """Return the sentences of text files, segmented by the regex segmenter,
+    as a simpletransformers DataFrame. Words are labelled "O", a label of the
+    teacher, for the conversion to features; these labels are not trained on.
+    """
+
+    rows = []
+    sentence_id = sentence_offset
+    for path in paths:
+        with open(path, encoding="utf-8") as input_stream:
+            doc = standoff.Document(str(path), input_stream.read())
+        for sentence in doc.sentences():
+            rows.extend((sentence_id, word, "O") for word in sentence)
+            sentence_id += 1
+    return pd.DataFrame(rows, columns=["sentence_id", "words", "labels"])
+
+
+def features(teacher, df, labelled=True):
+    """Return the features of a DataFrame as simpletransformers converts them
+    for the teacher (input ids, input mask, segment ids, label ids), and the
+    mask of the first subword of every word. Labels of unlabelled data are
+    set to -100, so that they are ignored by the loss.
+    """
+
+    df = split_long_sentences(df, teacher.tokenizer, teacher.args.max_seq_length)
+    # in memory only: the features depend on the teacher and the text
+    input_ids, input_mask, segment_ids, label_ids = teacher.load_and_cache_examples(df, no_cache=True).tensors
+    first = label_ids != teacher.pad_token_label_id
+    if not labelled:
+        label_ids = torch.full_like(label_ids, teacher.pad_token_label_id)
+    return [input_ids, input_mask, segment_ids, label_ids, first]
+
+
+@torch.no_grad()
+def teacher_logits(teacher, tensors, batch_size=64):
+    """Return the logits of the teacher for every position of the features,
+    in float16.
+    """
+
+    input_ids, input_mask = tensors[:2]
+    logits = torch.zeros(*input_ids.shape, len(teacher.args.labels_list), dtype=torch.float16)
+    network = teacher.model.eval()
+    sampler = LengthBucketBatchSampler(input_mask.sum(dim=1).numpy(), batch_size=batch_size, shuffle=False)
+    for indices in sampler:
+        length = int(input_mask[indices].sum(dim=1).max())
+        outputs = network(
+            input_ids=input_ids[indices, :length].to(teacher.device),
+            attention_mask=input_mask[indices, :length].to(teacher.device),
+        )
+        logits[indices, :length] = outputs.logits.cpu().half()
+    return logits
+
+
+def distillation_loss(logits, teacher_logits, label_ids, first, temperature=2.0, alpha=0.5):
+    """Return the mix of the KL divergence between the softened outputs of the
+    teacher and of the student on first subwords (weight `alpha`) and of the
+    cross-entropy with the gold labels (weight `1 - alpha`).
+    """
+
+    student_log_probs = torch.log_softmax(logits[first] / temperature, dim=-1)
+    teacher_probs = torch.softmax(teacher_logits[first].float() / temperature, dim=-1)
+    # scaled by T^2 so that gradients keep their magnitude (Hinton et al.)
+    loss = alpha * temperature ** 2 * torch.nn.functional.kl_div(student_log_probs, teacher_probs, reduction="batchmean")
+    if alpha < 1 and (label_ids != -100).any():
+        loss = loss + (1 - alpha) * torch.nn.functional.cross_entropy(
+            logits.reshape(-1, logits.shape[-1]), label_ids.reshape(-1)
+        )
+    return loss
+
+
+def train_student(
+    student,
+    dataset,
+    epochs=3,
+    batch_size=32,
+    learning_rate=1e-4,
+    warmup_ratio=0.06,
+    temperature=2.0,
+    alpha=0.5,
+    seed=0,
+    logging_steps=50,
+):
+    """Train `student` on a TensorDataset of features, first subword masks
+    and teacher logits, with length-bucketed batches. Return the number of
+    optimizer steps.
+    """
+
+    lengths = dataset.tensors[1].sum(dim=1).numpy()
+    batch_sampler = LengthBucketBatchSampler(lengths, batch_size=batch_size, seed=seed)
+    stats = BatchStats()
+    loader = CountingDataLoader(dataset, batch_sampler=batch_sampler, collate_fn=PaddingTrimmer(), stats=stats)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate)
+    t_total = len(loader) * epochs
+    scheduler = get_linear_schedule_with_warmup(optimizer, math.ceil(t_total * warmup_ratio), t_total)
+
+    student.train()
+    device = next(student.parameters()).device
+    step = 0
+    total = 0.0
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        for input_ids, input_mask, _, label_ids, first, logits in loader:
+            outputs = student(input_ids=input_ids.to(device), attention_mask=input_mask.to(device))
+            loss = distillation_loss(
+                outputs.logits, logits.to(device), label_ids.to(device), first.to(device), temperature, alpha
+            )
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(student.parameters(), 1.0)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            step += 1
+            total += loss.item()
+            if logging_steps > 0 and step % logging_steps == 0:
+                print(
+                    f"epoch {epoch + 1}, step {step}/{t_total}: loss={total / logging_steps:.4f},"
+                    f" {stats.n_tokens / (time.perf_counter() - start):.0f} tokens/s",
+                    flush=True,
+                )
+                total = 0.0
+    student.eval()
+    return step
+
+
+def compare(teacher, student, eval_path, data_format="conll", batch_size=64):
+    """Print the F1-scores of the teacher and the student on `eval_path`, the
+    agreement of the student with the teacher and their speeds. Return the
+    results.
+    """
+
+    df = read_data(eval_path, data_format)
+    sentences, labels = to_sentences(df)
+    n_tokens = sum(len(sentence) for sentence in sentences)
+
+    results = {}
+    predictions = {}
+    for name, model in (("teacher", teacher), ("student", student)):
+        start = time.perf_counter()
+        predictions[name] = predict_tags(model, sentences, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "f1_score": score_tags(labels, predictions[name])["overall_f1"],
+            "agreement": score_tags(predictions["teacher"], predictions[name])["overall_f1"],
+            "parameters": sum(parameter.numel() for parameter in model.model.parameters()),
+            "seconds": elapsed,
+            "tokens_per_second": n_tokens / elapsed,
+        }
+
+    if not any(label != "O" for sentence_labels in labels for label in sentence_labels):
+        print(f"{eval_path} has no gold entities: compare the agreement with the teacher")
+    print(f"{'model':<8} {'F':>6} {'agree':>6} {'params (M)':>11} {'tokens/s':>10} {'speedup':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:<8} {result['f1_score'] * 100:>6.2f} {result['agreement'] * 100:>6.2f}"
+            f" {result['parameters'] / 1e6:>11.1f} {result['tokens_per_second']:>10.1f}"
+            f" {results['teacher']['seconds'] / result['seconds']:>7.2f}x"
+        )
+    return results
+
+
+def main(
+    teacher_path,
+    output_dir,
+    train_path=HIPE / "train.conll",
+    texts=(),
+    eval_path=HIPE / "test.conll",
+    data_format="conll",
+    num_layers=4,
+    hidden_size=None,
+    epochs=3,
+    batch_size=32,
+    learning_rate=1e-4,
+    temperature=2.0,
+    alpha=0.5,
+):
+    torch.manual_seed(0)
+    teacher = load_model(teacher_path)
+
+    print("converting the training data...")
+    tensors = features(teacher, read_data(train_path, data_format))
+    if texts:
+        text_df = read_texts(texts)
+        print(f"{text_df['sentence_id'].nunique()} sentences of unlabelled text")
+        text_tensors = features(teacher, text_df, labelled=False)
+        tensors = [torch.cat(pair) for pair in zip(tensors, text_tensors)]
+    print("computing the logits of the teacher...")
+    start = time.perf_counter()
+    logits = teacher_logits(teacher, tensors)
+    print(f"{len(logits)} sentences in {time.perf_counter() - start:.1f} s")
+
+    student = make_student(teacher.model, num_layers=num_layers, hidden_size=hidden_size).to(teacher.device)
+    train_student(
+        student,
+        TensorDataset(*tensors, logits),
+        epochs=epochs,
+        batch_size=batch_size,
+        learning_rate=learning_rate,
+        temperature=temperature,
+        alpha=alpha,
+    )
+
+    # the folder of a model as simpletransformers saves it (see export_model.py)
+    os.makedirs(output_dir, exist_ok=True)
+    student.save_pretrained(output_dir)
+    teacher.tokenizer.save_pretrained(output_dir)
+    teacher._save_model_args(output_dir)
+    print(f"student saved to {output_dir}")
+
+    if eval_path:
+        compare(teacher, load_model(output_dir), eval_path, data_format=data_format)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("teacher_path", help="Path to the trained model folder, e.g. outputs/best_model.")
+    parser.add_argument("output_dir", help="Folder where the student is saved.")
+    parser.add_argument("--train", dest="train_path", default=HIPE / "train.conll", help="Labelled training data (default: HIPE train).")
+    parser.add_argument("--texts", nargs="+", default=(), help="Unlabelled text files, annotated by the teacher only.")
+    parser.add_argument("--eval", dest="eval_path", default=HIPE / "test.conll", help="CoNLL file on which the teacher and the student are compared, empty to skip (default: HIPE test).")
+    parser.add_argument("-f", "--data-format", choices=("conll", "presto"), default="conll", help="Format of the labelled data (default: %(default)s).")
+    parser.add_argument("-l", "--num-layers", type=int, default=4, help="Number of layers of the student (default: %(default)s).")
+    parser.add_argument("--hidden-size", type=int, help="Hidden size of the student, randomly initialized if it differs from the teacher's (default: the teacher's).")
+    parser.add_argument("-e", "--epochs", type=int, default=3, help="Number of training epochs (default: %(default)s).")
+    parser.add_argument("--batch-size", type=int, default=32, help="Number of sentences per batch (default: %(default)s).")
+    parser.add_argument("--learning-rate", type=float, default=1e-4, help="Peak learning rate (default: %(default)s).")
+    parser.add_argument("-T", "--temperature", type=float, default=2.0, help="Temperature softening the outputs of both models (default: %(default)s).")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weight of the distillation loss, the gold labels getting 1 - alpha (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,264 @@
+"""Data parallel training of a TrainingNERModel on CPU, with torch
+DistributedDataParallel and the gloo backend.
+
+simpletransformers trains in a single process, which uses only part of a
+multi-core machine. Here, `launch` starts `num_procs` processes per node (on
+one or several nodes of a local network); the long sentences of the training
+DataFrame are cut into windows once per node, then every process converts and
+trains on its own shard of it, and gradients are all-reduced after every
+backward pass. With a per-process batch size of `train_batch_size /
+world_size`, an optimizer step sees as many sentences as a single-process step
+with a batch of `train_batch_size`, with the same learning rate schedule; only
+the loss normalization differs slightly, as every process averages the loss
+over its own tokens. Only the default optimizer and scheduler of
+simpletransformers (AdamW and a linear schedule with warmup) are supported.
+
+The first process saves the trained model to `output_dir`.
+"""
+
+import contextlib
+import json
+import math
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import RandomSampler
+
+from simpletransformers.ner import NERArgs
+from transformers import AutoTokenizer, get_linear_schedule_with_warmup
+
+from training import CountingDataLoader, PaddingTrimmer, TrainingNERModel, patched, split_long_sentences
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "with_transformers"))
+
+from batching import LengthBucketBatchSampler  # noqa: E402
+from profiling import Profiler  # noqa: E402
+
+
+DISTRIBUTED_BATCHING = ("random", "bucket")
+
+
+def shard_sentences(df, rank, world_size, seed=0):
+    """Return the sentences of a simpletransformers DataFrame given to process
+    `rank` out of `world_size`. Sentences are shuffled with `seed` and dealt to
+    processes; the first ones are repeated so that all processes get as many
+    sentences, hence as many batches. Sentences are renumbered from 0.
+    """
+
+    sentence_ids = df["sentence_id"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, sentence_ids[1:] != sentence_ids[:-1]])
+    ends = np.r_[starts[1:], len(sentence_ids)]
+    order = np.random.default_rng(seed).permutation(len(starts))
+    order = np.resize(order, math.ceil(len(order) / world_size) * world_size)
+    shard = order[rank::world_size]
+
+    lengths = ends[shard] - starts[shard]
+    rows = np.repeat(starts[shard] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    part = df.iloc[rows].reset_index(drop=True)
+    part["sentence_id"] = np.repeat(np.arange(len(shard), dtype=np.int32), lengths)
+    return part
+
+
+def _dataloader(model, dataset, batch_size, epoch):
+    seed = (model.args.manual_seed or 0) + epoch
+    if model.batching == "random":
+        generator = torch.Generator().manual_seed(seed)
+        return CountingDataLoader(
+            dataset,
+            sampler=RandomSampler(dataset, generator=generator),
+            batch_size=batch_size,
+            collate_fn=PaddingTrimmer(trim=False),
+            stats=model.batch_stats,
+        )
+    batch_sampler = LengthBucketBatchSampler(dataset.tensors[1].sum(dim=1).numpy(), batch_size=batch_size, seed=seed)
+    return CountingDataLoader(dataset, batch_sampler=batch_sampler, collate_fn=PaddingTrimmer(), stats=model.batch_stats)
+
+
+def _log(rank, world_size, step, counts, elapsed):
+    """All-reduce the samples, tokens, loss and batches counted since the
+    last log and print the throughput from the first process.
+    """
+
+    totals = torch.tensor(counts, dtype=torch.float64)
+    dist.all_reduce(totals)
+    samples, tokens, loss, batches = totals.tolist()
+    if rank == 0:
+        print(
+            f"step {step}: loss={loss / max(batches, 1):.4f}, {samples / elapsed:.1f} samples/s"
+            f" ({samples / elapsed / world_size:.1f} per process), {tokens / elapsed:.0f} tokens/s",
+            flush=True,
+        )
+    return samples
+
+
+def check_args(args):
+    """Raise a ValueError if the NERArgs `args` ask for an optimizer, a
+    scheduler or parameter groups other than the defaults of
+    simpletransformers (AdamW and a linear schedule with warmup), the only
+    ones reproduced by `train`.
+    """
+
+    defaults = NERArgs()
+    for name in ("optimizer", "scheduler", "custom_parameter_groups", "custom_layer_parameters", "train_custom_parameters_only"):
+        if getattr(args, name) != getattr(defaults, name):
+            raise ValueError(f"{name}={getattr(args, name)!r} is not supported with several processes")
+
+
+def train(model, shard, rank, world_size, weight=None, profiler=None):
+    """Train `model` (a TrainingNERModel) on `shard`, the sentences of
+    process `rank` (see `shard_sentences`), within an initialized gloo process
+    group. Return the number of optimizer steps.
+    """
+
+    args = model.args
+    if args.train_batch_size % world_size:
+        raise ValueError(f"train_batch_size ({args.train_batch_size}) is not a multiple of the number of processes ({world_size})")
+    batch_size = args.train_batch_size // world_size
+
+    # processes already convert their shards in parallel
+    with patched(args, "use_multiprocessing", False):
+        dataset = model.load_and_cache_examples(shard)
+
+    network = model.model
+    network.train()
+    ddp = DistributedDataParallel(network)
+    no_decay = ("bias", "LayerNorm.weight")
+    optimizer = torch.optim.AdamW(
+        [
+            {"params": [p for n, p in network.named_parameters() if not any(nd in n for nd in no_decay)], "weight_decay": args.weight_decay},
+            {"params": [p for n, p in network.named_parameters() if any(nd in n for nd in no_decay)], "weight_decay": 0.0},
+        ],
+        lr=args.learning_rate,
+        eps=args.adam_epsilon,
+        betas=args.adam_betas,
+    )
+    steps_per_epoch = math.ceil(len(_dataloader(model, dataset, batch_size, 0)) / args.gradient_accumulation_steps)
+    t_total = steps_per_epoch * args.num_train_epochs
+    warmup_steps = args.warmup_steps or math.ceil(t_total * args.warmup_ratio)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=warmup_steps, num_training_steps=t_total)
+    loss_fct = torch.nn.CrossEntropyLoss(weight=None if weight is None else torch.tensor(weight, dtype=torch.float))
+
+    if rank == 0:
+        print(
+            f"training on {world_size} processes: {len(dataset)} sentences and batches of {batch_size} per process,"
+            f" {t_total} steps, {torch.get_num_threads()} threads per process",
+            flush=True,
+        )
+    if profiler is not None and rank == 0:
+        profiler.instrument(network)
+
+    step = 0
+    counts = [0, 0, 0.0, 0]  # samples, tokens, loss, batches since the last log
+    n_samples = 0
+    start = last_log = time.perf_counter()
+    for epoch in range(int(args.num_train_epochs)):
+        loader = _dataloader(model, dataset, batch_size, epoch)
+        for i, (input_ids, input_mask, _, label_ids) in enumerate(loader):
+            accumulate = (i + 1) % args.gradient_accumulation_steps and i + 1 < len(loader)
+            with ddp.no_sync() if accumulate else contextlib.nullcontext():
+                logits = ddp(input_ids=input_ids, attention_mask=input_mask).logits
+                loss = loss_fct(logits.view(-1, logits.shape[-1]), label_ids.reshape(-1))
+                (loss / args.gradient_accumulation_steps).backward()
+            counts[0] += len(input_ids)
+            counts[1] += int(input_mask.sum())
+            counts[2] += loss.item()
+            counts[3] += 1
+            if accumulate:
+                continue
+
+            torch.nn.utils.clip_grad_norm_(network.parameters(), args.max_grad_norm)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            step += 1
+            if args.logging_steps > 0 and step % args.logging_steps == 0:
+                now = time.perf_counter()
+                n_samples += _log(rank, world_size, step, counts, now - last_log)
+                counts = [0, 0, 0.0, 0]
+                last_log = now
+
+    now = time.perf_counter()
+    if counts[3]:  # the same on all processes, which have as many batches
+        n_samples += _log(rank, world_size, step, counts, now - last_log)
+    if profiler is not None and rank == 0:
+        profiler.release()
+    if rank == 0:
+        elapsed = now - start
+        print(
+            f"trained in {elapsed:.1f} s: {n_samples / elapsed:.1f} samples/s,"
+            f" {n_samples / elapsed / world_size:.1f} per process",
+            flush=True,
+        )
+    network.eval()
+    return step
+
+
+def _worker(local_rank, num_procs, nnodes, node_rank, master_addr, master_port, shard_dir, model_kwargs, profiler, profile_path):
+    rank = node_rank * num_procs + local_rank
+    shard = pd.read_pickle(os.path.join(shard_dir, f"shard-{rank}.pkl"))
+    world_size = nnodes * num_procs
+    dist.init_process_group("gloo", init_method=f"tcp://{master_addr}:{master_port}", rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_procs))
+    profiler = profiler if rank == 0 else None
+    try:
+        torch.manual_seed(model_kwargs["args"].manual_seed or 0)
+        model = TrainingNERModel(**model_kwargs, use_cuda=False, profiler=profiler)
+        train(model, shard, rank, world_size, weight=model_kwargs.get("weight"), profiler=profiler)
+        if rank == 0:
+            model.save_model(model=model.model)
+            if profiler is not None:
+                with open(profile_path, "w", encoding="utf-8") as output_stream:
+                    json.dump(profiler.state(), output_stream)
+        dist.barrier()
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(train_df, model_kwargs, num_procs, nnodes=1, node_rank=0, master_addr="127.0.0.1", master_port=29500, profiler=None):
+    """Train a TrainingNERModel built from `model_kwargs` on `train_df` with
+    `num_procs` processes on this node, out of `nnodes` nodes. Every node runs
+    this function with its `node_rank`; `master_addr` and `master_port` are the
+    address of node 0 and a free port on it. The model is saved to the
+    `output_dir` of its args by the first process of node 0.
+
+    Given a `Profiler`, the stages recorded by the first process (the
+    conversion of its shard and its training) are added to it.
+    """
+
+    if model_kwargs.get("batching", "random") not in DISTRIBUTED_BATCHING:
+        raise ValueError(f"batching must be one of {DISTRIBUTED_BATCHING} with several processes")
+    args = model_kwargs["args"]
+    check_args(args)
+    world_size = nnodes * num_procs
+
+    # long sentences are cut once per node, every process then reads its own
+    # shard from a file
+    tokenizer = AutoTokenizer.from_pretrained(model_kwargs["model_name"], use_fast=False, do_lower_case=args.do_lower_case)
+    train_df = split_long_sentences(train_df, tokenizer, args.max_seq_length, model_kwargs.get("window_overlap", 0))
+    # processes get a copy of the profiler, the first one writes what it
+    # recorded to a file
+    worker_profiler = None if profiler is None else Profiler(profiler.trace_dir, profiler.trace_schedule)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rank in range(node_rank * num_procs, (node_rank + 1) * num_procs):
+            shard = shard_sentences(train_df, rank, world_size, seed=args.manual_seed or 0)
+            shard.to_pickle(os.path.join(tmp_dir, f"shard-{rank}.pkl"))
+        del train_df
+        profile_path = os.path.join(tmp_dir, "profile.json")
+        mp.spawn(
+            _worker,
+            args=(num_procs, nnodes, node_rank, master_addr, master_port, tmp_dir, model_kwargs, worker_profiler, profile_path),
+            nprocs=num_procs,
+            join=True,
+        )
+        if profiler is not None and os.path.exists(profile_path):  # on node 0
+            with open(profile_path, encoding="utf-8") as input_stream:
+                profiler.merge(json.load(input_stream))
@@ -0,0 +1,62 @@
+"""Export a trained simpletransformers NER model (e.g. the `best_model` folder
+written by `named_entity_recognition_french.py`) for faster CPU inference.
+
+Two exports are available:
+- int8: linear layers are dynamically quantized to int8 and the quantized
+  weights are saved, to be loaded with the "int8" backend;
+- onnx: the model is converted to ONNX, to be run by ONNX Runtime with the
+  "onnx" or "onnx-int8" backends.
+"""
+
+import argparse
+import os
+import pathlib
+
+import torch
+
+from simpletransformers.ner import NERModel
+
+
+def export_int8(model_path, output_dir):
+    """Save the dynamically int8-quantized version of a model in `output_dir`.
+    simpletransformers reloads it when `quantized_model` is set in its args.
+    """
+
+    model = NERModel("camembert", model_path, args={"dynamic_quantize": True}, use_cuda=False)
+    os.makedirs(output_dir, exist_ok=True)
+    torch.save(model.model.state_dict(), os.path.join(output_dir, "pytorch_model.bin"))
+    model.config.save_pretrained(output_dir)
+    model.tokenizer.save_pretrained(output_dir)
+    model.args.quantized_model = True
+    model.args.dynamic_quantize = True
+    model._save_model_args(output_dir)
+
+
+def export_onnx(model_path, output_dir):
+    """Convert a model to ONNX in `output_dir`, which must be empty."""
+
+    model = NERModel("camembert", model_path, use_cuda=False)
+    model.convert_to_onnx(output_dir)
+
+
+exporters = {
+    "int8": export_int8,
+    "onnx": export_onnx,
+}
+
+
+def main(model_path, output_dir, to=("int8", "onnx")):
+    for name in to:
+        destination = pathlib.Path(output_dir) / name
+        print(f"exporting {name} model to {destination}...")
+        exporters[name](model_path, str(destination))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("model_path", help="Path to the trained model folder.")
+    parser.add_argument("output_dir", help="Folder where exported models are written, one subfolder per export.")
+    parser.add_argument("--to", nargs="+", choices=sorted(exporters), default=["int8", "onnx"], help="Exports to do (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -5,95 +5,61 @@ investigated to use other transformer-based LM.
 """
 
 import argparse
+import os
+import pathlib
 import sys
-import time
 import torch
 import pandas as pd
 
-from simpletransformers.ner import NERModel, NERArgs
+from simpletransformers.ner import NERArgs
 
+import distributed
+from readers import frame_label_counts, read_data, read_label_counts, to_sentences
+from training import BATCHING_MODES, CLASS_WEIGHTING, TrainingNERModel, class_weights, find_checkpoint, sample_sentences
 
-def read_conll(path, columns=None):
-    """Read a CoNLL file with no metadata and returns the corpus represented as
-    a pandas dataFrame. The dataFrame has three columns: sentence_id, words and
-    labels. This is the expected corpus format with simpletransformers.
-    """
-
-    columns = columns or [0, -1]
-    data = []
-    sent_id = 0
-    with open(path) as input_stream:
-        for line in input_stream:
-            line = line.strip()
-            if not line:
-                sent_id += 1
-                continue
-            parts = line.split("\t")
-            relevant = [parts[column] for column in columns]
-            data.append([sent_id] + relevant)
-    df = pd.DataFrame(data, columns=["sentence_id", "words", "labels"])
-    return data, df
-
-
-def read_presto(path, columns=None):
-    """Read a presto file and returns the corpus represented as a pandas
-    dataFrame. The dataFrame has three columns: sentence_id, words and labels.
-    This is the expected corpus format with simpletransformers.
-    """
-
-    fields = ["form", "lemma", "POS", "O", "O", "O", "O", "_"]
-    columns = columns or [0, -1]
-    data = []
-    sent_id = 0
-    prev = None
-    with open(path) as input_stream:
-        for line in input_stream:
-            line = line.strip()
-            parts = line.split("\t")
-            if not line:
-                sent_id += 1
-                prev = line
-                continue
-            elif parts[0].endswith(".tsv") and parts[1] == "xxx":
-                if prev:
-                    sent_id += 1
-                prev = line
-                continue
-            elif parts == fields:
-                prev = line
-                continue
-            relevant = [parts[column] for column in columns]
-            data.append([sent_id] + relevant)
-            prev = line
-
-    df = pd.DataFrame(data, columns=["sentence_id", "words", "labels"])
-    return data, df
-
-
-def read_data(path, data_format, columns=None):
-    """Read a file to give the pandas dataFrame simpletransformers expects to
-    work with.
-    """
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "with_transformers"))
 
-    func = format2function[data_format.lower()]
-    return func(path, columns=columns)
+from profiling import Profiler  # noqa: E402
+from scorer import report, score_tags  # noqa: E402
 
 
 def evaluate(model, df):
     """Print precision, recall and F1-score for using the model `model` on the
     gold corpus `df`."""
 
-    result, model_outputs, predictions = model.eval_model(df)
+    sentences, labels = to_sentences(df)
+    predictions, _ = model.predict(sentences, split_on_space=False)
+    # words beyond max_seq_length get no prediction, count them as "O"
+    tagss = [
+        [list(word.values())[0] for word in prediction] + ["O"] * (len(sentence) - len(prediction))
+        for sentence, prediction in zip(sentences, predictions)
+    ]
+    result = score_tags(labels, tagss)
+
+    print(report(result))
+    print(f"P={result['overall_precision']*100:.2f}")
+    print(f"R={result['overall_recall']*100:.2f}")
+    print(f"F={result['overall_f1']*100:.2f}")
+
+
+def read_labels(labels):
+    """Return the list of labels given either as a file (one label per line)
+    or as a comma-separated list.
+    """
+
+    if pathlib.Path(labels).is_file():
+        with open(labels, encoding="utf-8") as input_stream:
+            return [line.strip() for line in input_stream if line.strip()]
+    return [label.strip() for label in labels.split(",") if label.strip()]
 
-    print(f"P={result['precision']*100:.2f}")
-    print(f"R={result['recall']*100:.2f}")
-    print(f"F={result['f1_score']*100:.2f}")
 
+def print_label_counts(counts, labels_list):
+    """Print the frequency of every label in the training set."""
 
-format2function = {
-    "conll": read_conll,
-    "presto": read_presto,
-}
+    total = sum(counts.values()) or 1
+    print("label frequencies (train):")
+    for label in sorted(labels_list, key=lambda label: -counts.get(label, 0)):
+        print(f"  {label:<12} {counts.get(label, 0):>9} {counts.get(label, 0) / total * 100:>6.2f}%")
 
 
 #
@@ -104,20 +70,26 @@ model_args = NERArgs()
 model_args.overwrite_output_dir = True
 model_args.reprocess_input_data = True
 model_args.num_train_epochs = 5
-model_args.use_multiprocessing = False
-model_args.multiprocessing_chunksize = 1
-model_args.process_count = 1
+# features are converted by a pool of processes, in chunks of a size
+# depending on the number of sentences (see training.feature_chunksize)
+model_args.use_multiprocessing = True
+model_args.multiprocessing_chunksize = -1
+model_args.process_count = os.cpu_count() or 1
 model_args.train_batch_size = 8
 model_args.save_model_every_epoch = False
 model_args.save_eval_checkpoints = False
 model_args.dataloader_num_workers = 1
-# TODO: in real world, change this to evaluate with a given number of training steps instead of each epoch
-# following the "gainz fer teh paperz" heuristic
+# evaluation every --eval-steps steps on a subset of the validation data (see
+# `main`): the best model is saved to best_model_dir, and training stops when
+# the F-score has not improved for --patience evaluations.
 model_args.evaluate_during_training_steps = 0
 model_args.evaluate_each_epoch = False
-model_args.evaluate_during_training = (
-    model_args.evaluate_during_training_steps > 0 or model_args.evaluate_each_epoch
-)
+model_args.evaluate_during_training = False
+model_args.evaluate_during_training_verbose = True
+model_args.save_best_model = True
+model_args.early_stopping_metric = "f1_score"
+model_args.early_stopping_metric_minimize = False
+model_args.early_stopping_consider_epochs = False
 model_args.save_steps = -1
 
 
@@ -130,63 +102,158 @@ def main(
     data_format="conll",
     word_column=0,
     tag_column=-1,
+    cache_dir=None,
+    labels_next_to_corpus=False,
+    batching="random",
+    max_tokens=4096,
+    max_seq_length=128,
+    window_overlap=0,
+    labels=None,
+    class_weighting="none",
+    profile=None,
+    profile_trace=None,
+    num_procs=1,
+    nnodes=1,
+    node_rank=0,
+    master_addr="127.0.0.1",
+    master_port=29500,
+    process_count=None,
+    eval_steps=0,
+    eval_subset=500,
+    patience=3,
+    min_delta=0.001,
+    save_steps=0,
+    keep_checkpoints=2,
+    resume=False,
 ):
     #
     # Creating train_df, valid_df and eval_df
     #
 
-    start = time.time()
-    labels_set = set()  # libraries require the list of labels, we will infer it from the dataset
+    profiler = Profiler(trace_dir=profile_trace)
+    profiler.start()
     columns = [word_column, tag_column]
-
-    if reload_model:
+    readers_kwargs = dict(cache_dir=cache_dir, labels_next_to_corpus=labels_next_to_corpus)
+
+    # a run resumed from a checkpoint goes on at the batch following it, with
+    # the state of the optimizer, of the scheduler and of random generators.
+    checkpoint = find_checkpoint(model_args.output_dir) if resume else None
+    if checkpoint:
+        model_name = checkpoint
+    elif reload_model:
         model_name = str(pathlib.Path(model_args.output_dir) / "best_model")
     else:
         model_name = "camembert-base"
+    if resume and not checkpoint:
+        print(f"no checkpoint in {model_args.output_dir}, training from {model_name}")
 
     print("reading train data...")
-    start_read = time.time()
-    train_data, train_df = read_data(train_path, data_format, columns=columns)
-    labels_set.update(set(train_df["labels"]))
-    print("done in", time.time() - start_read, "s")
+    with profiler.stage("read"):
+        train_df = read_data(train_path, data_format, columns=columns, **readers_kwargs)
 
     if valid_path:
         print("reading valid data...")
-        start_read = time.time()
-        valid_data, valid_df = read_data(valid_path, data_format, columns=columns)
-        labels_set.update(set(valid_df["labels"]))
-        print("done in", time.time() - start_read, "s")
+        with profiler.stage("read"):
+            valid_df = read_data(valid_path, data_format, columns=columns, **readers_kwargs)
     else:
         print("no validation data...")
-        valid_data, valid_df = [], pd.DataFrame()
-
-    if eval_path:
-        eval_data, eval_df = read_data(eval_path, data_format, columns=columns)
-        labels_set.update(set(eval_df["labels"]))
+        valid_df = pd.DataFrame()
+    print("done in", profiler.seconds["read"], "s")
+
+    # libraries require the list of labels: unless it is given, it is inferred
+    # from the label counts of the corpora, those of the eval corpus being read
+    # from its sidecar when it is up to date, so that it is only loaded when
+    # evaluating.
+    train_counts = frame_label_counts(train_df)
+    eval_df = None
+    if labels:
+        labels_list = read_labels(labels)
     else:
-        eval_data, eval_df = [], pd.DataFrame()
-
-    model_args.labels_list = sorted(set(labels_set))
+        labels_set = set(train_counts)
+        if not valid_df.empty:
+            labels_set.update(frame_label_counts(valid_df))
+        if eval_path:
+            eval_counts = read_label_counts(eval_path, data_format, columns, cache_dir=cache_dir, next_to_corpus=labels_next_to_corpus)
+            if eval_counts is None:
+                with profiler.stage("read"):
+                    eval_df = read_data(eval_path, data_format, columns=columns, **readers_kwargs)
+                eval_counts = frame_label_counts(eval_df)
+            labels_set.update(eval_counts)
+        labels_list = sorted(labels_set)
+    print_label_counts(train_counts, labels_list)
+
+    model_args.labels_list = labels_list
     model_args.num_train_epochs = n_epochs
+    model_args.max_seq_length = max_seq_length
+    if process_count:
+        model_args.process_count = process_count
+        model_args.use_multiprocessing = process_count > 1
+
+    # evaluations during training are done on a fixed random subset of the
+    # validation data, converted to features once; the whole validation data
+    # is only evaluated at the end, with the best model.
+    evaluate_during_training = eval_steps > 0 and not valid_df.empty and num_procs * nnodes == 1
+    if eval_steps > 0 and not evaluate_during_training:
+        print("no evaluation during training: it needs validation data and a single training process")
+    model_args.evaluate_during_training = evaluate_during_training
+    model_args.evaluate_during_training_steps = eval_steps
+    model_args.use_early_stopping = evaluate_during_training and patience > 0
+    model_args.early_stopping_patience = patience
+    model_args.early_stopping_delta = min_delta
+    if evaluate_during_training:
+        eval_subset_df = sample_sentences(valid_df, eval_subset, seed=model_args.manual_seed or 0)
+    else:
+        eval_subset_df = valid_df
+    model_args.save_steps = save_steps
+    if save_steps > 0 and num_procs * nnodes > 1:
+        print("no checkpoints during training: they need a single training process")
 
     #
     # Create a NERModel and train / eval
     #
 
-    model = NERModel(
-        "camembert",
-        model_name,
+    model_kwargs = dict(
+        model_type="camembert",
+        model_name=model_name,
         args=model_args,
-        use_cuda=torch.cuda.is_available(),
+        weight=class_weights(train_counts, labels_list, class_weighting),
+        batching=batching,
+        max_tokens=max_tokens,
+        feature_cache_dir=str(pathlib.Path(cache_dir) / "features") if cache_dir else None,
+        keep_checkpoints=keep_checkpoints,
+        window_overlap=window_overlap,
     )
 
-    try:
-        model.train_model(
+    if num_procs * nnodes > 1:
+        # data parallel training on CPU, the trained model is saved to
+        # output_dir by the first process and evaluated on node 0 only.
+        distributed.launch(
             train_df,
-            eval_data=valid_df,
+            model_kwargs,
+            num_procs,
+            nnodes=nnodes,
+            node_rank=node_rank,
+            master_addr=master_addr,
+            master_port=master_port,
+            profiler=profiler,
         )
-    except KeyboardInterrupt:  # might take some time, allow the user to cut short
-        pass
+        if node_rank != 0:
+            return
+        model_kwargs["model_name"] = model_args.output_dir
+        model = TrainingNERModel(**model_kwargs, use_cuda=False, profiler=profiler)
+    else:
+        model = TrainingNERModel(**model_kwargs, use_cuda=torch.cuda.is_available(), profiler=profiler)
+        try:
+            model.train_model(
+                train_df,
+                eval_data=eval_subset_df,
+            )
+        except KeyboardInterrupt:  # might take some time, allow the user to cut short
+            pass
+        if evaluate_during_training and pathlib.Path(model_args.best_model_dir).exists():
+            print(f"loading the best model from {model_args.best_model_dir}")
+            model_kwargs["model_name"] = model_args.best_model_dir
+            model = TrainingNERModel(**model_kwargs, use_cuda=torch.cuda.is_available(), profiler=profiler)
 
     if not valid_df.empty:
         print()
@@ -194,29 +261,36 @@ def main(
         print("# valid")
         print("#" + "="*31)
         print()
-        evaluate(model, valid_df)
+        with profiler.stage("eval"):
+            evaluate(model, valid_df)
 
-    if not eval_df.empty:
+    if eval_path:
+        if eval_df is None:
+            with profiler.stage("read"):
+                eval_df = read_data(eval_path, data_format, columns=columns, **readers_kwargs)
         print()
         print("#" + "="*31)
         print("# eval")
         print("#" + "="*31)
         print()
-        evaluate(model, eval_df)
+        with profiler.stage("eval"):
+            evaluate(model, eval_df)
 
-    if valid_df.empty and eval_df.empty:
+    if valid_df.empty and not eval_path:
         print()
         print("#" + "="*31)
         print("# train")
         print("#" + "="*31)
         print()
-        evaluate(model, train_df)
-
-    end = time.time()
+        with profiler.stage("eval"):
+            evaluate(model, train_df)
 
+    profiler.stop()
     print()
     print()
-    print(end - start)
+    print(profiler)
+    if profile:
+        profiler.to_json(profile)
 
 
 if __name__ == "__main__":
@@ -231,6 +305,29 @@ if __name__ == "__main__":
     parser.add_argument("-f", "--data-format", choices=("conll", "presto"), default="conll", help="Format of the data (default: %(default)s).")
     parser.add_argument("--word-column", type=int, default=0, help="Index of the word column (default: %(default)s).")
     parser.add_argument("-t", "--tag-column", type=int, default=-1, help="Index of the tag column (default: %(default)s).")
+    parser.add_argument("--cache-dir", help="Folder where parsed corpora, their label counts and their features are cached, no caching if not given.")
+    parser.add_argument("--labels-next-to-corpus", action="store_true", help="Without --cache-dir, record the label counts of every corpus next to it, in a <corpus>.labels.json file.")
+    parser.add_argument("-b", "--batching", choices=BATCHING_MODES, default="random", help="How training batches are built: random sentences, sentences of similar lengths or a budget of tokens (default: %(default)s).")
+    parser.add_argument("--max-tokens", type=int, default=4096, help="Maximum number of subword tokens per batch with '--batching tokens' (default: %(default)s).")
+    parser.add_argument("--max-seq-length", type=int, default=128, help="Maximum number of subword tokens per sentence (default: %(default)s).")
+    parser.add_argument("--window-overlap", type=int, default=0, help="Number of subword tokens shared by the training windows of sentences longer than --max-seq-length, each shared word being trained on in one window only (default: %(default)s).")
+    parser.add_argument("--labels", help="The labels of the model, as a file with one label per line or a comma-separated list (default: the labels found in the data).")
+    parser.add_argument("--class-weighting", choices=CLASS_WEIGHTING, default="none", help="Weight the loss of labels by their inverse frequency, or its square root, in the train data (default: %(default)s).")
+    parser.add_argument("--profile", metavar="PATH", help="Write the time spent in every stage, the throughput and the peak memory of the run to this JSON file.")
+    parser.add_argument("--profile-trace", metavar="DIR", help="Record torch.profiler traces of a few training steps in this folder (viewable with TensorBoard).")
+    parser.add_argument("--eval-steps", type=int, default=0, help="Evaluate on a subset of the validation data every this number of training steps, keeping the best model and stopping early; 0 to train for all epochs (default: %(default)s).")
+    parser.add_argument("--eval-subset", type=int, default=500, help="Number of validation sentences drawn at random for evaluations during training, 0 for all (default: %(default)s).")
+    parser.add_argument("--patience", type=int, default=3, help="Stop training after this number of evaluations without improvement of the F-score, 0 to never stop early (default: %(default)s).")
+    parser.add_argument("--min-delta", type=float, default=0.001, help="Minimum improvement of the F-score (default: %(default)s).")
+    parser.add_argument("--save-steps", type=int, default=0, help="Save a checkpoint of the training state every this number of training steps, 0 for none (default: %(default)s).")
+    parser.add_argument("--keep-checkpoints", type=int, default=2, help="Number of the latest checkpoints kept (default: %(default)s).")
+    parser.add_argument("--resume", action="store_true", help="Resume training from the latest complete checkpoint, if any.")
+    parser.add_argument("--process-count", type=int, help="Number of processes converting sentences to features (default: all CPUs).")
+    parser.add_argument("--num-procs", type=int, default=1, help="Number of training processes on this node, gradients being all-reduced between processes with gloo; the batch size is shared between all processes (default: %(default)s).")
+    parser.add_argument("--nnodes", type=int, default=1, help="Number of nodes training together, each one running this script with its --node-rank (default: %(default)s).")
+    parser.add_argument("--node-rank", type=int, default=0, help="Rank of this node, from 0 to nnodes - 1 (default: %(default)s).")
+    parser.add_argument("--master-addr", default="127.0.0.1", help="Address of node 0 (default: %(default)s).")
+    parser.add_argument("--master-port", type=int, default=29500, help="Free port on node 0 (default: %(default)s).")
     args = parser.parse_args()
 
     main(**vars(args))
@@ -0,0 +1,250 @@
+"""Apply a simpletransformers model on a collection of text files using a pool
+of worker processes.
+
+Every worker loads its own copy of the model and uses a share of the CPU
+threads so that workers do not oversubscribe the machine. One output file is
+written per input file; files whose output already exists are skipped, so an
+interrupted run can be resumed by launching the same command again.
+
+Every worker keeps the sentences it predicted in a `PredictionCache`; with
+`--cache-path`, workers share them through a SQLite file, which also serves
+later runs.
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import pathlib
+import sys
+import time
+
+from prediction_cache import format_stats, merge_stats
+
+
+extensions = {
+    "html": ".html",
+    "brat": ".ann",
+    "json": ".json",
+}
+
+_worker = {}
+
+
+def list_inputs(inputs, pattern="*.txt"):
+    """Return the input files and the folder their paths are relative to.
+    `inputs` is either a folder, searched recursively for `pattern`, or a
+    manifest file listing one path per line.
+    """
+
+    inputs = pathlib.Path(inputs)
+    if inputs.is_dir():
+        return sorted(path for path in inputs.rglob(pattern) if path.is_file()), inputs
+
+    with open(inputs, encoding="utf-8") as input_stream:
+        paths = [pathlib.Path(line.strip()) for line in input_stream if line.strip()]
+    paths = [path if path.is_absolute() else inputs.parent / path for path in paths]
+    root = pathlib.Path(os.path.commonpath([path.resolve().parent for path in paths])) if paths else inputs.parent
+    return [path.resolve() for path in paths], root
+
+
+def output_path(path, root, output_dir, output_format):
+    relative = pathlib.Path(path).resolve().relative_to(pathlib.Path(root).resolve())
+    return pathlib.Path(output_dir) / relative.with_suffix(extensions[output_format])
+
+
+def _init_worker(
+    model_path, n_threads, output_format, batch_size, backend, segmenter_name, window_overlap, cache_size, cache_path, label_consistency
+):
+    import torch
+
+    torch.set_num_threads(n_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:  # already set in this process
+        pass
+
+    import ner_french_predict
+    from prediction_cache import PredictionCache
+
+    _worker["module"] = ner_french_predict
+    _worker["model"] = ner_french_predict.load_model(model_path, backend=backend)
+    _worker["output_format"] = output_format
+    _worker["batch_size"] = batch_size
+    _worker["segmenter_name"] = segmenter_name
+    _worker["window_overlap"] = window_overlap
+    _worker["label_consistency"] = label_consistency
+    _worker["cache"] = None
+    if cache_size > 0:
+        _worker["cache"] = PredictionCache(model_path, max_size=cache_size, path=cache_path, backend=backend, overlap=window_overlap, decoder="viterbi")
+
+
+def _annotate(path, destination):
+    """Annotate the file at `path` into `destination` and return its number
+    of tokens.
+    """
+
+    module = _worker["module"]
+    with open(path, encoding="utf-8") as input_stream:
+        text = input_stream.read()
+    doc = module.annotate(
+        _worker["model"],
+        text,
+        name=str(path),
+        batch_size=_worker["batch_size"],
+        overlap=_worker["window_overlap"],
+        segmenter_name=_worker["segmenter_name"],
+        cache=_worker["cache"],
+        label_consistency=_worker["label_consistency"],
+    )
+    output = module.formatters[_worker["output_format"]](doc)
+
+    # write to a temporary file first: an existing output is always complete
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    tmp_destination = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_destination, "w", encoding="utf-8") as output_stream:
+            output_stream.write(output)
+        os.replace(tmp_destination, destination)
+    except OSError:
+        tmp_destination.unlink(missing_ok=True)
+        raise
+    return module.count_tokens(doc)
+
+
+def _annotate_file(task):
+    """Annotate a file in a worker. Errors are returned rather than raised,
+    so that one bad file does not stop the run.
+    """
+
+    path, destination = task
+    start = time.perf_counter()
+    n_tokens, error = 0, None
+    try:
+        n_tokens = _annotate(path, destination)
+    except Exception as exception:
+        error = f"{type(exception).__name__}: {exception}"
+
+    cache = _worker["cache"]
+    if cache is not None and cache.connection is not None:
+        # workers are terminated without cleanup: save the timing now
+        cache.save_timing()
+    stats = cache.stats() if cache is not None else None
+    return os.getpid(), path, n_tokens, time.perf_counter() - start, stats, error
+
+
+def main(
+    model_path,
+    inputs,
+    output_dir,
+    num_workers=None,
+    threads_per_worker=None,
+    output_format="json",
+    batch_size=64,
+    pattern="*.txt",
+    backend="torch",
+    segmenter_name="sem",
+    window_overlap=32,
+    cache_size=100000,
+    cache_path=None,
+    label_consistency=None,
+):
+    if segmenter_name == "regex" and output_format == "html":
+        raise ValueError("the HTML output needs the SEM segmenter")
+    num_workers = num_workers or max(1, (os.cpu_count() or 1) // 4)
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+
+    paths, root = list_inputs(inputs, pattern=pattern)
+    tasks = []
+    for path in paths:
+        destination = output_path(path, root, output_dir, output_format)
+        if not destination.exists():
+            tasks.append((path, destination))
+    print(f"{len(paths)} files, {len(paths) - len(tasks)} already done, {len(tasks)} to annotate")
+    print(f"{num_workers} workers with {threads_per_worker} threads each")
+    if not tasks:
+        return
+
+    # inherited by the workers before torch is imported in them
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+    os.environ["MKL_NUM_THREADS"] = str(threads_per_worker)
+
+    tokens = collections.Counter()
+    busy = collections.Counter()
+    n_files = collections.Counter()
+    cache_stats = {}  # cumulative stats of the cache of every worker
+    failures = []
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(
+        num_workers,
+        initializer=_init_worker,
+        initargs=(
+            model_path,
+            threads_per_worker,
+            output_format,
+            batch_size,
+            backend,
+            segmenter_name,
+            window_overlap,
+            cache_size,
+            cache_path,
+            label_consistency,
+        ),
+    ) as pool:
+        for i, (pid, path, n_tokens, seconds, stats, error) in enumerate(pool.imap_unordered(_annotate_file, tasks), 1):
+            if stats is not None:
+                cache_stats[pid] = stats
+            if error is not None:
+                failures.append((path, error))
+                print(f"failed: {path}: {error}", flush=True)
+            tokens[pid] += n_tokens
+            busy[pid] += seconds
+            n_files[pid] += 1
+            if i % 100 == 0 or i == len(tasks):
+                elapsed = time.perf_counter() - start
+                print(f"{i}/{len(tasks)} files, {sum(tokens.values()) / elapsed:.1f} tokens/s", flush=True)
+    elapsed = time.perf_counter() - start
+
+    print()
+    for pid in sorted(tokens):
+        print(
+            f"worker {pid}: {n_files[pid]} files, {tokens[pid]} tokens, "
+            f"{tokens[pid] / busy[pid]:.1f} tokens/s"
+        )
+    print(f"total: {sum(tokens.values())} tokens in {elapsed:.1f} s, {sum(tokens.values()) / elapsed:.1f} tokens/s")
+    if cache_stats:
+        print(format_stats(merge_stats(cache_stats.values())))
+    if failures:
+        # their outputs are not written: a later run tries them again
+        print(f"\n{len(failures)} of {len(tasks)} files failed:")
+        for path, error in failures:
+            print(f"{path}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # imported here rather than at the top of the module: spawned workers
+    # import this module again, and must not load torch before _init_worker
+    # sets their number of threads
+    from consistency import RESOLUTIONS
+    from ner_french_predict import SEGMENTERS, backends
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("model_path", help="Path to the model folder.")
+    parser.add_argument("inputs", help="Folder of text files, or a manifest file listing one path per line.")
+    parser.add_argument("output_dir", help="Folder where outputs are written.")
+    parser.add_argument("-n", "--num-workers", type=int, help="Number of worker processes (default: a quarter of the CPUs).")
+    parser.add_argument("-t", "--threads-per-worker", type=int, help="Number of torch threads per worker (default: CPUs / workers).")
+    parser.add_argument("-f", "--output-format", choices=sorted(extensions), default="json", help="Output format (default: %(default)s).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Number of sentences given to the model at once (default: %(default)s).")
+    parser.add_argument("--pattern", default="*.txt", help="Pattern of input files in a folder (default: %(default)s).")
+    parser.add_argument("-b", "--backend", choices=sorted(backends), default="torch", help="Inference backend (default: %(default)s).")
+    parser.add_argument("--segmenter", dest="segmenter_name", choices=SEGMENTERS, default="sem", help="Tokenization and sentence splitting: SEM, or regular expressions without SEM for brat and json outputs (default: %(default)s).")
+    parser.add_argument("--window-overlap", type=int, default=32, help="Number of subword tokens shared by the windows of sentences longer than the model (default: %(default)s).")
+    parser.add_argument("--cache-size", type=int, default=100000, help="Number of predicted sentences kept in memory by every worker to skip repeated ones, 0 to disable the cache (default: %(default)s).")
+    parser.add_argument("--cache-path", help="SQLite file where the predicted sentences are shared by workers and kept across runs (default: memory only).")
+    parser.add_argument("--label-consistency", choices=RESOLUTIONS, help="Tag the unlabelled occurrences of the entities of every document, the type of forms predicted with several types being the most frequent, the first or none (default: off).")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,59 @@
+"""Send a text read from the standard input (or files) to a running NER
+server and print the result.
+"""
+
+import argparse
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def annotate(text, url="http://127.0.0.1:8000", output_format="json", name="document", timeout=60):
+    """Return the annotation of `text` by the server at `url`. Errors of the
+    server raise `urllib.error.HTTPError`.
+    """
+
+    query = urllib.parse.urlencode({"format": output_format, "name": name})
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/annotate?{query}",
+        data=text.encode("utf-8"),
+        headers={"Content-Type": "text/plain; charset=utf-8"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read().decode("utf-8")
+
+
+def _report(error, name):
+    message = error.read().decode("utf-8", errors="replace").strip()
+    print(f"{name}: HTTP error {error.code} ({error.reason}): {message}", file=sys.stderr)
+
+
+def main(paths, url="http://127.0.0.1:8000", output_format="json"):
+    if not paths:
+        try:
+            sys.stdout.write(annotate(sys.stdin.read(), url=url, output_format=output_format))
+        except urllib.error.HTTPError as error:
+            _report(error, "<stdin>")
+            sys.exit(1)
+        return
+    n_failed = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as input_stream:
+            try:
+                sys.stdout.write(annotate(input_stream.read(), url=url, output_format=output_format, name=path))
+            except urllib.error.HTTPError as error:
+                _report(error, path)
+                n_failed += 1
+    if n_failed:
+        sys.exit(f"{n_failed} of {len(paths)} files failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("paths", nargs="*", help="Files to annotate, the standard input if none.")
+    parser.add_argument("-u", "--url", default="http://127.0.0.1:8000", help="URL of the server (default: %(default)s).")
+    parser.add_argument("-f", "--output-format", choices=("json", "brat", "html"), default="json", help="Output format (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
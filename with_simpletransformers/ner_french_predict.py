@@ -1,58 +1,402 @@
 """Apply a simpletranformers model on some text data given as a text stream read
 from the standard input.
 
-Currently uses SEM to pre-/post- process data, should consider using SpaCy to
-tokenize input and output data in a BRAT format.
+Text is segmented and predictions are turned into entities either by SEM, the
+only option for HTML output, or by the regex segmenter of `standoff.py`, which
+keeps character offsets in arrays and writes BRAT or JSON standoff without SEM.
+With `--label-consistency`, entities predicted once in a document are also
+tagged where the model missed them (see `consistency.py`).
 """
 
 import argparse
+import io
+import pathlib
 import sys
 import time
+import unicodedata
+import numpy as np
 import torch
-import pandas as pd
 
-import sem.storage
-import sem.modules.segmentation
-import sem.modules.export
-import sem.modules.label_consistency
+try:
+    import sem.storage
+    import sem.modules.segmentation
+    import sem.modules.export
+except ImportError:  # only the "regex" segmenter is available
+    sem = None
 
 from simpletransformers.ner import NERModel
+from simpletransformers.ner.ner_utils import InputExample
 
+import standoff
+from consistency import RESOLUTIONS, propagate
+from prediction_cache import PredictionCache, format_stats, sentence_key
 
-segmenter = sem.modules.segmentation.SEMModule("fr")
-exporter = sem.modules.export.SEMModule("html", ner_column="NER")
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "with_transformers"))
 
+from decoding import decode_tags  # noqa: E402
+from windows import merge, window_spans  # noqa: E402
 
-def main(model_path):
-    model = NERModel(
-        "camembert",
-        model_path,
-        use_cuda=torch.cuda.is_available(),
-    )
 
-    text = sys.stdin.read()
-    doc = sem.storage.Document("document", text)
+SEGMENTERS = ("sem", "regex")
+
+if sem is not None:
+    segmenter = sem.modules.segmentation.SEMModule("fr")
+    exporter = sem.modules.export.SEMModule("html", ner_column="NER")
+
+
+def iter_chunks(input_stream, chunk_size=100000):
+    """Yield the text of `input_stream` by chunks of about `chunk_size`
+    characters. Chunks end on an empty line (a paragraph boundary) so that no
+    sentence is cut, unless no empty line was found within `4 * chunk_size`
+    characters, in which case the chunk ends at the end of a line.
+    """
+
+    lines = []
+    size = 0
+    for line in input_stream:
+        lines.append(line)
+        size += len(line)
+        if (size >= chunk_size and not line.strip()) or size >= 4 * chunk_size:
+            yield "".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield "".join(lines)
+
+
+def max_subwords(sentence):
+    """Return an upper bound of the number of SentencePiece subword tokens of
+    a sentence (a list of words): a word has at most one subword per character
+    of its NFKC normal form, plus the word boundary.
+    """
+
+    return len(unicodedata.normalize("NFKC", " ".join(sentence))) + 1
+
+
+def sentence_windows(model, sentences, overlap=32):
+    """Return the word spans of the windows of every sentence. A sentence
+    whose subword tokens do not fit in `max_seq_length` is split into windows
+    that do, consecutive windows sharing about `overlap` subword tokens.
+    """
+
+    # <s>, </s> and the extra </s> of RoBERTa-like models
+    budget = model.args.max_seq_length - 3
+    cache = {}
+    spanss = []
+    for sentence in sentences:
+        # short sentences are only tokenized by the model, not twice
+        if max_subwords(sentence) <= budget:
+            spanss.append([(0, len(sentence))])
+            continue
+        costs = [cache.setdefault(word, max(1, len(model.tokenizer.tokenize(word)))) for word in sentence]
+        if sum(costs) <= budget:
+            spanss.append([(0, len(sentence))])
+        else:
+            spanss.append(window_spans(costs, budget, overlap))
+    return spanss
+
+
+def predict_tags(model, sentences, batch_size=None, overlap=32, cache=None):
+    """Return the predicted tags of every sentence. Sentences repeated in
+    `sentences` are predicted once and, with a `PredictionCache`, sentences
+    already predicted are not predicted again.
+    """
+
+    keys = [sentence_key(sentence) for sentence in sentences]
+    tagss = [None] * len(sentences)
+    pending = {}  # key -> indices of the sentences to predict
+    for i, key in enumerate(keys):
+        if key not in pending and cache is not None:
+            tagss[i] = cache.get(key)
+        if tagss[i] is None:
+            pending.setdefault(key, []).append(i)
+    if not pending:
+        return tagss
+
+    start = time.perf_counter()
+    predicted = _predict_tags(model, [sentences[indices[0]] for indices in pending.values()], batch_size, overlap)
+    seconds = time.perf_counter() - start
+    for indices, tags in zip(pending.values(), predicted):
+        for i in indices:
+            tagss[i] = list(tags)
+    if cache is not None:
+        cache.update(zip(pending, predicted), seconds, duplicates=sum(len(indices) - 1 for indices in pending.values()))
+    return tagss
+
+
+def _forward(model, input_ids, input_mask):
+    """Return the logits of a batch of features as an array, with PyTorch or
+    ONNX Runtime depending on the backend of `model`.
+    """
+
+    if model.args.onnx:
+        return model.model.run(None, {"input_ids": input_ids.numpy(), "attention_mask": input_mask.numpy()})[0]
+    with torch.no_grad(), torch.autocast("cuda", enabled=model.args.fp16 and model.device.type == "cuda"):
+        outputs = model.model(input_ids=input_ids.to(model.device), attention_mask=input_mask.to(model.device))
+    return outputs[0].float().cpu().numpy()
+
+
+def _predict_tags(model, sentences, batch_size=None, overlap=32):
+    """Sentences are sorted by length and given to the model by batches of
+    `batch_size` sentences, so that the memory used does not depend on the
+    number of sentences. Every batch is converted to simpletransformers
+    features, cut after its longest sentence and run through the model.
+
+    Sentences longer than `max_seq_length` subword tokens are predicted by
+    overlapping windows whose logits are merged back (see `sentence_windows`),
+    instead of having their last words dropped by simpletransformers.
+
+    Tags are decoded from the logits of the first subword of every word by
+    `decoding.decode_tags`, which only allows valid BIO sequences.
+    """
+
+    labels = model.args.labels_list
+    # logits of words cut by the model, which are tagged O
+    outside = np.where(np.array(labels) == "O", 0.0, -1e4 if "O" in labels else 0.0).astype(np.float32)
+
+    spanss = sentence_windows(model, sentences, overlap=overlap)
+    pieces = [sentence[start: end] for sentence, spans in zip(sentences, spanss) for start, end in spans]
+
+    if not model.args.onnx:
+        model._move_model_to_device()
+        model.model.eval()
+    batch_size = batch_size or len(pieces)
+    order = sorted(range(len(pieces)), key=lambda i: len(pieces[i]))
+    piece_logits = [None] * len(pieces)
+    for start in range(0, len(order), batch_size):
+        indices = order[start: start + batch_size]
+        examples = [InputExample(i, pieces[i], [labels[0]] * len(pieces[i])) for i in indices]
+        input_ids, input_mask, _, label_ids = model.load_and_cache_examples(None, to_predict=examples).tensors
+        length = int(input_mask.sum(dim=1).max())
+        logits = _forward(model, input_ids[:, :length], input_mask[:, :length])
+        # only the first subword of every word has a label
+        is_first = (label_ids[:, :length] != model.pad_token_label_id).numpy()
+        for row, i in enumerate(indices):
+            word_logits = logits[row, is_first[row]]
+            # a single word longer than the model may still be cut
+            cut = np.tile(outside, (len(pieces[i]) - len(word_logits), 1))
+            piece_logits[i] = np.concatenate([word_logits, cut])
+
+    logits = []
+    position = 0
+    for spans in spanss:
+        logits.append(merge(spans, piece_logits[position: position + len(spans)]))
+        position += len(spans)
+    return decode_tags(logits, labels)
+
+
+def segment(text, name="document", segmenter_name="sem"):
+    """Segment `text` into a SEM document, or a `standoff.Document` with the
+    "regex" segmenter. Return the document and the list of its sentences, each
+    sentence being a list of tokens.
+    """
+
+    if segmenter_name == "regex":
+        doc = standoff.Document(name, text)
+        return doc, doc.sentences()
+    if sem is None:
+        raise ImportError("SEM is not installed, use the regex segmenter")
+    doc = sem.storage.Document(name, text)
     segmenter.process_document(doc)
     tokens = [text[w.lb: w.ub] for w in doc.segmentation("tokens")]
     sentences = [tokens[s.lb: s.ub] for s in doc.segmentation("sentences")]
-    predictions, raw_outputs = model.predict(sentences, split_on_space=False)
-    tagss = []
+    return doc, sentences
+
+
+def add_predictions(doc, tagss):
+    """Add the predicted tags of every sentence to `doc` as its "NER"
+    annotation.
+    """
+
+    if isinstance(doc, standoff.Document):
+        doc.add_predictions(tagss)
+        return
 
-    for i, pred in enumerate(predictions):
-        tags = [val for val in [list(l.values())[0] for l in pred]]
+    for i, tags in enumerate(tagss):
         doc.corpus.sentences[i].add(tags, "NER")
-        tagss.append(tags)
 
     doc._annotations["NER"] = sem.storage.chunk_annotation_from_corpus(
         doc.corpus, "NER", "NER", reference=doc.segmentation("tokens")
     )
 
-    exporter.process_document(doc)
+
+def annotate(
+    model,
+    text,
+    name="document",
+    batch_size=None,
+    overlap=32,
+    segmenter_name="sem",
+    cache=None,
+    label_consistency=None,
+):
+    """Segment `text`, predict its named entities and return the resulting
+    document. With a `label_consistency` resolution (see
+    `consistency.RESOLUTIONS`), the entities of the document are also tagged
+    where the model missed them.
+    """
+
+    doc, sentences = segment(text, name=name, segmenter_name=segmenter_name)
+    tagss = predict_tags(model, sentences, batch_size=batch_size, overlap=overlap, cache=cache) if sentences else []
+    if label_consistency:
+        tagss, _ = propagate(sentences, tagss, resolution=label_consistency)
+    add_predictions(doc, tagss)
+    return doc
+
+
+def entities(doc):
+    """Return the named entities of an annotated document as a list of
+    dictionaries with their type, character offsets and text.
+    """
+
+    if isinstance(doc, standoff.Document):
+        return doc.entities()
+    return [
+        {"type": tag.value, "start": tag.lb, "end": tag.ub, "text": doc.content[tag.lb: tag.ub]}
+        for tag in doc.annotation("NER").get_reference_annotations()
+    ]
+
+
+def to_brat(doc):
+    """Return the named entities of an annotated document in BRAT standoff
+    format.
+    """
+
+    return standoff.format_brat(entities(doc))
+
+
+def to_json(doc):
+    """Return the named entities of an annotated document as JSON."""
+
+    return standoff.format_json(doc.name, entities(doc))
+
+
+def count_tokens(doc):
+    if isinstance(doc, standoff.Document):
+        return doc.n_tokens
+    return len(doc.segmentation("tokens"))
+
+
+def to_html(doc):
+    """Return the HTML visualization of an annotated document."""
+
+    if isinstance(doc, standoff.Document):
+        raise ValueError("the HTML output needs the SEM segmenter")
+    output = io.StringIO()
+    exporter.process_document(doc, outfile=output)
+    return output.getvalue()
+
+
+formatters = {
+    "html": to_html,
+    "brat": to_brat,
+    "json": to_json,
+}
+
+
+def write_document(doc, output_format="html"):
+    """Write an annotated document on the standard output."""
+
+    if output_format == "html":
+        exporter.process_document(doc)
+    else:
+        sys.stdout.write(formatters[output_format](doc))
+        sys.stdout.write("\n")
+
+
+# model args that select the inference backend, see export_model.py
+backends = {
+    "torch": {},
+    "int8": {"dynamic_quantize": True},
+    "onnx": {"onnx": True},
+    "onnx-int8": {"onnx": True, "dynamic_quantize": True},
+}
+
+
+def load_model(model_path, backend="torch"):
+    """Load the NER model saved in `model_path` with the given backend. The
+    "onnx" backends expect a folder written by `export_model.py`, "int8"
+    quantizes linear layers of a PyTorch model to int8 when loading it (or
+    loads a model already quantized by `export_model.py`).
+    """
+
+    return NERModel(
+        "camembert",
+        model_path,
+        args=dict(backends[backend]),
+        use_cuda=torch.cuda.is_available() and backend == "torch",
+    )
+
+
+def main(
+    model_path,
+    stream=False,
+    chunk_size=100000,
+    batch_size=64,
+    output_format="html",
+    backend="torch",
+    window_overlap=32,
+    segmenter_name="sem",
+    cache_size=100000,
+    cache_path=None,
+    label_consistency=None,
+):
+    if segmenter_name == "regex" and output_format == "html":
+        raise ValueError("the HTML output needs the SEM segmenter")
+    model = load_model(model_path, backend=backend)
+    cache = None
+    if cache_size > 0:
+        cache = PredictionCache(model_path, max_size=cache_size, path=cache_path, backend=backend, overlap=window_overlap, decoder="viterbi")
+
+    try:
+        if not stream:
+            doc = annotate(
+                model,
+                sys.stdin.read(),
+                batch_size=batch_size,
+                overlap=window_overlap,
+                segmenter_name=segmenter_name,
+                cache=cache,
+                label_consistency=label_consistency,
+            )
+            write_document(doc, output_format)
+            return
+
+        for i, text in enumerate(iter_chunks(sys.stdin, chunk_size=chunk_size)):
+            if not text.strip():
+                continue
+            doc = annotate(
+                model,
+                text,
+                name=f"document-{i}",
+                batch_size=batch_size,
+                overlap=window_overlap,
+                segmenter_name=segmenter_name,
+                cache=cache,
+                label_consistency=label_consistency,
+            )
+            write_document(doc, output_format)
+            sys.stdout.flush()
+    finally:
+        if cache is not None:
+            # the standard output holds the annotations
+            print(format_stats(cache.stats()), file=sys.stderr)
+            cache.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
     parser.add_argument("model_path", help="Path to train file.")
+    parser.add_argument("-s", "--stream", action="store_true", help="Read and annotate the input by chunks, writing the output of each chunk as soon as it is done.")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Approximate number of characters per chunk with --stream (default: %(default)s).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Number of sentences given to the model at once (default: %(default)s).")
+    parser.add_argument("-f", "--output-format", choices=sorted(formatters), default="html", help="Output format (default: %(default)s).")
+    parser.add_argument("-b", "--backend", choices=sorted(backends), default="torch", help="Inference backend (default: %(default)s).")
+    parser.add_argument("--segmenter", dest="segmenter_name", choices=SEGMENTERS, default="sem", help="Tokenization and sentence splitting: SEM, or regular expressions without SEM for brat and json outputs (default: %(default)s).")
+    parser.add_argument("--window-overlap", type=int, default=32, help="Number of subword tokens shared by the windows of sentences longer than the model (default: %(default)s).")
+    parser.add_argument("--cache-size", type=int, default=100000, help="Number of predicted sentences kept in memory to skip repeated ones, 0 to disable the cache (default: %(default)s).")
+    parser.add_argument("--cache-path", help="SQLite file where predicted sentences are also kept across runs (default: memory only).")
+    parser.add_argument("--label-consistency", choices=RESOLUTIONS, help="Tag the unlabelled occurrences of the entities of every document, the type of forms predicted with several types being the most frequent, the first or none (default: off).")
     args = parser.parse_args()
 
     main(**vars(args))
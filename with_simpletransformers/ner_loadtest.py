@@ -0,0 +1,54 @@
+"""Load-test a running NER server with concurrent clients and report latency
+percentiles and throughput.
+"""
+
+import argparse
+import concurrent.futures
+import statistics
+import time
+
+from ner_client import annotate
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main(path, url="http://127.0.0.1:8000", concurrency=8, n_requests=200, output_format="json"):
+    with open(path, encoding="utf-8") as input_stream:
+        text = input_stream.read()
+
+    def timed_request(_):
+        start = time.perf_counter()
+        annotate(text, url=url, output_format=output_format)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed_request, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{n_requests} requests, {concurrency} concurrent clients, {elapsed:.2f} s")
+    print(f"throughput: {n_requests / elapsed:.1f} requests/s, {n_requests * len(text) / elapsed:.0f} chars/s")
+    print(
+        "latency (ms):"
+        f" mean={statistics.mean(latencies) * 1000:.1f}"
+        f" p50={percentile(latencies, 0.50) * 1000:.1f}"
+        f" p95={percentile(latencies, 0.95) * 1000:.1f}"
+        f" p99={percentile(latencies, 0.99) * 1000:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "path", nargs="?", default="../sample_data/exemple.txt", help="Text sent by every request (default: %(default)s)."
+    )
+    parser.add_argument("-u", "--url", default="http://127.0.0.1:8000", help="URL of the server (default: %(default)s).")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Number of concurrent clients (default: %(default)s).")
+    parser.add_argument("-n", "--n-requests", type=int, default=200, help="Total number of requests (default: %(default)s).")
+    parser.add_argument("-f", "--output-format", choices=("json", "brat", "html"), default="json", help="Output format (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
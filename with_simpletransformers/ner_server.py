@@ -0,0 +1,240 @@
+"""Serve a simpletransformers NER model over HTTP.
+
+The model, SEM's segmenter and the HTML exporter are loaded once. Documents are
+sent by POST requests to `/annotate?format=json|brat|html` with the raw text as
+body. Requests are handled concurrently and the sentences of all requests that
+arrive within a small time window are predicted together. With `--segmenter
+regex`, documents are segmented without SEM (see `standoff.py`), and the HTML
+format is not available. Predicted sentences are kept in a `PredictionCache`,
+whose hit rate is reported by `/health`. With `--label-consistency`, entities
+predicted once in a document are also tagged where the model missed them.
+"""
+
+import argparse
+import contextlib
+import http.server
+import queue
+import threading
+import time
+import traceback
+import urllib.parse
+
+from consistency import RESOLUTIONS, propagate
+from ner_french_predict import SEGMENTERS, add_predictions, backends, formatters, load_model, predict_tags, segment
+from prediction_cache import PredictionCache
+
+
+content_types = {
+    "html": "text/html; charset=utf-8",
+    "brat": "text/plain; charset=utf-8",
+    "json": "application/json; charset=utf-8",
+}
+
+
+class _Request:
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.tags = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class PredictionBatcher:
+    """Gather the sentences of concurrent requests and predict them together.
+
+    A batch is closed `max_wait` seconds after its first request arrived or as
+    soon as it holds `max_sentences` sentences.
+    """
+
+    def __init__(self, model, max_wait=0.01, max_sentences=256, batch_size=None, overlap=32, cache=None):
+        self.model = model
+        self.cache = cache
+        self.overlap = overlap
+        self.max_wait = max_wait
+        self.max_sentences = max_sentences
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.n_batches = 0
+        self.n_requests = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def predict(self, sentences):
+        """Return the predicted tags of every sentence, blocking until the batch
+        they were put in is done.
+        """
+
+        if not sentences:
+            return []
+        request = _Request(sentences)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.tags
+
+    def _next_batch(self):
+        requests = [self.queue.get()]
+        n_sentences = len(requests[0].sentences)
+        deadline = time.monotonic() + self.max_wait
+        while n_sentences < self.max_sentences:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            n_sentences += len(request.sentences)
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._next_batch()
+            sentences = [sentence for request in requests for sentence in request.sentences]
+            try:
+                tagss = predict_tags(self.model, sentences, batch_size=self.batch_size, overlap=self.overlap, cache=self.cache)
+            except Exception as error:
+                for request in requests:
+                    request.error = error
+            else:
+                start = 0
+                for request in requests:
+                    request.tags = tagss[start: start + len(request.sentences)]
+                    start += len(request.sentences)
+            self.n_batches += 1
+            self.n_requests += len(requests)
+            for request in requests:
+                request.done.set()
+
+
+class NERRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handle `POST /annotate` requests and `GET /health` checks. The server
+    is expected to have a `batcher` attribute.
+    """
+
+    # SEM's segmenter and exporter are not known to be thread-safe
+    lock = threading.Lock()
+
+    def _send(self, code, body, content_type="text/plain; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/health":
+            self._send(404, "not found\n")
+            return
+        batcher = self.server.batcher
+        body = f"ok {batcher.n_requests} requests in {batcher.n_batches} batches"
+        if batcher.cache is not None:
+            stats = batcher.cache.stats()
+            body += f", cache hit rate {stats['hit_rate']:.1%} of {stats['sentences']} sentences"
+        self._send(200, body + "\n")
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/annotate":
+            self._send(404, "not found\n")
+            return
+        params = urllib.parse.parse_qs(url.query)
+        output_format = params.get("format", ["json"])[0]
+        if output_format not in formatters:
+            self._send(400, f"unknown format {output_format}, expected one of {sorted(formatters)}\n")
+            return
+        segmenter_name = self.server.segmenter_name
+        if segmenter_name == "regex" and output_format == "html":
+            self._send(400, "the html format needs the SEM segmenter\n")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError(f"negative length {length}")
+        except ValueError as error:
+            self._send(400, f"bad Content-Length header: {error}\n")
+            return
+        try:
+            text = self.rfile.read(length).decode("utf-8")
+        except UnicodeDecodeError as error:
+            self._send(400, f"the body is not UTF-8 text: {error}\n")
+            return
+
+        name = params.get("name", ["document"])[0]
+        lock = self.lock if segmenter_name == "sem" else contextlib.nullcontext()
+        try:
+            with lock:
+                doc, sentences = segment(text, name=name, segmenter_name=segmenter_name)
+            tagss = self.server.batcher.predict(sentences)
+            if self.server.label_consistency:
+                tagss, _ = propagate(sentences, tagss, resolution=self.server.label_consistency)
+            with lock:
+                add_predictions(doc, tagss)
+                body = formatters[output_format](doc)
+        except Exception as error:
+            traceback.print_exc()
+            self._send(500, f"annotation failed: {type(error).__name__}: {error}\n")
+            return
+        self._send(200, body, content_types[output_format])
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def main(
+    model_path,
+    host="127.0.0.1",
+    port=8000,
+    max_wait=0.01,
+    max_sentences=256,
+    verbose=False,
+    backend="torch",
+    segmenter_name="sem",
+    window_overlap=32,
+    cache_size=100000,
+    cache_path=None,
+    label_consistency=None,
+):
+    model = load_model(model_path, backend=backend)
+    cache = None
+    if cache_size > 0:
+        cache = PredictionCache(model_path, max_size=cache_size, path=cache_path, backend=backend, overlap=window_overlap, decoder="viterbi")
+    server = http.server.ThreadingHTTPServer((host, port), NERRequestHandler)
+    server.batcher = PredictionBatcher(model, max_wait=max_wait, max_sentences=max_sentences, overlap=window_overlap, cache=cache)
+    server.verbose = verbose
+    server.segmenter_name = segmenter_name
+    server.label_consistency = label_consistency
+    print(f"serving on http://{host}:{port}/annotate", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("model_path", help="Path to the model folder.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: %(default)s).")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="Port to listen on (default: %(default)s).")
+    parser.add_argument("--max-wait", type=float, default=0.01, help="Seconds to wait for other requests before predicting a batch (default: %(default)s).")
+    parser.add_argument("--max-sentences", type=int, default=256, help="Maximum number of sentences per batch (default: %(default)s).")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request.")
+    parser.add_argument("-b", "--backend", choices=sorted(backends), default="torch", help="Inference backend (default: %(default)s).")
+    parser.add_argument("--segmenter", dest="segmenter_name", choices=SEGMENTERS, default="sem", help="Tokenization and sentence splitting: SEM, or regular expressions without SEM for brat and json outputs (default: %(default)s).")
+    parser.add_argument("--window-overlap", type=int, default=32, help="Number of subword tokens shared by the windows of sentences longer than the model (default: %(default)s).")
+    parser.add_argument("--cache-size", type=int, default=100000, help="Number of predicted sentences kept in memory to skip repeated ones, 0 to disable the cache (default: %(default)s).")
+    parser.add_argument("--cache-path", help="SQLite file where predicted sentences are also kept across runs (default: memory only).")
+    parser.add_argument("--label-consistency", choices=RESOLUTIONS, help="Tag the unlabelled occurrences of the entities of every document, the type of forms predicted with several types being the most frequent, the first or none (default: off).")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,194 @@
+"""Cache of predicted tags by sentence, for corpora that repeat themselves
+(mastheads, rubric headers, advertisements, reprinted dispatches).
+
+Entries are keyed on the tokens of a sentence, in Unicode normal form C, and
+belong to a model fingerprint: the names, sizes and modification times of the
+files of the model folder and the prediction options. A small in-memory LRU
+tier is backed by an optional SQLite file shared across runs and processes;
+when the files of a model folder change, the entries of its previous
+fingerprint are deleted from the file.
+"""
+
+import collections
+import hashlib
+import json
+import pathlib
+import sqlite3
+import unicodedata
+
+
+def model_fingerprint(model_path, **options):
+    """Return a digest of the files of `model_path` (names, sizes and
+    modification times) and of the prediction `options`.
+    """
+
+    root = pathlib.Path(model_path).resolve()
+    files = []
+    for path in sorted(root.rglob("*")):
+        if path.is_file():
+            stat = path.stat()
+            files.append([str(path.relative_to(root)), stat.st_size, stat.st_mtime_ns])
+    description = json.dumps([files, sorted(options.items())], default=str)
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+def sentence_key(sentence):
+    return "\x1f".join(unicodedata.normalize("NFC", word) for word in sentence)
+
+
+class PredictionCache:
+    """Tags of the sentences predicted by the model at `model_path`, with at
+    most `max_size` sentences in memory and, if `path` is given, all of them in
+    a SQLite file.
+    """
+
+    def __init__(self, model_path, max_size=100000, path=None, **options):
+        self.model_path = str(pathlib.Path(model_path).resolve())
+        self.fingerprint = model_fingerprint(model_path, **options)
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.counts = collections.Counter()  # hits, disk_hits, duplicates, predicted
+        self.predict_seconds = 0.0
+        # prediction time and sentences of previous runs, for the time saved
+        self.previous = (0.0, 0)
+        self.saved = (0.0, 0)  # prediction time and sentences already added to the file
+        self.connection = None
+        if path is not None:
+            self._open(path)
+
+    def _open(self, path):
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # several processes may share the file, with one writer at a time
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS models (path TEXT PRIMARY KEY, fingerprint TEXT, seconds REAL, sentences INTEGER)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (fingerprint TEXT, key BLOB, tags TEXT, PRIMARY KEY (fingerprint, key))"
+        )
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT fingerprint, seconds, sentences FROM models WHERE path = ?", (self.model_path,)
+            ).fetchone()
+            if row is not None and row[0] == self.fingerprint:
+                self.previous = row[1:]
+            elif row is not None:
+                # the model was trained again or exported again in place
+                self.connection.execute("DELETE FROM predictions WHERE fingerprint = ?", row[:1])
+            self.connection.execute(
+                "INSERT OR REPLACE INTO models (path, fingerprint, seconds, sentences) VALUES (?, ?, ?, ?)",
+                (self.model_path, self.fingerprint, *self.previous),
+            )
+
+    def _disk_key(self, key):
+        return hashlib.sha1(key.encode("utf-8")).digest()
+
+    def get(self, key):
+        """Return the tags cached for the sentence `key` (see
+        `sentence_key`), or None.
+        """
+
+        tags = self.entries.get(key)
+        if tags is not None:
+            self.entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return list(tags)
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT tags FROM predictions WHERE fingerprint = ? AND key = ?",
+                (self.fingerprint, self._disk_key(key)),
+            ).fetchone()
+            if row is not None:
+                tags = json.loads(row[0])
+                self._remember(key, tags)
+                self.counts["disk_hits"] += 1
+                return tags
+        return None
+
+    def _remember(self, key, tags):
+        self.entries[key] = tuple(tags)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def update(self, items, seconds, duplicates=0):
+        """Store the (key, tags) `items` predicted in `seconds`, while
+        `duplicates` other sentences were copies of them.
+        """
+
+        items = list(items)
+        for key, tags in items:
+            self._remember(key, tags)
+        if self.connection is not None and items:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO predictions (fingerprint, key, tags) VALUES (?, ?, ?)",
+                    [(self.fingerprint, self._disk_key(key), json.dumps(tags)) for key, tags in items],
+                )
+        self.counts["predicted"] += len(items)
+        self.counts["duplicates"] += duplicates
+        self.predict_seconds += seconds
+
+    def stats(self):
+        """Return the number of sentences looked up, found in memory, found on
+        disk, collapsed with a duplicate and predicted, the hit rate and an
+        estimate of the prediction time saved.
+        """
+
+        counts = self.counts
+        saved = counts["hits"] + counts["disk_hits"] + counts["duplicates"]
+        sentences = saved + counts["predicted"]
+        seconds, predicted = self.predict_seconds + self.previous[0], counts["predicted"] + self.previous[1]
+        seconds_per_sentence = seconds / predicted if predicted else 0.0
+        return {
+            "sentences": sentences,
+            "hits": counts["hits"],
+            "disk_hits": counts["disk_hits"],
+            "duplicates": counts["duplicates"],
+            "predicted": counts["predicted"],
+            "hit_rate": saved / sentences if sentences else 0.0,
+            "predict_seconds": self.predict_seconds,
+            "saved_seconds": saved * seconds_per_sentence,
+        }
+
+    def save_timing(self):
+        """Add the prediction time of this run since the last call to the
+        SQLite file. The totals are incremented in SQL, as other processes
+        may add theirs meanwhile.
+        """
+
+        seconds = self.predict_seconds - self.saved[0]
+        sentences = self.counts["predicted"] - self.saved[1]
+        with self.connection:
+            self.connection.execute(
+                "UPDATE models SET seconds = seconds + ?, sentences = sentences + ? WHERE path = ? AND fingerprint = ?",
+                (seconds, sentences, self.model_path, self.fingerprint),
+            )
+        self.saved = (self.predict_seconds, self.counts["predicted"])
+
+    def close(self):
+        if self.connection is not None:
+            self.save_timing()
+            self.connection.close()
+            self.connection = None
+
+
+def format_stats(stats):
+    return (
+        f"prediction cache: {stats['sentences']} sentences, {stats['hits']} in memory, {stats['disk_hits']} on disk,"
+        f" {stats['duplicates']} duplicates, {stats['predicted']} predicted (hit rate {stats['hit_rate']:.1%}),"
+        f" {stats['predict_seconds']:.1f} s predicting, about {stats['saved_seconds']:.1f} s saved"
+    )
+
+
+def merge_stats(statss):
+    """Return the sum of the stats of several caches, e.g. one per worker."""
+
+    statss = list(statss)
+    merged = {
+        key: sum(stats[key] for stats in statss)
+        for key in ("sentences", "hits", "disk_hits", "duplicates", "predicted", "predict_seconds", "saved_seconds")
+    }
+    merged["hit_rate"] = (merged["sentences"] - merged["predicted"]) / merged["sentences"] if merged["sentences"] else 0.0
+    return merged
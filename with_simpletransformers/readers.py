@@ -0,0 +1,331 @@
+"""Streaming readers for the corpus formats used to train NER models.
+
+Files are read by chunks of lines and each corpus is directly stored as typed
+columns: sentence ids are int32, words are interned (every occurrence of a word
+is the same python string) and labels are categorical. The list of
+`[sentence_id, word, label]` lists is only built when a caller asks for it.
+
+The label counts of a corpus are recorded in a small `.labels.json` sidecar,
+in the cache folder of parsed corpora or, when asked to, next to the corpus,
+so that its label set is known without reading it again as long as the file
+does not change.
+"""
+
+import array
+import json
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+import corpus_cache
+
+
+CHUNK_SIZE = 1 << 20  # number of bytes read at once when streaming a file
+LABELS_SUFFIX = ".labels.json"
+
+
+class ColumnBuilder:
+    """Accumulate the tokens of a corpus as typed columns.
+
+    Words and labels are stored as int32 codes into a vocabulary, which both
+    interns words and allows labels to be categorical without any extra pass
+    over the data.
+    """
+
+    def __init__(self):
+        self.sentence_ids = array.array("i")
+        self.word_codes = array.array("i")
+        self.label_codes = array.array("i")
+        self.word2code = {}
+        self.label2code = {}
+
+    def __len__(self):
+        return len(self.sentence_ids)
+
+    def append(self, sent_id, word, label):
+        word_code = self.word2code.get(word)
+        if word_code is None:
+            word_code = self.word2code[word] = len(self.word2code)
+        label_code = self.label2code.get(label)
+        if label_code is None:
+            label_code = self.label2code[label] = len(self.label2code)
+        self.sentence_ids.append(sent_id)
+        self.word_codes.append(word_code)
+        self.label_codes.append(label_code)
+
+    def columns(self):
+        """Return the columns as a dictionary of numpy arrays and lists, as
+        expected by `columns_to_frame`.
+        """
+
+        return {
+            "sentence_ids": np.frombuffer(self.sentence_ids, dtype=np.int32),
+            "word_codes": np.frombuffer(self.word_codes, dtype=np.int32),
+            "label_codes": np.frombuffer(self.label_codes, dtype=np.int32),
+            "vocabulary": list(self.word2code),
+            "labels": list(self.label2code),
+        }
+
+    def to_frame(self):
+        return columns_to_frame(**self.columns())
+
+
+def count_labels(label_codes, labels):
+    """Return the number of occurrences of every label, from the label codes
+    of a corpus.
+    """
+
+    counts = np.bincount(np.asarray(label_codes), minlength=len(labels))
+    return {label: int(count) for label, count in zip(labels, counts)}
+
+
+def columns_to_frame(sentence_ids, word_codes, label_codes, vocabulary, labels):
+    """Return the corpus as the dataFrame simpletransformers expects, with
+    columns sentence_id (int32), words (interned strings) and labels
+    (categorical).
+    """
+
+    words = np.empty(len(vocabulary), dtype=object)
+    words[:] = vocabulary
+    return pd.DataFrame(
+        {
+            "sentence_id": np.asarray(sentence_ids, dtype=np.int32),
+            "words": words[word_codes],
+            "labels": pd.Categorical.from_codes(np.asarray(label_codes), categories=labels),
+        }
+    )
+
+
+def iter_lines(path):
+    """Yield the stripped lines of a file, reading it by chunks of about
+    CHUNK_SIZE bytes.
+    """
+
+    with open(path, encoding="utf-8") as input_stream:
+        for lines in iter(lambda: input_stream.readlines(CHUNK_SIZE), []):
+            for line in lines:
+                yield line.strip()
+
+
+def to_data(df):
+    """Return the list of `[sentence_id, word, label]` lists for a corpus
+    dataFrame.
+    """
+
+    return [
+        [int(sent_id), word, label]
+        for sent_id, word, label in zip(df["sentence_id"], df["words"], df["labels"])
+    ]
+
+
+def to_sentences(df):
+    """Return the sentences (lists of words) of a corpus DataFrame and the
+    matching lists of labels.
+    """
+
+    sentence_ids = df["sentence_id"].to_numpy()
+    boundaries = np.flatnonzero(sentence_ids[1:] != sentence_ids[:-1]) + 1
+    words = np.split(df["words"].to_numpy(dtype=object), boundaries)
+    labels = np.split(df["labels"].to_numpy(dtype=object), boundaries)
+    return [sentence.tolist() for sentence in words], [sentence.tolist() for sentence in labels]
+
+
+def _output(df, return_data):
+    if return_data:
+        return to_data(df), df
+    return df
+
+
+def parse_conll(path, columns=None):
+    """Parse a CoNLL file with no metadata into a ColumnBuilder."""
+
+    word_column, label_column = columns or [0, -1]
+    builder = ColumnBuilder()
+    sent_id = 0
+    for line in iter_lines(path):
+        if not line:
+            sent_id += 1
+            continue
+        parts = line.split("\t")
+        builder.append(sent_id, parts[word_column], parts[label_column])
+    return builder
+
+
+def parse_presto(path, columns=None):
+    """Parse a presto file into a ColumnBuilder."""
+
+    fields = ["form", "lemma", "POS", "O", "O", "O", "O", "_"]
+    word_column, label_column = columns or [0, -1]
+    builder = ColumnBuilder()
+    sent_id = 0
+    prev = None
+    for line in iter_lines(path):
+        parts = line.split("\t")
+        if not line:
+            sent_id += 1
+            prev = line
+            continue
+        elif parts[0].endswith(".tsv") and parts[1] == "xxx":
+            if prev:
+                sent_id += 1
+            prev = line
+            continue
+        elif parts == fields:
+            prev = line
+            continue
+        builder.append(sent_id, parts[word_column], parts[label_column])
+        prev = line
+    return builder
+
+
+def read_conll(path, columns=None, return_data=False):
+    """Read a CoNLL file with no metadata and returns the corpus represented as
+    a pandas dataFrame. The dataFrame has three columns: sentence_id, words and
+    labels. This is the expected corpus format with simpletransformers.
+
+    If `return_data` is True, the list of `[sentence_id, word, label]` lists is
+    also built and a `(data, df)` couple is returned.
+    """
+
+    return _output(parse_conll(path, columns=columns).to_frame(), return_data)
+
+
+def read_presto(path, columns=None, return_data=False):
+    """Read a presto file and returns the corpus represented as a pandas
+    dataFrame. The dataFrame has three columns: sentence_id, words and labels.
+    This is the expected corpus format with simpletransformers.
+
+    If `return_data` is True, the list of `[sentence_id, word, label]` lists is
+    also built and a `(data, df)` couple is returned.
+    """
+
+    return _output(parse_presto(path, columns=columns).to_frame(), return_data)
+
+
+def labels_path(path, data_format, columns=None, cache_dir=None, next_to_corpus=False):
+    """Return the path of the label counts sidecar of a corpus: in
+    `cache_dir` if given, else next to the corpus if `next_to_corpus`, else
+    None (no sidecar).
+    """
+
+    path = pathlib.Path(path)
+    if cache_dir is not None:
+        return pathlib.Path(cache_dir) / (corpus_cache.cache_key(path, data_format, columns) + LABELS_SUFFIX)
+    if next_to_corpus:
+        return path.with_name(path.name + LABELS_SUFFIX)
+    return None
+
+
+def _labels_key(path, data_format, columns):
+    return {
+        "format": data_format.lower(),
+        "columns": list(columns or [0, -1]),
+        "signature": corpus_cache.stat_signature(path),
+    }
+
+
+def read_label_counts(path, data_format, columns=None, cache_dir=None, next_to_corpus=False):
+    """Return the label counts recorded for the corpus at `path` (see
+    `labels_path`), or None if there are none or if the corpus changed since.
+    """
+
+    sidecar = labels_path(path, data_format, columns, cache_dir=cache_dir, next_to_corpus=next_to_corpus)
+    if sidecar is None:
+        return None
+    try:
+        with open(sidecar, encoding="utf-8") as input_stream:
+            meta = json.load(input_stream)
+    except (OSError, ValueError):
+        return None
+    if meta.get("key") != _labels_key(path, data_format, columns):
+        return None
+    return meta["counts"]
+
+
+def write_label_counts(path, data_format, columns, counts, cache_dir=None, next_to_corpus=False):
+    """Record the label counts of the corpus at `path` (see `labels_path`).
+    Nothing is written if the folder of the sidecar is read-only.
+    """
+
+    sidecar = labels_path(path, data_format, columns, cache_dir=cache_dir, next_to_corpus=next_to_corpus)
+    if sidecar is None:
+        return
+    tmp_path = sidecar.with_name(f".{sidecar.name}.{os.getpid()}.tmp")
+    try:
+        sidecar.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as output_stream:
+            json.dump({"key": _labels_key(path, data_format, columns), "counts": counts}, output_stream, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, sidecar)
+    except OSError:
+        pass
+
+
+def read_columns(path, data_format, columns=None, cache_dir=None, labels_next_to_corpus=False):
+    """Parse a corpus (or load it from `cache_dir`) into the columns expected
+    by `columns_to_frame`, recording its label counts if needed (see
+    `labels_path`).
+    """
+
+    data_format = data_format.lower()
+    if cache_dir is None:
+        parsed = format2parser[data_format](path, columns=columns).columns()
+    else:
+        key = corpus_cache.cache_key(path, data_format, columns)
+        parsed = corpus_cache.load(cache_dir, key, path)
+        if parsed is None:
+            parsed = format2parser[data_format](path, columns=columns).columns()
+            corpus_cache.save(cache_dir, key, path, parsed)
+
+    if read_label_counts(path, data_format, columns, cache_dir=cache_dir, next_to_corpus=labels_next_to_corpus) is None:
+        counts = count_labels(parsed["label_codes"], parsed["labels"])
+        write_label_counts(path, data_format, columns, counts, cache_dir=cache_dir, next_to_corpus=labels_next_to_corpus)
+    return parsed
+
+
+def read_data(path, data_format, columns=None, cache_dir=None, labels_next_to_corpus=False):
+    """Read a file to give the pandas dataFrame simpletransformers expects to
+    work with.
+
+    If `cache_dir` is given, the parsed corpus is stored there in a binary
+    format and loaded back (memory-mapped) as long as the file, the format and
+    the columns do not change. Its label counts are recorded there too or,
+    without `cache_dir`, next to the corpus with `labels_next_to_corpus`.
+    """
+
+    parsed = read_columns(path, data_format, columns=columns, cache_dir=cache_dir, labels_next_to_corpus=labels_next_to_corpus)
+    return columns_to_frame(**parsed)
+
+
+def frame_label_counts(df):
+    """Return the number of occurrences of every label of a DataFrame
+    returned by `read_data`, whose labels are categorical.
+    """
+
+    labels = df["labels"]
+    return count_labels(labels.cat.codes.to_numpy(), list(labels.cat.categories))
+
+
+def label_counts(path, data_format, columns=None, cache_dir=None, labels_next_to_corpus=False):
+    """Return the number of occurrences of every label of a corpus. They are
+    read from its sidecar when it is up to date, the corpus is only parsed
+    otherwise.
+    """
+
+    counts = read_label_counts(path, data_format, columns, cache_dir=cache_dir, next_to_corpus=labels_next_to_corpus)
+    if counts is None:
+        parsed = read_columns(path, data_format, columns=columns, cache_dir=cache_dir, labels_next_to_corpus=labels_next_to_corpus)
+        counts = count_labels(parsed["label_codes"], parsed["labels"])
+    return counts
+
+
+format2function = {
+    "conll": read_conll,
+    "presto": read_presto,
+}
+
+format2parser = {
+    "conll": parse_conll,
+    "presto": parse_presto,
+}
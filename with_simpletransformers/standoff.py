@@ -0,0 +1,187 @@
+"""Segmentation of French text and standoff output of predictions without SEM.
+
+Tokens are found by a regular expression and kept as two arrays of character
+offsets; sentences are runs of tokens, given by the indices of their first
+token. Predicted tags are decoded into entity spans with array operations, so
+that no object is built per token besides the words given to the model, and
+entities are written in BRAT or JSON standoff format, with the same output as
+the SEM pipeline of `ner_french_predict.py`.
+"""
+
+import json
+import pathlib
+import re
+import sys
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "with_transformers"))
+
+from decoding import entity_spans  # noqa: E402
+
+
+TOKEN_PATTERN = re.compile(
+    r"""
+    https?://[^\s<>"]*[^\s<>".,;:!?)»]          # URLs
+    | [\w.+-]+@[\w-]+(?:\.[\w-]+)+             # e-mail addresses
+    | aujourd['’]hui
+    | \b(?:[cdjlmnst]|qu|jusqu|lorsqu|puisqu|quoiqu|presqu)['’](?=\w)  # elisions: l', qu'
+    | (?:[^\W\d_]\.){2,}                       # acronyms: U.S.A.
+    | \d+(?:[.,]\d+)+                          # numbers with separators: 3,14
+    | \w+(?:-\w+)*                             # words, hyphenated compounds
+    | \.\.\.
+    | [^\w\s]                                  # any other character
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+LINE_PATTERN = re.compile(r"[^\r\n]+")
+PARAGRAPH_PATTERN = re.compile(r"\n[^\S\n]*\n")
+FINAL_PATTERN = re.compile(r"\.\.\.|[.!?…]")
+
+FINAL_PUNCTUATION = frozenset(".!?…")
+CLOSING_PUNCTUATION = frozenset("»”\"')]’")
+# tokens followed by a period that does not end a sentence
+ABBREVIATIONS = frozenset(
+    "M MM Mme Mmes Mlle Mlles Mgr Me Dr Pr St Ste Sts cf ex p pp vol chap av apr env etc".split()
+)
+
+
+def tokenize(text):
+    """Return the start and end offsets of the tokens of `text`, as arrays."""
+
+    offsets = np.fromiter(
+        (offset for match in TOKEN_PATTERN.finditer(text) for offset in match.span()),
+        dtype=np.int64,
+    )
+    return offsets[0::2], offsets[1::2]
+
+
+def split_sentences(text, starts, ends):
+    """Return the indices of the first token of every sentence of `text`,
+    followed by the number of tokens.
+
+    A sentence ends at a blank line, or at final punctuation (and the closing
+    quotes or brackets after it) followed by a token that does not start in
+    lower case, unless the period follows an abbreviation or an initial.
+    """
+
+    n_tokens = len(starts)
+    if n_tokens == 0:
+        return np.zeros(1, dtype=np.int64)
+
+    paragraphs = np.array([match.start() for match in PARAGRAPH_PATTERN.finditer(text)], dtype=np.int64)
+    bounds = {0, n_tokens}
+    bounds.update(np.searchsorted(starts, paragraphs).tolist())
+
+    # tokens of final punctuation, about one per sentence, are looked at one
+    # by one; periods within tokens (numbers, acronyms, URLs) are left out
+    positions = np.array([match.start() for match in FINAL_PATTERN.finditer(text)], dtype=np.int64)
+    candidates = np.searchsorted(starts, positions)
+    candidates = candidates[(candidates < n_tokens) & (starts[np.minimum(candidates, n_tokens - 1)] == positions)]
+    for i in candidates.tolist():
+        token = text[starts[i]: ends[i]]
+        if token == "." and i > 0 and ends[i - 1] == starts[i]:
+            previous = text[starts[i - 1]: ends[i - 1]]
+            if previous in ABBREVIATIONS or (len(previous) == 1 and previous.isupper()):
+                continue
+        last = i
+        while last + 1 < n_tokens and (
+            text[starts[last + 1]] in FINAL_PUNCTUATION or text[starts[last + 1]] in CLOSING_PUNCTUATION
+        ):
+            last += 1
+        if last + 1 < n_tokens and not text[starts[last + 1]].islower():
+            bounds.add(last + 1)
+    return np.array(sorted(bounds), dtype=np.int64)
+
+
+def decode_entities(tags, sentence_bounds):
+    """Return the first and last token indices and the types of the entities
+    of a sequence of BIO (or IO) tags, see `decoding.entity_spans`; an entity
+    also begins at the start of every sentence.
+    """
+
+    names, codes = np.unique(np.asarray(tags, dtype=object).astype(str), return_inverse=True)
+    return entity_spans(codes, names.tolist(), sentence_bounds[:-1])
+
+
+def format_brat(entities):
+    """Return `entities` (dictionaries with their type, character offsets and
+    text) in BRAT standoff format. An entity spanning several lines is written
+    as one fragment per line, as BRAT does, so that every entity stays on one
+    line.
+    """
+
+    lines = []
+    for i, entity in enumerate(entities, 1):
+        start, text = entity["start"], entity["text"]
+        spans = f"{start} {entity['end']}"
+        if "\n" in text or "\r" in text:
+            fragments = list(LINE_PATTERN.finditer(text))
+            spans = ";".join(f"{start + match.start()} {start + match.end()}" for match in fragments)
+            text = " ".join(match.group() for match in fragments)
+        lines.append(f"T{i}\t{entity['type']} {spans}\t{text}\n")
+    return "".join(lines)
+
+
+def format_json(name, entities):
+    """Return the `entities` of the document `name` as JSON."""
+
+    return json.dumps({"name": name, "entities": entities}, ensure_ascii=False)
+
+
+class Document:
+    """A text segmented into tokens and sentences by `tokenize` and
+    `split_sentences`, and its entities once predictions are added.
+    """
+
+    def __init__(self, name, content):
+        self.name = name
+        self.content = content
+        self.starts, self.ends = tokenize(content)
+        self.sentence_bounds = split_sentences(content, self.starts, self.ends)
+        self.entity_starts = np.zeros(0, dtype=np.int64)
+        self.entity_ends = np.zeros(0, dtype=np.int64)
+        self.entity_types = np.zeros(0, dtype=str)
+
+    @property
+    def n_tokens(self):
+        return len(self.starts)
+
+    def sentences(self):
+        """Return the sentences as lists of words, as given to the model."""
+
+        content = self.content
+        words = [content[start: end] for start, end in zip(self.starts.tolist(), self.ends.tolist())]
+        bounds = self.sentence_bounds.tolist()
+        return [words[start: end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def add_predictions(self, tagss):
+        """Set the entities of the document from the predicted tags of every
+        sentence.
+        """
+
+        tags = [tag for tags in tagss for tag in tags]
+        if len(tags) != self.n_tokens:
+            raise ValueError(f"{len(tags)} tags for {self.n_tokens} tokens")
+        first, last, self.entity_types = decode_entities(tags, self.sentence_bounds)
+        self.entity_starts = self.starts[first]
+        self.entity_ends = self.ends[last]
+
+    def entities(self):
+        """Return the entities as a list of dictionaries with their type,
+        character offsets and text.
+        """
+
+        content = self.content
+        return [
+            {"type": entity_type, "start": start, "end": end, "text": content[start: end]}
+            for entity_type, start, end in zip(
+                self.entity_types.tolist(), self.entity_starts.tolist(), self.entity_ends.tolist()
+            )
+        ]
+
+    def to_brat(self):
+        return format_brat(self.entities())
+
+    def to_json(self):
+        return format_json(self.name, self.entities())
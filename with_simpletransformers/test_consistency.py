@@ -0,0 +1,28 @@
+import pytest
+
+import consistency
+from consistency import propagate
+
+
+@pytest.mark.parametrize("automaton", ["python", "pyahocorasick"])
+def test_propagate_overlapping_occurrences(automaton, monkeypatch):
+    if automaton == "python":
+        monkeypatch.setattr(consistency, "ahocorasick", None)
+    elif consistency.ahocorasick is None:
+        pytest.skip("pyahocorasick is not installed")
+    sentences = [
+        ["Le", "Moniteur", "parle", "."],
+        ["Moniteur", "de", "Paris"],
+        ["Le", "Moniteur", "de", "Paris", "et", "Le", "Moniteur", "."],
+    ]
+    tagss = [
+        ["B-prod", "I-prod", "O", "O"],
+        ["B-org", "I-org", "I-org"],
+        ["O"] * 8,
+    ]
+
+    tagss, added = propagate(sentences, tagss)
+
+    # "Moniteur de Paris" is longer than "Le Moniteur", which starts first
+    assert tagss[2] == ["O", "B-org", "I-org", "I-org", "O", "B-prod", "I-prod", "O"]
+    assert added == 2
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import TensorDataset
+
+from training import IGNORED_LABEL, CountingDataLoader, PaddingTrimmer, split_long_sentences
+
+from batching import BatchStats, LengthBucketBatchSampler
+
+
+class CharTokenizer:
+    """One subword per character."""
+
+    def tokenize(self, word):
+        return list(word)
+
+
+def test_split_long_sentences_categorical_labels():
+    words = ["a", "bb", "c", "dd", "e", "ff", "g"]
+    labels = ["O", "B-pers", "I-pers", "O", "B-loc", "O", "O"]
+    df = pd.DataFrame(
+        {
+            "sentence_id": np.zeros(len(words), dtype=np.int32),
+            "words": words,
+            "labels": pd.Categorical(labels, categories=["B-loc", "B-pers", "I-pers", "O"]),
+        }
+    )
+
+    windows = split_long_sentences(df, CharTokenizer(), max_seq_length=3 + 5, overlap=2)
+
+    assert windows["sentence_id"].nunique() > 1
+    assert isinstance(windows["labels"].dtype, pd.CategoricalDtype)
+    # every word is trained on in exactly one window
+    owned = windows[windows["labels"] != IGNORED_LABEL]
+    assert owned["words"].tolist() == words
+    assert owned["labels"].astype(str).tolist() == labels
+
+
+def test_counting_data_loader_counts_batches_of_workers():
+    lengths = [3, 5, 2, 8, 4, 6]
+    input_mask = torch.zeros(len(lengths), 10, dtype=torch.long)
+    for i, length in enumerate(lengths):
+        input_mask[i, :length] = 1
+    input_ids = torch.ones_like(input_mask)
+    dataset = TensorDataset(input_ids, input_mask, torch.zeros_like(input_mask), input_ids)
+    stats = BatchStats()
+    loader = CountingDataLoader(
+        dataset,
+        batch_sampler=LengthBucketBatchSampler(lengths, batch_size=2),
+        collate_fn=PaddingTrimmer(),
+        num_workers=2,
+        stats=stats,
+    )
+
+    batches = list(loader)
+
+    assert stats.n_batches == len(batches) == 3
+    assert stats.n_tokens == sum(lengths)
+    assert stats.n_padded == sum(batch[1].numel() for batch in batches) == 2 * (3 + 5 + 8)
@@ -0,0 +1,610 @@
+"""A simpletransformers NERModel with the training extensions used by the
+tutorial scripts.
+
+simpletransformers builds its training DataLoader inside `NERModel.train`,
+from features padded to `max_seq_length`. The DataLoader of the training set
+is replaced here, which allows length-bucketed batches whose padding is cut
+down to their longest sentence. Training sentences longer than
+`max_seq_length` are cut into windows beforehand rather than truncated.
+Features are converted by a pool of processes and, given a `feature_cache_dir`,
+cached under a key computed from the content of the data, the tokenizer and
+the labels; those of evaluation sets are also kept in memory, so that
+evaluating every N steps during training does not convert them again.
+Given a `Profiler` (see `with_transformers/profiling.py`), the conversion of
+the data into features and every stage of training are timed.
+
+Checkpoints saved every `save_steps` steps hold the optimizer, the scheduler
+and the random state along with the model; they are written to a temporary
+folder renamed when complete, and only the last `keep_checkpoints` are kept.
+A model created from a checkpoint (see `find_checkpoint`) resumes training at
+the batch following it, the order of batches depending only on the seed and
+the epoch.
+"""
+
+import contextlib
+import hashlib
+import json
+import math
+import os
+import pathlib
+import random
+import re
+import shutil
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, RandomSampler, TensorDataset
+
+from simpletransformers.ner import NERModel
+from simpletransformers.ner import ner_model
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "with_transformers"))
+
+from batching import BatchStats, LengthBucketBatchSampler  # noqa: E402
+from windows import owned_spans, window_spans  # noqa: E402
+
+
+BATCHING_MODES = ("random", "bucket", "tokens")
+CLASS_WEIGHTING = ("none", "inverse", "sqrt")
+# checkpoints of simpletransformers: every `save_steps` steps and at the end of
+# epochs with `save_model_every_epoch`
+CHECKPOINT_PATTERN = re.compile(r"checkpoint-(\d+)(-epoch-\d+)?$")
+TRAINING_STATE = "training_state.pt"
+# label of the words of a training window owned by another window, left out
+# of the loss
+IGNORED_LABEL = "<ignored>"
+
+
+@contextlib.contextmanager
+def patched(module, name, value):
+    """Temporarily replace the attribute `name` of `module` by `value`."""
+
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+def class_weights(counts, labels, weighting="inverse"):
+    """Return the loss weight of every label of `labels` from the label
+    counts of the training set: proportional to the inverse of their frequency
+    ("inverse") or of its square root ("sqrt"), normalized so that the weighted
+    number of tokens is unchanged. Labels never seen get the largest weight.
+    Return None with "none".
+    """
+
+    if weighting == "none":
+        return None
+    if weighting not in CLASS_WEIGHTING:
+        raise ValueError(f"unknown class weighting {weighting!r}, expected one of {CLASS_WEIGHTING}")
+    frequencies = np.array([counts.get(label, 0) for label in labels], dtype=np.float64)
+    seen = frequencies[frequencies > 0]
+    frequencies[frequencies == 0] = seen.min() if len(seen) else 1.0
+    weights = 1.0 / frequencies if weighting == "inverse" else 1.0 / np.sqrt(frequencies)
+    weights *= frequencies.sum() / (weights * frequencies).sum()
+    return weights.tolist()
+
+
+def feature_chunksize(n_examples, process_count):
+    """Return the number of examples converted at once by a process: about
+    four chunks per process, to balance the work, but not less than 100
+    examples since the tokenizer is sent along with every chunk.
+    """
+
+    return max(math.ceil(n_examples / (4 * process_count)), 100)
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Return a hash of the vocabulary of a tokenizer, the same wherever it
+    was loaded from (e.g. the hub or a checkpoint).
+    """
+
+    vocabulary = sorted(tokenizer.get_vocab().items())
+    return hashlib.sha1(json.dumps([type(tokenizer).__name__, vocabulary]).encode("utf-8")).hexdigest()
+
+
+def feature_cache_key(df, tokenizer, labels, max_seq_length, model_type, split=False, overlap=0):
+    """Return the name of the cache entry of the features of a
+    simpletransformers DataFrame: it changes with the content of the data, the
+    tokenizer, the labels and the maximum sequence length. `split` tells the
+    features of a training set whose long sentences are cut into windows
+    sharing `overlap` subwords.
+    """
+
+    rows = pd.util.hash_pandas_object(df[["sentence_id", "words", "labels"]], index=False)
+    description = [
+        hashlib.sha1(rows.to_numpy().tobytes()).hexdigest(),
+        tokenizer_fingerprint(tokenizer),
+        list(labels),
+        max_seq_length,
+        model_type,
+        split,
+    ]
+    if overlap:
+        description.append(overlap)
+    return hashlib.sha1(json.dumps(description).encode("utf-8")).hexdigest()
+
+
+def sample_sentences(df, n_sentences, seed=0):
+    """Return `n_sentences` sentences of a simpletransformers DataFrame drawn
+    at random with `seed`, in their original order, or the whole DataFrame if
+    it has no more sentences.
+    """
+
+    sentence_ids = df["sentence_id"].unique()
+    if not n_sentences or len(sentence_ids) <= n_sentences:
+        return df
+    chosen = np.random.default_rng(seed).choice(sentence_ids, n_sentences, replace=False)
+    return df[df["sentence_id"].isin(chosen)].reset_index(drop=True)
+
+
+def split_long_sentences(df, tokenizer, max_seq_length, overlap=0):
+    """Cut the sentences of a simpletransformers DataFrame (sentence_id,
+    words, labels) whose subword tokens do not fit in `max_seq_length` into
+    windows that do, instead of letting simpletransformers drop their last
+    words. Windows get new sentence ids; with a positive `overlap`, words
+    shared by two windows appear in both but keep their label only in the
+    window that owns them (see `windows.owned_spans`), the other one getting
+    `IGNORED_LABEL`, so that no word is trained on twice.
+    """
+
+    if df.empty:
+        return df
+    words = df["words"].to_numpy().astype(str)
+    vocabulary, inverse = np.unique(words, return_inverse=True)
+    word_costs = np.fromiter((max(1, len(tokenizer.tokenize(word))) for word in vocabulary), dtype=np.int64)
+    costs = word_costs[inverse]
+
+    sentence_ids = df["sentence_id"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, sentence_ids[1:] != sentence_ids[:-1]])
+    ends = np.r_[starts[1:], len(sentence_ids)]
+    budget = max_seq_length - 3  # <s>, </s> and the extra </s> of RoBERTa-like models
+    long_sentences = np.flatnonzero(np.add.reduceat(costs, starts) > budget)
+    if len(long_sentences) == 0:
+        return df
+
+    # the readers return categorical labels, which only take known values
+    labels = df["labels"]
+    if overlap and isinstance(labels.dtype, pd.CategoricalDtype) and IGNORED_LABEL not in labels.cat.categories:
+        df = df.assign(labels=labels.cat.add_categories([IGNORED_LABEL]))
+
+    keep = np.ones(len(df), dtype=bool)
+    parts = []
+    next_id = int(sentence_ids.max()) + 1
+    for sentence in long_sentences:
+        start, end = starts[sentence], ends[sentence]
+        keep[start: end] = False
+        spans = window_spans(costs[start: end], budget, overlap)
+        for (window_start, window_end), (own_start, own_end) in zip(spans, owned_spans(spans)):
+            part = df.iloc[start + window_start: start + window_end].copy()
+            part["sentence_id"] = next_id
+            if overlap:
+                owned = np.arange(window_start, window_end)
+                owned = (owned >= own_start) & (owned < own_end)
+                part["labels"] = part["labels"].where(owned, IGNORED_LABEL)
+            parts.append(part)
+            next_id += 1
+    print(f"{len(long_sentences)} sentences longer than {max_seq_length} subwords cut into {len(parts)} windows")
+    return pd.concat([df[keep]] + parts, ignore_index=True)
+
+
+def checkpoints(output_dir):
+    """Return the complete checkpoints of `output_dir`, as (step, path)
+    pairs sorted by step.
+    """
+
+    found = []
+    for path in pathlib.Path(output_dir).glob("checkpoint-*"):
+        match = CHECKPOINT_PATTERN.match(path.name)
+        if match and (path / TRAINING_STATE).exists():
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+
+def find_checkpoint(output_dir):
+    """Return the path of the latest complete checkpoint of `output_dir`, or
+    None if there is none.
+    """
+
+    found = checkpoints(output_dir)
+    return str(found[-1][1]) if found else None
+
+
+def rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class RandomBatchSampler:
+    """Yield random batches of `batch_size` indices out of `n_items`, in an
+    order depending only on `seed` and the epoch, which is incremented at
+    every iteration.
+    """
+
+    def __init__(self, n_items, batch_size, seed=0):
+        self.n_items = n_items
+        self.batch_size = batch_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return math.ceil(self.n_items / self.batch_size)
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        order = torch.randperm(self.n_items, generator=generator).tolist()
+        for start in range(0, self.n_items, self.batch_size):
+            yield order[start: start + self.batch_size]
+
+
+class ResumedBatchSampler:
+    """Start the iterations of a batch sampler (with a `set_epoch` method) at
+    epoch `epoch`, the first one after `skip` batches. simpletransformers
+    skips the batches trained on before a checkpoint by iterating over them:
+    they are yielded empty, and collated to None, instead of being built.
+    """
+
+    def __init__(self, batch_sampler, epoch=0, skip=0):
+        self.batch_sampler = batch_sampler
+        self.epoch = epoch
+        self.skip = skip
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+        self.batch_sampler.set_epoch(self.epoch)
+        self.epoch += 1
+        skip, self.skip = self.skip, 0
+        for i, batch in enumerate(self.batch_sampler):
+            yield [] if i < skip else batch
+
+
+class CountingDataLoader(DataLoader):
+    """A DataLoader which, given `stats` (a `BatchStats`), counts the batches
+    as they are yielded, in the main process: collate functions run in the
+    worker processes.
+    """
+
+    def __init__(self, *args, stats=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+
+    def __iter__(self):
+        for batch in super().__iter__():
+            if self.stats is not None and batch is not None:
+                self.stats.update(batch[1])
+            yield batch
+
+
+class LazyDataLoader(CountingDataLoader):
+    """A CountingDataLoader whose iterator is only created when its first
+    batch is requested: the progress bar of simpletransformers calls `iter` on
+    it once more than needed, which would start workers and draw batches
+    (advancing the epoch of the sampler) for nothing.
+    """
+
+    def __iter__(self):
+        yield from super().__iter__()
+
+
+class PaddingTrimmer:
+    """Collate the items of simpletransformers' TensorDataset (input ids,
+    input mask, segment ids and label ids) and, if `trim` is True, cut the
+    positions that are padding for every sentence of the batch.
+    """
+
+    def __init__(self, trim=True):
+        self.trim = trim
+
+    def __call__(self, items):
+        if not items:  # skipped when resuming
+            return None
+        batch = [torch.stack(column) for column in zip(*items)]
+        if self.trim:
+            length = int(batch[1].sum(dim=1).max())
+            batch = [tensor[:, :length].contiguous() for tensor in batch]
+        return batch
+
+
+class TrainingNERModel(NERModel):
+    """A NERModel whose training batches are built according to `batching`:
+
+    - "random": random batches of `train_batch_size` sentences padded to
+      `max_seq_length`, as simpletransformers does;
+    - "bucket": batches of `train_batch_size` sentences of similar lengths;
+    - "tokens": batches of sentences of similar lengths of at most
+      `max_tokens` subword tokens, padding included.
+
+    The padding ratio and the number of tokens per second of training batches
+    are printed at the end of training and available in `batch_stats`. If a
+    `profiler` is given, the stages of training are recorded by it. If a
+    `feature_cache_dir` is given, the features of DataFrames are stored there
+    and reused as long as the data, the tokenizer and the labels do not
+    change. Only the last `keep_checkpoints` checkpoints are kept (all of
+    them if None). Training sentences longer than `max_seq_length` are cut
+    into windows sharing `window_overlap` subwords (see
+    `split_long_sentences`).
+    """
+
+    def __init__(
+        self,
+        *args,
+        batching="random",
+        max_tokens=4096,
+        profiler=None,
+        feature_cache_dir=None,
+        keep_checkpoints=None,
+        window_overlap=0,
+        **kwargs,
+    ):
+        model_args = kwargs.get("args")
+        if isinstance(model_args, dict):
+            use_multiprocessing = model_args.get("use_multiprocessing")
+        else:
+            use_multiprocessing = getattr(model_args, "use_multiprocessing", None)
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="use_multiprocessing automatically disabled")
+            super().__init__(*args, **kwargs)
+        # simpletransformers turns the process pool off for CamemBERT, whose
+        # sentencepiece tokenizer could not be pickled by old versions of
+        # transformers; it can now.
+        if use_multiprocessing is not None:
+            self.args.use_multiprocessing = use_multiprocessing
+        if batching not in BATCHING_MODES:
+            raise ValueError(f"unknown batching mode {batching!r}, expected one of {BATCHING_MODES}")
+        self.batching = batching
+        self.max_tokens = max_tokens
+        self.batch_stats = BatchStats()
+        self.profiler = profiler
+        self.feature_cache_dir = feature_cache_dir
+        self.eval_features = {}
+        self.keep_checkpoints = keep_checkpoints
+        self.window_overlap = window_overlap
+        self.train_key = None
+        self.resume_state = None
+        self.best_score = None
+
+    def _dataloader(self, dataset, sampler=None, batch_size=1, **kwargs):
+        # DataLoaders draw the seed of their workers from their own generator,
+        # so that the global random state only depends on training steps.
+        seed = self.args.manual_seed or 0
+        kwargs.setdefault("generator", torch.Generator().manual_seed(seed))
+        # only the training set is sampled randomly, evaluation during
+        # training keeps the DataLoader of simpletransformers.
+        if not isinstance(sampler, RandomSampler) or not hasattr(dataset, "tensors"):
+            return LazyDataLoader(dataset, sampler=sampler, batch_size=batch_size, **kwargs)
+
+        if self.batching == "random":
+            batch_sampler = RandomBatchSampler(len(dataset), batch_size, seed=seed)
+        else:
+            batch_sampler = LengthBucketBatchSampler(
+                dataset.tensors[1].sum(dim=1).numpy(),
+                batch_size=batch_size if self.batching == "bucket" else None,
+                max_tokens=self.max_tokens if self.batching == "tokens" else None,
+                seed=seed,
+            )
+        epoch = skip = 0
+        if self.resume_state is not None:
+            # as simpletransformers counts the steps to skip
+            steps_per_epoch = max(1, len(batch_sampler) // self.args.gradient_accumulation_steps)
+            epoch, skip = divmod(self.resume_state["global_step"], steps_per_epoch)
+        return LazyDataLoader(
+            dataset,
+            batch_sampler=ResumedBatchSampler(batch_sampler, epoch=epoch, skip=skip),
+            collate_fn=PaddingTrimmer(trim=self.batching != "random"),
+            stats=self.batch_stats,
+            **kwargs,
+        )
+
+    def _convert(self, data, evaluate=False, no_cache=False, to_predict=None):
+        """Convert examples to features with simpletransformers, with chunks
+        of `feature_chunksize` examples unless `multiprocessing_chunksize` is
+        set, and print the time it took. Words labelled `IGNORED_LABEL` get
+        the padding label id, left out of the loss.
+        """
+
+        if to_predict is not None or not isinstance(data, pd.DataFrame):
+            return super().load_and_cache_examples(data, evaluate=evaluate, no_cache=no_cache, to_predict=to_predict)
+
+        n_examples = data["sentence_id"].nunique()
+        process_count = self.args.process_count
+        parallel = self.args.use_multiprocessing_for_evaluation if evaluate else self.args.use_multiprocessing
+        chunksize = self.args.multiprocessing_chunksize
+        if chunksize == -1:
+            chunksize = feature_chunksize(n_examples, process_count)
+        labels = list(self.args.labels_list)
+        ignored = bool((data["labels"] == IGNORED_LABEL).any())
+        labels_list = labels + [IGNORED_LABEL] if ignored else labels
+        start = time.perf_counter()
+        with patched(self.args, "multiprocessing_chunksize", chunksize), patched(self.args, "labels_list", labels_list):
+            dataset = super().load_and_cache_examples(data, evaluate=evaluate, no_cache=True)
+        if ignored:
+            label_ids = dataset.tensors[3]
+            label_ids[label_ids == len(labels)] = self.pad_token_label_id
+        print(
+            f"{n_examples} sentences converted to features in {time.perf_counter() - start:.1f} s"
+            + (f" ({process_count} processes, chunks of {chunksize})" if parallel and process_count > 1 else "")
+        )
+        return dataset
+
+    def _cached_features(self, data, evaluate=False, no_cache=False, to_predict=None):
+        if (
+            no_cache
+            or to_predict is not None
+            or not isinstance(data, pd.DataFrame)
+            or (self.feature_cache_dir is None and not evaluate)
+        ):
+            return self._convert(data, evaluate=evaluate, no_cache=no_cache, to_predict=to_predict)
+
+        if evaluate or self.train_key is None:
+            key = feature_cache_key(data, self.tokenizer, self.args.labels_list, self.args.max_seq_length, self.args.model_type)
+        else:
+            key = self.train_key
+        if key in self.eval_features:
+            return self.eval_features[key]
+
+        path = self._feature_path(key)
+        if path is not None and path.exists():
+            print(f"features loaded from {path}")
+            dataset = TensorDataset(*torch.load(path))
+        else:
+            dataset = self._convert(data, evaluate=evaluate)
+        if path is not None and not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            try:
+                torch.save(list(dataset.tensors), tmp_path)
+                os.replace(tmp_path, path)
+            except OSError:
+                tmp_path.unlink(missing_ok=True)
+        if evaluate:
+            self.eval_features[key] = dataset
+        return dataset
+
+    def _feature_path(self, key):
+        if self.feature_cache_dir is None:
+            return None
+        return pathlib.Path(self.feature_cache_dir) / f"{key}.pt"
+
+    def load_and_cache_examples(self, data, evaluate=False, no_cache=False, to_predict=None):
+        if self.profiler is None:
+            return self._cached_features(data, evaluate=evaluate, no_cache=no_cache, to_predict=to_predict)
+        with self.profiler.stage("tokenize"):
+            return self._cached_features(data, evaluate=evaluate, no_cache=no_cache, to_predict=to_predict)
+
+    def train_model(self, train_data, *args, **kwargs):
+        if not isinstance(train_data, pd.DataFrame):
+            return super().train_model(train_data, *args, **kwargs)
+
+        # the features of the training set are cached under the key of the
+        # data before cutting long sentences, which tokenizes them
+        if self.feature_cache_dir is not None:
+            self.train_key = feature_cache_key(
+                train_data,
+                self.tokenizer,
+                self.args.labels_list,
+                self.args.max_seq_length,
+                self.args.model_type,
+                split=True,
+                overlap=self.window_overlap,
+            )
+        if self.train_key is None or not self._feature_path(self.train_key).exists():
+            train_data = split_long_sentences(train_data, self.tokenizer, self.args.max_seq_length, self.window_overlap)
+        try:
+            return super().train_model(train_data, *args, **kwargs)
+        finally:
+            self.train_key = None
+
+    def _restoring(self, get_scheduler):
+        """Wrap a scheduler factory of transformers to load the states of the
+        optimizer and of the scheduler of the checkpoint training resumes from.
+        """
+
+        def get_restored_scheduler(optimizer, *args, **kwargs):
+            scheduler = get_scheduler(optimizer, *args, **kwargs)
+            if self.resume_state is not None:
+                path = pathlib.Path(self.resume_state["path"])
+                optimizer.load_state_dict(torch.load(path / "optimizer.pt", map_location="cpu"))
+                scheduler.load_state_dict(torch.load(path / "scheduler.pt"))
+            return scheduler
+
+        return get_restored_scheduler
+
+    def _resume(self):
+        """Restore the random state saved in the checkpoint the model was
+        loaded from, if any, and the score of the best model saved so far.
+        """
+
+        path = pathlib.Path(self.args.model_name or "")
+        if not CHECKPOINT_PATTERN.match(path.name) or not (path / TRAINING_STATE).exists():
+            return
+        self.resume_state = torch.load(path / TRAINING_STATE, weights_only=False)
+        self.resume_state["path"] = str(path)
+        set_rng_state(self.resume_state["rng"])
+        print(f"resuming training from {path} (step {self.resume_state['global_step']})")
+
+        # simpletransformers forgets the best score when training again
+        results = pathlib.Path(self.args.best_model_dir) / "eval_results.txt"
+        if results.exists():
+            for line in results.read_text().splitlines():
+                key, _, value = line.partition(" = ")
+                if key == self.args.early_stopping_metric:
+                    self.best_score = float(value)
+
+    def _improves(self, results):
+        score = results.get(self.args.early_stopping_metric)
+        if self.best_score is None or score is None:
+            return True
+        if self.args.early_stopping_metric_minimize:
+            return score < self.best_score
+        return score > self.best_score
+
+    def train(self, *args, **kwargs):
+        self.batch_stats.reset()
+        self._resume()
+        if self.profiler is not None:
+            self.profiler.instrument(self.model)
+        scheduler_factory = f"get_{self.args.scheduler}"
+        try:
+            with patched(ner_model, "DataLoader", self._dataloader), patched(
+                ner_model, scheduler_factory, self._restoring(getattr(ner_model, scheduler_factory))
+            ):
+                output = super().train(*args, **kwargs)
+        finally:
+            if self.profiler is not None:
+                self.profiler.release()
+            self.resume_state = None
+            self.best_score = None
+        self.batch_stats.stop()
+        print("training batches:", self.batch_stats)
+        return output
+
+    def save_model(self, output_dir=None, optimizer=None, scheduler=None, model=None, results=None):
+        if results and output_dir == self.args.best_model_dir:
+            if not self._improves(results):
+                return
+            self.best_score = results.get(self.args.early_stopping_metric, self.best_score)
+        match = CHECKPOINT_PATTERN.match(pathlib.Path(output_dir or "").name)
+        if match is None or optimizer is None or model is None or self.args.no_save:
+            return super().save_model(output_dir, optimizer, scheduler, model=model, results=results)
+
+        # a checkpoint is complete, with its training state, before being
+        # renamed: an interrupted save leaves the previous ones untouched
+        path = pathlib.Path(output_dir)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        with patched(self.args, "save_optimizer_and_scheduler", True):
+            super().save_model(str(tmp_path), optimizer, scheduler, model=model, results=results)
+        torch.save({"global_step": int(match.group(1)), "rng": rng_state()}, tmp_path / TRAINING_STATE)
+        shutil.rmtree(path, ignore_errors=True)  # made empty by simpletransformers before evaluations
+        os.replace(tmp_path, path)
+
+        if self.keep_checkpoints is not None:
+            found = checkpoints(path.parent)
+            for _, old_path in found[: max(0, len(found) - self.keep_checkpoints)]:
+                shutil.rmtree(old_path, ignore_errors=True)
@@ -0,0 +1,196 @@
+"""Length-bucketed batching for token classification.
+
+Random batches are padded to their longest sentence, and HIPE sentences go
+from a few tokens to hundreds, so most of the compute is spent on padding.
+Here, sentences are sorted by length and cut into batches, either of a fixed
+number of sentences or of at most a given number of (padded) subword tokens.
+Batches are formed once and only their order is shuffled at each epoch, which
+keeps the number of batches per epoch constant.
+
+`BatchStats` records the padding ratio and the throughput in tokens per
+second, so the gain can be measured.
+"""
+
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from transformers import Trainer
+
+
+class LengthBucketBatchSampler(torch.utils.data.Sampler):
+    """Yield batches of indices of sentences of similar lengths.
+
+    Args:
+      lengths: the number of subword tokens of every sentence.
+      batch_size: the number of sentences per batch, if `max_tokens` is None.
+      max_tokens: the maximum number of tokens of a padded batch, that is the
+        number of sentences times the length of the longest one.
+      shuffle: whether the order of batches changes at each epoch.
+      seed: the seed of the random order, the epoch is added to it.
+    """
+
+    def __init__(self, lengths, batch_size=None, max_tokens=None, shuffle=True, seed=0):
+        if batch_size is None and max_tokens is None:
+            raise ValueError("either batch_size or max_tokens must be given")
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        # random tie-break so that sentences of the same length are not always
+        # batched together in file order.
+        rng = np.random.default_rng(seed)
+        order = np.lexsort((rng.random(len(self.lengths)), self.lengths))
+        self.batches = self._make_batches(order)
+
+    def _make_batches(self, order):
+        if self.max_tokens is None:
+            return [order[i: i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+        batches = []
+        start = 0
+        for end in range(1, len(order) + 1):
+            # lengths are sorted: the padded size of order[start:end] is
+            # (end - start) * lengths[order[end - 1]]
+            if end - start > 1 and (end - start) * self.lengths[order[end - 1]] > self.max_tokens:
+                batches.append(order[start: end - 1])
+                start = end - 1
+        if start < len(order):
+            batches.append(order[start:])
+        return batches
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        if self.shuffle:
+            permutation = np.random.default_rng(self.seed + self.epoch).permutation(len(self.batches))
+            self.epoch += 1
+        else:
+            permutation = range(len(self.batches))
+        for index in permutation:
+            yield self.batches[index].tolist()
+
+
+class BatchStats:
+    """Count real and padded tokens of batches to report the padding ratio and
+    the throughput.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n_batches = 0
+        self.n_tokens = 0
+        self.n_padded = 0
+        self.start = None
+        self.end = None
+
+    def update(self, attention_mask):
+        if self.start is None:
+            self.start = time.perf_counter()
+        self.n_batches += 1
+        self.n_tokens += int(attention_mask.sum())
+        self.n_padded += attention_mask.numel()
+        self.end = time.perf_counter()
+
+    def stop(self):
+        self.end = time.perf_counter()
+
+    @property
+    def padding_ratio(self):
+        return 1.0 - self.n_tokens / self.n_padded if self.n_padded else 0.0
+
+    @property
+    def tokens_per_second(self):
+        elapsed = (self.end or 0.0) - (self.start or 0.0)
+        return self.n_tokens / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return {
+            "batches": self.n_batches,
+            "tokens": self.n_tokens,
+            "padding_ratio": self.padding_ratio,
+            "tokens_per_second": self.tokens_per_second,
+        }
+
+    def __str__(self):
+        return (
+            f"{self.n_batches} batches, {self.n_tokens} tokens, "
+            f"padding ratio={self.padding_ratio * 100:.1f}%, "
+            f"{self.tokens_per_second:.1f} tokens/s"
+        )
+
+
+class BucketingTrainer(Trainer):
+    """A Trainer whose training (and evaluation) batches are length-bucketed.
+
+    `batching` is either "bucket" (batches of `per_device_train_batch_size`
+    sentences) or "tokens" (batches of at most `max_tokens` padded tokens).
+    Statistics of training batches are available in `batch_stats`.
+    """
+
+    def __init__(self, *args, batching="tokens", max_tokens=4096, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batching = batching
+        self.max_tokens = max_tokens
+        self.batch_stats = BatchStats()
+
+    def _bucketed_dataloader(self, dataset, batch_size, shuffle, description):
+        if hasattr(dataset, "column_names"):  # a datasets.Dataset
+            dataset = self._remove_unused_columns(dataset, description=description)
+        lengths = getattr(dataset, "lengths", None)
+        if lengths is None:
+            lengths = [len(input_ids) for input_ids in dataset["input_ids"]]
+        batch_sampler = LengthBucketBatchSampler(
+            lengths,
+            batch_size=batch_size if self.batching == "bucket" else None,
+            max_tokens=self.max_tokens if self.batching == "tokens" else None,
+            shuffle=shuffle,
+            seed=self.args.seed,
+        )
+        return DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+
+    def get_train_dataloader(self):
+        return self._bucketed_dataloader(
+            self.train_dataset, self.args.train_batch_size, shuffle=True, description="training"
+        )
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        # evaluation metrics do not depend on the order of sentences, unlike
+        # `predict` whose dataloader is left untouched.
+        if isinstance(eval_dataset, str):
+            eval_dataset = self.eval_dataset[eval_dataset]
+        elif eval_dataset is None:
+            eval_dataset = self.eval_dataset
+        return self._bucketed_dataloader(
+            eval_dataset, self.args.eval_batch_size, shuffle=False, description="evaluation"
+        )
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        # counted here, in the main process, rather than by the collator,
+        # which runs in the data loader workers
+        self.batch_stats.update(inputs["attention_mask"])
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def train(self, *args, **kwargs):
+        self.batch_stats.reset()
+        output = super().train(*args, **kwargs)
+        self.batch_stats.stop()
+        print("training batches:", self.batch_stats)
+        return output
@@ -0,0 +1,104 @@
+"""Compare the notebook's `tokenize_and_align_labels` with the vectorized,
+cached tokenization of `pretokenized.py` on a CoNLL corpus.
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from transformers import AutoTokenizer
+
+from pretokenized import PretokenizedDataset, load, save, tokenize_corpus
+
+
+def read_examples(path, tag_column=-1):
+    """Return the sentences of a CoNLL file and their label ids."""
+
+    tokens, tags = [], []
+    sentence, sentence_tags = [], []
+    label2id = {}
+    with open(path, encoding="utf-8") as input_stream:
+        for line in input_stream:
+            line = line.rstrip("\n")
+            if not line:
+                if sentence:
+                    tokens.append(sentence)
+                    tags.append(sentence_tags)
+                sentence, sentence_tags = [], []
+                continue
+            parts = line.split("\t")
+            sentence.append(parts[0])
+            sentence_tags.append(label2id.setdefault(parts[tag_column], len(label2id)))
+    if sentence:
+        tokens.append(sentence)
+        tags.append(sentence_tags)
+    return tokens, tags
+
+
+def tokenize_and_align_labels(tokenizer, tokens, tags, label_all_tokens=True, batch_size=1000):
+    """The notebook version, applied by batches like `datasets.map` does."""
+
+    all_input_ids, all_labels = [], []
+    for start in range(0, len(tokens), batch_size):
+        tokenized_inputs = tokenizer(tokens[start: start + batch_size], is_split_into_words=True)
+        for i, label in enumerate(tags[start: start + batch_size]):
+            word_ids = tokenized_inputs.word_ids(batch_index=i)
+            previous_word_idx = None
+            label_ids = []
+            for word_idx in word_ids:
+                if word_idx is None:
+                    label_ids.append(-100)
+                elif word_idx != previous_word_idx:
+                    label_ids.append(label[word_idx])
+                else:
+                    label_ids.append(label[word_idx] if label_all_tokens else -100)
+                previous_word_idx = word_idx
+            all_labels.append(label_ids)
+        all_input_ids.extend(tokenized_inputs["input_ids"])
+    return all_input_ids, all_labels
+
+
+def main(path, model_checkpoint="camembert-base", check=True):
+    tokenizer = AutoTokenizer.from_pretrained(model_checkpoint)
+    tokens, tags = read_examples(path)
+    print(f"{len(tokens)} sentences, {sum(map(len, tokens))} words")
+
+    start = time.perf_counter()
+    input_ids, labels = tokenize_and_align_labels(tokenizer, tokens, tags)
+    reference_time = time.perf_counter() - start
+    print(f"notebook loop:    {reference_time:.3f} s")
+
+    start = time.perf_counter()
+    arrays = tokenize_corpus(tokenizer, tokens, tags)
+    vectorized_time = time.perf_counter() - start
+    print(f"vectorized:       {vectorized_time:.3f} s (x{reference_time / vectorized_time:.1f})")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        save(f"{cache_dir}/corpus", arrays)
+        start = time.perf_counter()
+        dataset = PretokenizedDataset(load(f"{cache_dir}/corpus"))
+        cached_time = time.perf_counter() - start
+        print(f"cached (mmap):    {cached_time:.3f} s (x{reference_time / cached_time:.1f})")
+
+        if check:
+            offsets = dataset.offsets
+            for i, (sentence_ids, sentence_labels) in enumerate(zip(input_ids, labels)):
+                start, end = offsets[i], offsets[i + 1]
+                assert np.array_equal(dataset.input_ids[start:end], sentence_ids), i
+                assert np.array_equal(dataset.label_ids[start:end], sentence_labels), i
+            print("outputs are identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "path", nargs="?", default="hipe/train.conll", help="Path to the CoNLL file (default: %(default)s)."
+    )
+    parser.add_argument(
+        "-m", "--model-checkpoint", default="camembert-base", help="Tokenizer to use (default: %(default)s)."
+    )
+    parser.add_argument("--no-check", dest="check", action="store_false", help="Do not compare outputs.")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,102 @@
+"""Compare the notebook's `compute_metrics` (list comprehensions and seqeval)
+with the vectorized scorer of `scorer.py` on a CoNLL corpus.
+
+Predictions are simulated by replacing a fraction of the gold labels by
+random ones; sentences are padded with -100 as in the arrays given to
+`compute_metrics` by the `Trainer`.
+"""
+
+import argparse
+import time
+import warnings
+
+import numpy as np
+from seqeval.metrics import accuracy_score, classification_report
+
+from bench_pretokenized import read_examples
+from scorer import score
+
+
+def seqeval_metrics(predictions, labels, label_list):
+    """The notebook version, with the computations of the `seqeval` metric of
+    🤗 Datasets.
+    """
+
+    true_predictions = [
+        [label_list[p] for (p, l) in zip(prediction, label) if l != -100]
+        for prediction, label in zip(predictions, labels)
+    ]
+    true_labels = [
+        [label_list[l] for (p, l) in zip(prediction, label) if l != -100]
+        for prediction, label in zip(predictions, labels)
+    ]
+
+    report = classification_report(true_labels, true_predictions, output_dict=True)
+    results = {
+        name: {"precision": values["precision"], "recall": values["recall"], "f1": values["f1-score"], "number": values["support"]}
+        for name, values in report.items()
+        if name not in ("micro avg", "macro avg", "weighted avg")
+    }
+    results["overall_precision"] = report["micro avg"]["precision"]
+    results["overall_recall"] = report["micro avg"]["recall"]
+    results["overall_f1"] = report["micro avg"]["f1-score"]
+    results["overall_accuracy"] = accuracy_score(true_labels, true_predictions)
+    return results
+
+
+def padded_arrays(tags, n_labels, noise=0.1, seed=0):
+    """Return gold and "predicted" label ids padded with -100, the first
+    position of every sentence being ignored like a special token.
+    """
+
+    rng = np.random.default_rng(seed)
+    length = max(map(len, tags)) + 2
+    labels = np.full((len(tags), length), -100, dtype=np.int64)
+    for i, sentence_tags in enumerate(tags):
+        labels[i, 1: len(sentence_tags) + 1] = sentence_tags
+    predictions = labels.copy()
+    noisy = rng.random(labels.shape) < noise
+    predictions[noisy] = rng.integers(0, n_labels, size=int(noisy.sum()))
+    return predictions, labels
+
+
+def main(path, noise=0.1, repeat=3):
+    warnings.filterwarnings("ignore")  # seqeval warns about undefined metrics
+    tokens, tags = read_examples(path)
+    # label ids are given by read_examples in order of first occurrence
+    label2id = {}
+    with open(path, encoding="utf-8") as input_stream:
+        for line in input_stream:
+            if line.strip():
+                label2id.setdefault(line.rstrip("\n").split("\t")[-1], len(label2id))
+    label_list = list(label2id)
+    predictions, labels = padded_arrays(tags, len(label_list), noise=noise)
+    print(f"{len(tokens)} sentences, {sum(map(len, tokens))} words, padded to {labels.shape[1]}")
+
+    def best_time(function):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = function(predictions, labels, label_list)
+            times.append(time.perf_counter() - start)
+        return min(times), results
+
+    reference_time, reference = best_time(seqeval_metrics)
+    print(f"notebook + seqeval: {reference_time:.3f} s")
+    vectorized_time, results = best_time(score)
+    print(f"scorer.py:          {vectorized_time:.3f} s (x{reference_time / vectorized_time:.1f})")
+
+    assert results == reference, (results, reference)
+    print("results are identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "path", nargs="?", default="hipe/test.conll", help="Path to the CoNLL file (default: %(default)s)."
+    )
+    parser.add_argument("--noise", type=float, default=0.1, help="Fraction of labels replaced at random (default: %(default)s).")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best is kept (default: %(default)s).")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,452 @@
+# coding=utf-8
+# Copyright 2020 HuggingFace Datasets Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Lint as: python3
+"""Generic CoNLL corpus builder.
+
+Corpora are tab separated files, one token per line, sentences being separated
+by empty lines (and -DOCSTART- lines). The columns to read, the label set of
+every column and the corpus name are given by the config, e.g.
+
+    load_dataset("conll.py", data_files=..., columns={"tokens": 0, "ner_tags": 3})
+
+When the label set of a column is not given, its tags are stored as strings
+while the Arrow cache is written, the labels seen being recorded in a
+`<corpus>.labels.json` file next to it; the column is then cast to a `ClassLabel`
+when the dataset is loaded, so the files are read only once.
+
+The files of a split (a path, a glob or a list of them) are cut into byte
+ranges of about `shard_size` bytes ending on an empty line, so that no
+sentence is split between two ranges. Ranges are parsed by a pool of worker
+processes and their sentences are yielded in the order of the files and of
+the ranges, with guids numbered sequentially: the examples and their guids do
+not depend on the number of processes nor on the size of the ranges.
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+
+import datasets
+
+
+logger = datasets.logging.get_logger(__name__)
+
+LABELS_FILE = "{corpus}.labels.json"
+SHARD_SIZE = 16 << 20  # bytes
+
+
+_HIPE_CITATION = """\
+@inproceedings{ehrmann_extended_2020,
+  title = {Extended {Overview} of {CLEF HIPE} 2020: {Named Entity Processing} on {Historical Newspapers}},
+  booktitle = {{CLEF 2020 Working Notes}. {Working Notes} of {CLEF} 2020 - {Conference} and {Labs} of the {Evaluation Forum}},
+  author = {Ehrmann, Maud and Romanello, Matteo and Fl{\"u}ckiger, Alex and Clematide, Simon},
+  editor = {Cappellato, Linda and Eickhoff, Carsten and Ferro, Nicola and N{\'e}v{\'e}ol, Aur{\'e}lie},
+  year = {2020},
+  volume = {2696},
+  pages = {38},
+  publisher = {{CEUR-WS}},
+  address = {{Thessaloniki, Greece}},
+  doi = {10.5281/zenodo.4117566},
+  url = {https://infoscience.epfl.ch/record/281054},
+}
+}
+"""
+
+_HIPE_DESCRIPTION = """\
+HIPE (Identifying Historical People, Places and other Entities) is a evaluation campaign on named entity processing on historical newspapers in French, German and English, which was organized in the context of the impresso project and run as a CLEF 2020 Evaluation Lab.
+"""
+
+_PRESTO_CITATION = """\
+@inproceedings{gabay:hal-03187097,
+  TITLE = {{A dataset for automatic detection of places in (early) modern French texts}},
+  AUTHOR = {Gabay, Simon and Ortiz Su{\'a}rez, Pedro Javier},
+  URL = {https://hal.archives-ouvertes.fr/hal-03187097},
+  BOOKTITLE = {{NASSCFL 2021 - 50th Annual North American Society for Seventeenth-Century French Literature Conference}},
+  ADDRESS = {Iowa City / Virtual, United States},
+  ORGANIZATION = {{NASSCFL}},
+  PAGES = {5},
+  YEAR = {2021},
+  MONTH = May,
+  PDF = {https://hal.archives-ouvertes.fr/hal-03187097/file/NASSCFL.pdf},
+  HAL_ID = {hal-03187097},
+  HAL_VERSION = {v1},
+}
+"""
+
+_PRESTO_DESCRIPTION = """\
+Linguistically annotated corpora of modern French (16-18th c.)
+"""
+
+_FTB_CITATION = """\
+@inproceedings{gabay:hal-03187097,
+  TITLE = {{A dataset for automatic detection of places in (early) modern French texts}},
+  AUTHOR = {Gabay, Simon and Ortiz Su{\'a}rez, Pedro Javier},
+  URL = {https://hal.archives-ouvertes.fr/hal-03187097},
+  BOOKTITLE = {{NASSCFL 2021 - 50th Annual North American Society for Seventeenth-Century French Literature Conference}},
+  ADDRESS = {Iowa City / Virtual, United States},
+  ORGANIZATION = {{NASSCFL}},
+  PAGES = {5},
+  YEAR = {2021},
+  MONTH = May,
+  PDF = {https://hal.archives-ouvertes.fr/hal-03187097/file/NASSCFL.pdf},
+  HAL_ID = {hal-03187097},
+  HAL_VERSION = {v1},
+}
+"""
+
+_FTB_DESCRIPTION = """\
+FTB Treebank
+"""
+
+
+def resolve_files(data_files):
+    """Return the list of paths given by a path, a glob, or a list of them."""
+
+    if isinstance(data_files, (str, os.PathLike)):
+        data_files = [data_files]
+    paths = []
+    for pattern in data_files:
+        pattern = os.fspath(pattern)
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise FileNotFoundError(f"no file matches {pattern!r}")
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def byte_ranges(path, shard_size=SHARD_SIZE):
+    """Return `(start, end)` byte ranges covering a file, each one (but the
+    last) ending just after an empty line.
+    """
+
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(min(start + shard_size, size))
+            if f.tell() < size:
+                f.readline()  # end of the current (possibly partial) line
+                line = f.readline()
+                while line and line.strip():
+                    line = f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_range(task):
+    """Parse the sentences of the byte range `(path, start, end, columns)`.
+    `columns` maps every feature to the index of its column; "tokens" and the
+    other features are lists with one element per token.
+    """
+
+    path, start, end, columns = task
+    examples = []
+    example = {name: [] for name in columns}
+    with open(path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline().decode("utf-8")
+            if line.startswith("-DOCSTART-") or not line.strip():
+                if example["tokens"]:
+                    examples.append(example)
+                    example = {name: [] for name in columns}
+                continue
+            splits = line.rstrip("\r\n").split("\t")
+            for name, column in columns.items():
+                # trailing spaces are only kept in tokens
+                example[name].append(splits[column] if name == "tokens" else splits[column].rstrip())
+    if example["tokens"]:
+        examples.append(example)
+    return examples
+
+
+def generate_examples(data_files, columns, num_proc=None, shard_size=SHARD_SIZE):
+    """Yield the `(guid, example)` pairs of the files of a split, parsed by
+    `num_proc` processes (all CPUs if None). Every example has an "id" (its
+    guid as a string) and one list per feature of `columns`.
+    """
+
+    tasks = [
+        (path, start, end, columns)
+        for path in resolve_files(data_files)
+        for start, end in byte_ranges(path, shard_size=shard_size)
+    ]
+    num_proc = min(num_proc or os.cpu_count() or 1, len(tasks))
+
+    if num_proc <= 1:
+        results = map(parse_range, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.get_context("spawn").Pool(num_proc)
+        results = pool.imap(parse_range, tasks)
+
+    try:
+        guid = 0
+        for examples in results:
+            for example in examples:
+                yield guid, {"id": str(guid), **example}
+                guid += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+class ConllConfig(datasets.BuilderConfig):
+    """BuilderConfig for CoNLL corpora"""
+
+    def __init__(
+        self,
+        corpus=None,
+        columns=None,
+        label_names=None,
+        homepage="",
+        citation="",
+        num_workers=None,
+        shard_size=SHARD_SIZE,
+        **kwargs,
+    ):
+        """BuilderConfig for CoNLL corpora.
+        Args:
+          corpus: name of the corpus (default: the name of the config).
+          columns: index of the column of every feature, "tokens" included (default: tokens then tags in the last column).
+          label_names: label set of the features given as `ClassLabel`s, others are inferred from the data.
+          homepage: homepage of the corpus.
+          citation: citation of the corpus.
+          num_workers: number of processes parsing the files (default: all CPUs).
+          shard_size: approximate size in bytes of the parts of files given to each process.
+          **kwargs: keyword arguments forwarded to super.
+        """
+        super(ConllConfig, self).__init__(**kwargs)
+        self.corpus = corpus or self.name
+        self.columns = dict(columns or {"tokens": 0, "ner_tags": -1})
+        self.label_names = dict(label_names or {})
+        self.homepage = homepage
+        self.citation = citation
+        self.num_workers = num_workers
+        self.shard_size = shard_size
+
+    @property
+    def inferred_features(self):
+        """The features whose label set is inferred from the data."""
+
+        return [name for name in self.columns if name != "tokens" and name not in self.label_names]
+
+
+HIPE = ConllConfig(
+    name="HIPE",
+    version=datasets.Version("1.0.0"),
+    description=_HIPE_DESCRIPTION,
+    columns={"tokens": 0, "ner_tags": 3},
+    label_names={
+        "ner_tags": [
+            "I-time",
+            "B-org",
+            "I-prod",
+            "I-pers",
+            "B-time",
+            "I-loc",
+            "B-loc",
+            "B-comp",
+            "B-prod",
+            "O",
+            "B-pers",
+            "I-org",
+        ],
+    },
+    homepage="https://impresso.github.io/CLEF-HIPE-2020/",
+    citation=_HIPE_CITATION,
+)
+
+PRESTO = ConllConfig(
+    name="Presto",
+    version=datasets.Version("1.0.0"),
+    description=_PRESTO_DESCRIPTION,
+    columns={"tokens": 0, "ner_tags": 3},
+    label_names={
+        "ner_tags": [
+            "B-event",
+            "B-func",
+            "B-loc",
+            "B-org",
+            "B-pers",
+            "B-prod",
+            "B-time",
+            "I-event",
+            "I-func",
+            "I-loc",
+            "I-org",
+            "I-pers",
+            "I-prod",
+            "I-time",
+            "O",
+        ],
+    },
+    homepage="https://github.com/e-ditiones/LEM17",
+    citation=_PRESTO_CITATION,
+)
+
+FTB = ConllConfig(
+    name="FTB",
+    version=datasets.Version("1.0.0"),
+    description=_FTB_DESCRIPTION,
+    columns={"tokens": 0, "pos_tags": 2, "ner_tags": 3},
+    label_names={
+        "pos_tags": [
+            "VPR",
+            "PREF",
+            "P+D",
+            "ADV",
+            "PRO",
+            "VPP",
+            "ADVWH",
+            "VIMP",
+            "PONCT",
+            "PROREL",
+            "VINF",
+            "CS",
+            "ET",
+            "DETWH",
+            "PROWH",
+            "P+PRO",
+            "ADJ",
+            "P",
+            "CLS",
+            "ADJWH",
+            "DET",
+            "CC",
+            "V",
+            "NC",
+            "I",
+            "CLO",
+            "CLR",
+            "VS",
+            "NPP",
+        ],
+        "ner_tags": [
+            "I-Organization",
+            "I-Location",
+            "B-Product",
+            "I-POI",
+            "B-Company",
+            "O",
+            "I-FictionCharacter",
+            "I-Person",
+            "B-Organization",
+            "B-Location",
+            "B-Person",
+            "B-FictionCharacter",
+            "I-Product",
+            "I-Company",
+            "B-POI",
+        ],
+    },
+    homepage="http://www.llf.cnrs.fr/en/Gens/Abeille/French-Treebank-fr.php",
+    citation=_FTB_CITATION,
+)
+
+
+class Conll(datasets.GeneratorBasedBuilder):
+    """CoNLL corpus."""
+
+    BUILDER_CONFIG_CLASS = ConllConfig
+    BUILDER_CONFIGS = [
+        ConllConfig(name="conll", version=datasets.Version("1.0.0"), description="CoNLL corpus"),
+        HIPE,
+        PRESTO,
+        FTB,
+    ]
+    DEFAULT_CONFIG_NAME = "conll"
+
+    def _info(self):
+        features = {"id": datasets.Value("string")}
+        for name in self.config.columns:
+            if name in self.config.label_names:
+                feature = datasets.features.ClassLabel(names=self.config.label_names[name])
+            else:
+                feature = datasets.Value("string")
+            features[name] = datasets.Sequence(feature)
+        return datasets.DatasetInfo(
+            description=self.config.description,
+            features=datasets.Features(features),
+            supervised_keys=None,
+            homepage=self.config.homepage,
+            citation=self.config.citation,
+        )
+
+    def _split_generators(self, dl_manager):
+        """The `data_files` kwarg in load_dataset() can be a str, List[str], Dict[str,str], or Dict[str,List[str]].
+        If str or List[str], then the dataset returns only the 'train' split.
+        If dict, then keys should be from the `datasets.Split` enum.
+        Paths may be globs, and every split may be made of several files (shards).
+        """
+
+        splits = {"train": datasets.Split.TRAIN, "validation": datasets.Split.VALIDATION, "test": datasets.Split.TEST}
+        return [
+            datasets.SplitGenerator(name=split, gen_kwargs={"filepaths": self.config.data_files[key]})
+            for key, split in splits.items()
+            if key in self.config.data_files
+        ]
+
+    def _generate_examples(self, filepaths):
+        logger.info("⏳ Generating examples from = %s", filepaths)
+        inferred = {name: set() for name in self.config.inferred_features}
+        for guid, example in generate_examples(
+            filepaths,
+            self.config.columns,
+            num_proc=self.config.num_workers,
+            shard_size=self.config.shard_size,
+        ):
+            for name, labels in inferred.items():
+                labels.update(example[name])
+            yield guid, example
+        if inferred:
+            self._record_labels(inferred)
+
+    def _labels_path(self):
+        return os.path.join(self._output_dir, LABELS_FILE.format(corpus=self.config.corpus))
+
+    def _record_labels(self, inferred):
+        """Add the labels seen in a split to the labels file of the cache."""
+
+        path = self._labels_path()
+        labels = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                labels = json.load(f)
+        for name, names in inferred.items():
+            labels[name] = sorted(set(labels.get(name, [])) | names)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(labels, f, ensure_ascii=False, indent=2)
+
+    def load_labels(self):
+        """Return the label set of every inferred feature, as recorded when
+        the cache was written.
+        """
+
+        with open(self._labels_path(), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _as_dataset(self, split=datasets.Split.TRAIN, in_memory=False):
+        dataset = super()._as_dataset(split=split, in_memory=in_memory)
+        if self.config.inferred_features:
+            labels = self.load_labels()
+            for name in self.config.inferred_features:
+                dataset = dataset.cast_column(name, datasets.Sequence(datasets.features.ClassLabel(names=labels[name])))
+        return dataset
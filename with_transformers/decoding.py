@@ -0,0 +1,198 @@
+"""Constrained decoding of BIO tags and grouping of decoded tags into entities.
+
+Instead of taking the best label of every word independently, which may give
+an I- tag after an O or after another type, the labels of a batch of
+sentences are decoded by a Viterbi search on their logits in which only
+valid BIO transitions are allowed. The search runs on tensors for the whole
+batch at once, one step per word, and the decoded label ids are grouped into
+entity spans with array operations, without a Python loop over words.
+"""
+
+import re
+
+import numpy as np
+import torch
+
+
+# words as in the CoNLL corpora: hyphenated compounds, elisions and
+# punctuation are split like in training data
+WORD_PATTERN = re.compile(r"\w+(?:-\w+)*['’]?|[^\w\s]")
+
+
+def allowed_transitions(labels):
+    """Return the BIO constraints on `labels`: a boolean matrix whose entry
+    `[i, j]` tells whether label j may follow label i, and a boolean vector of
+    the labels a sentence may start with.
+
+    I-X may only follow B-X or I-X. When there is no B-X label (IO tagging),
+    I-X is not constrained; neither are labels without a prefix.
+    """
+
+    types = [label[2:] if label[1:2] == "-" else None for label in labels]
+    prefixes = [label[:2] if label[1:2] == "-" else None for label in labels]
+    begins = {entity_type for prefix, entity_type in zip(prefixes, types) if prefix == "B-"}
+    constrained = np.array([prefix == "I-" and entity_type in begins for prefix, entity_type in zip(prefixes, types)])
+    same_entity = np.array(
+        [[prefix in ("B-", "I-") and entity_type == other for prefix, entity_type in zip(prefixes, types)] for other in types]
+    ).T
+    allowed = np.where(constrained[np.newaxis, :], same_entity, True)
+    return allowed, ~constrained
+
+
+def viterbi(logits, lengths, allowed, start):
+    """Return the best label ids of a batch of sentences given the `logits` of
+    their words, a `(batch, words, labels)` tensor padded after `lengths`
+    words, under the `allowed` transitions and `start` labels (see
+    `allowed_transitions`). Label ids after the length of a sentence are
+    meaningless.
+    """
+
+    logits = torch.as_tensor(logits, dtype=torch.float32)
+    batch_size, n_words, n_labels = logits.shape
+    if n_words == 0:
+        return torch.zeros((batch_size, 0), dtype=torch.long)
+    lengths = torch.as_tensor(lengths).reshape(-1, 1)
+    transitions = torch.zeros(n_labels, n_labels).masked_fill_(~torch.as_tensor(allowed), float("-inf"))
+    score = logits[:, 0].masked_fill(~torch.as_tensor(start), float("-inf"))
+
+    # padded steps keep the scores and point back to the same label, so that
+    # backtracking from the last step goes through the last word unchanged
+    identity = torch.arange(n_labels).expand(batch_size, n_labels)
+    backpointers = torch.empty((batch_size, n_words, n_labels), dtype=torch.long)
+    for t in range(1, n_words):
+        best, pointers = (score.unsqueeze(2) + transitions).max(dim=1)
+        active = t < lengths
+        score = torch.where(active, best + logits[:, t], score)
+        backpointers[:, t] = torch.where(active, pointers, identity)
+
+    paths = torch.empty((batch_size, n_words), dtype=torch.long)
+    paths[:, -1] = score.argmax(dim=1)
+    for t in range(n_words - 1, 0, -1):
+        paths[:, t - 1] = backpointers[:, t].gather(1, paths[:, t:t + 1]).squeeze(1)
+    return paths
+
+
+def entity_spans(label_ids, labels, sentence_starts=()):
+    """Group the label ids (indices in `labels`) of the words of one or several
+    consecutive sentences into entities.
+
+    Return the first and last word indices and the type of every entity, as
+    arrays. An entity begins at a B- label, at a label of another type than
+    the previous word (which only happens with IO tags) and at the indices of
+    `sentence_starts`.
+    """
+
+    label_ids = np.asarray(label_ids, dtype=np.int64)
+    types, type_codes = np.unique(
+        [label[2:] if label[1:2] == "-" else ("" if label == "O" else label) for label in labels],
+        return_inverse=True,
+    )
+    outside = int(np.searchsorted(types, "")) if "" in types else -1
+    is_begin = np.array([label.startswith("B-") for label in labels], dtype=bool)
+    codes = type_codes[label_ids] if len(label_ids) else np.zeros(0, dtype=np.int64)
+
+    starts = np.zeros(len(codes), dtype=bool)
+    sentence_starts = np.asarray(sentence_starts, dtype=np.int64)
+    starts[sentence_starts[sentence_starts < len(codes)]] = True
+    inside = codes != outside
+    previous = np.r_[outside, codes[:-1]]
+    begins = inside & (is_begin[label_ids] | (codes != previous) | starts)
+    continues = inside & ~begins
+    last = inside & ~np.r_[continues[1:], False]
+    first_indices = np.flatnonzero(begins)
+    return first_indices, np.flatnonzero(last), types[codes[first_indices]]
+
+
+def decode_tags(logits, labels, batch_size=256):
+    """Return the tags of every sentence given the logits of its words (one
+    `(words, labels)` array per sentence), decoded by batches of sentences of
+    similar lengths.
+    """
+
+    allowed, start = allowed_transitions(labels)
+    labels = np.asarray(labels, dtype=object)
+    tagss = [None] * len(logits)
+    order = sorted(range(len(logits)), key=lambda i: len(logits[i]))
+    for batch_start in range(0, len(order), batch_size):
+        indices = order[batch_start: batch_start + batch_size]
+        lengths = np.array([len(logits[i]) for i in indices])
+        padded = np.zeros((len(indices), lengths.max(initial=0), len(labels)), dtype=np.float32)
+        for row, i in enumerate(indices):
+            padded[row, :lengths[row]] = logits[i]
+        paths = viterbi(padded, lengths, allowed, start).numpy()
+        for row, i in enumerate(indices):
+            tagss[i] = labels[paths[row, :lengths[row]]].tolist()
+    return tagss
+
+
+def predict_entities(model, tokenizer, texts, batch_size=16, max_length=None, overlap=64):
+    """Return the named entities of every text, as the "ner" pipeline of
+    transformers with grouped entities: dictionaries with the type
+    ("entity_group"), the mean probability of the labels of its words
+    ("score"), the text ("word") and the character offsets of every entity.
+
+    Texts are split into words with `WORD_PATTERN`, as the training data.
+    Texts longer than `max_length` subwords (by default, the maximum length
+    of the tokenizer) are predicted by windows sharing about `overlap`
+    subwords, whose logits are merged back (see `windows.predict_logits`).
+    Labels are then decoded on the first subword of every word with
+    `viterbi`.
+    """
+
+    from transformers import DataCollatorForTokenClassification
+
+    from pretokenized import PretokenizedDataset, _special_tokens, tokenize_corpus
+    from windows import predict_logits
+
+    labels = [model.config.id2label[i] for i in range(model.config.num_labels)]
+    allowed, start = allowed_transitions(labels)
+    offsets = [
+        np.array([match.span() for match in WORD_PATTERN.finditer(text)], dtype=np.int64).reshape(-1, 2)
+        for text in texts
+    ]
+    words = [[text[a:b] for a, b in spans.tolist()] for text, spans in zip(texts, offsets)]
+    arrays = tokenize_corpus(tokenizer, words, [[0] * len(text_words) for text_words in words])
+    prefix, suffix = _special_tokens(tokenizer)
+    dataset = PretokenizedDataset(
+        arrays,
+        max_length=max_length or tokenizer.model_max_length,
+        n_prefix=len(prefix),
+        n_suffix=len(suffix),
+        overlap=overlap,
+    )
+    subword_logits = predict_logits(model, dataset, DataCollatorForTokenClassification(tokenizer), batch_size=batch_size)
+
+    # logits of the first subword of every word
+    word_logits = []
+    for i, text_logits in enumerate(subword_logits):
+        word_ids = arrays["word_ids"][arrays["offsets"][i] + len(prefix): arrays["offsets"][i + 1] - len(suffix)]
+        is_first = word_ids != np.r_[-1, word_ids[:-1]]
+        word_logits.append(torch.as_tensor(text_logits[is_first], dtype=torch.float32))
+
+    results = []
+    for batch_start in range(0, len(texts), batch_size):
+        batch_logits = word_logits[batch_start: batch_start + batch_size]
+        lengths = torch.tensor([len(text_logits) for text_logits in batch_logits])
+        padded = torch.nn.utils.rnn.pad_sequence(batch_logits, batch_first=True)
+        paths = viterbi(padded, lengths, allowed, start)
+        probabilities = padded.softmax(dim=2).gather(2, paths.unsqueeze(2)).squeeze(2).numpy()
+        # the words of the batch, one sentence after the other
+        lengths = lengths.numpy()
+        sentence_starts = np.r_[0, np.cumsum(lengths)[:-1]]
+        within = np.arange(paths.shape[1])[np.newaxis, :] < lengths[:, np.newaxis]
+        firsts, lasts, types = entity_spans(paths.numpy()[within], labels, sentence_starts)
+        sentences = np.searchsorted(sentence_starts, firsts, side="right") - 1
+        firsts, lasts = firsts - sentence_starts[sentences], lasts - sentence_starts[sentences]
+        batch_results = [[] for _ in batch_logits]
+        for sentence, first, last, entity_type in zip(sentences.tolist(), firsts.tolist(), lasts.tolist(), types.tolist()):
+            text = texts[batch_start + sentence]
+            start_offset, end_offset = (int(value) for value in (offsets[batch_start + sentence][first, 0], offsets[batch_start + sentence][last, 1]))
+            batch_results[sentence].append({
+                "entity_group": entity_type,
+                "score": float(probabilities[sentence, first: last + 1].mean()),
+                "word": text[start_offset: end_offset],
+                "start": start_offset,
+                "end": end_offset,
+            })
+        results.extend(batch_results)
+    return results
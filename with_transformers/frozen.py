@@ -0,0 +1,310 @@
+"""Lightweight tagging heads trained on the embeddings of a frozen encoder.
+
+The encoder (e.g. CamemBERT) is run once over a corpus: the hidden state of
+the first subword of every word is stored in a memory-mapped float16 array,
+one row per word of the CoNLL file, with the offsets of the sentences in it.
+Sentences longer than the encoder are encoded by overlapping windows (see
+`windows.py`). Labels are not stored with the embeddings, so that a new label
+scheme only needs a new head, not a new pass of the encoder.
+
+A head is a linear layer, optionally preceded by a BiLSTM and followed by a
+CRF; it trains on CPU in minutes. Batches are made of sentences of similar
+lengths (see `batching.py`), since the CRF and the BiLSTM run over the padded
+length.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+from torch import nn
+from transformers import DataCollatorForTokenClassification
+
+from batching import LengthBucketBatchSampler
+from pretokenized import IGNORE_INDEX, PretokenizedDataset, _special_tokens, tokenize_corpus
+from scorer import score_flat
+
+
+HEADS = ("linear", "crf", "bilstm", "bilstm-crf")
+FORMAT_VERSION = 1
+
+
+def cache_key(path, model_name, layer=-1, max_length=None, overlap=64):
+    """Return the name of the cache entry of the embeddings of the CoNLL file
+    at `path` by the encoder `model_name`.
+    """
+
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as input_stream:
+        for chunk in iter(lambda: input_stream.read(1 << 20), b""):
+            sha1.update(chunk)
+    description = [sha1.hexdigest(), str(model_name), layer, max_length, overlap, FORMAT_VERSION]
+    return hashlib.sha1(json.dumps(description).encode("utf-8")).hexdigest()
+
+
+@torch.no_grad()
+def encode_corpus(model, tokenizer, tokens, directory, batch_size=16, layer=-1, max_length=None, overlap=64):
+    """Write to `directory` the embeddings of the words of `tokens` (a list of
+    sentences) given by the hidden states of `layer` of `model`, pooled on the
+    first subword of every word. The entry is written in a temporary directory
+    first so that an interrupted run leaves no partial entry.
+    """
+
+    arrays = tokenize_corpus(tokenizer, tokens, [[0] * len(sentence) for sentence in tokens], label_all_tokens=False)
+    prefix, suffix = _special_tokens(tokenizer)
+    if max_length is None:
+        # RoBERTa-like models keep two positions for the padding offset
+        max_length = min(tokenizer.model_max_length, model.config.max_position_embeddings - 2)
+    dataset = PretokenizedDataset(
+        arrays, max_length=max_length, n_prefix=len(prefix), n_suffix=len(suffix), overlap=overlap
+    )
+    # with label_all_tokens=False, only first subwords have a label
+    first = arrays["label_ids"] != IGNORE_INDEX
+    word_ids = arrays["word_ids"]
+    word_offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum([len(sentence) for sentence in tokens], out=word_offsets[1:])
+
+    directory = pathlib.Path(directory)
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tmp_directory = pathlib.Path(tempfile.mkdtemp(dir=directory.parent, prefix=f".{directory.name}-"))
+    try:
+        embeddings = np.lib.format.open_memmap(
+            tmp_directory / "embeddings.npy",
+            mode="w+",
+            dtype=np.float16,
+            shape=(int(word_offsets[-1]), model.config.hidden_size),
+        )
+        model.eval()
+        collator = DataCollatorForTokenClassification(tokenizer)
+        order = np.argsort(dataset.lengths, kind="stable")
+        for start in range(0, len(order), batch_size):
+            indices = order[start: start + batch_size].tolist()
+            batch = collator([dataset[i] for i in indices])
+            batch.pop("labels")
+            batch = {key: value.to(model.device) for key, value in batch.items()}
+            hidden_states = model(**batch, output_hidden_states=True).hidden_states[layer].float().cpu().numpy()
+            for i, states in zip(indices, hidden_states):
+                sentence, window_start, _, own_start, own_end = (int(value) for value in dataset.windows[i])
+                content = int(dataset.offsets[sentence]) + dataset.n_prefix
+                owned = slice(content + own_start, content + own_end)
+                is_first = first[owned]
+                rows = states[dataset.n_prefix + own_start - window_start: dataset.n_prefix + own_end - window_start]
+                embeddings[word_offsets[sentence] + word_ids[owned][is_first]] = rows[is_first]
+        embeddings.flush()
+        del embeddings
+        np.save(tmp_directory / "offsets.npy", word_offsets)
+        with open(tmp_directory / "meta.json", "w", encoding="utf-8") as output_stream:
+            json.dump({"model": model.config.name_or_path, "layer": layer, "hidden_size": model.config.hidden_size}, output_stream)
+        if directory.exists():
+            shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_directory, directory)
+    except BaseException:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+
+
+def load(directory):
+    """Return the memory-mapped embeddings and the sentence offsets stored in
+    `directory`, or None if there is no entry.
+    """
+
+    directory = pathlib.Path(directory)
+    if not (directory / "meta.json").exists():
+        return None
+    return np.load(directory / "embeddings.npy", mmap_mode="r"), np.load(directory / "offsets.npy")
+
+
+class EmbeddingDataset(torch.utils.data.Dataset):
+    """Sentences of word embeddings and their label ids (a flat array, one
+    label per word). Empty sentences are left out.
+    """
+
+    def __init__(self, embeddings, offsets, label_ids):
+        if len(label_ids) != len(embeddings):
+            raise ValueError(f"{len(label_ids)} labels for {len(embeddings)} embedded words")
+        self.embeddings = embeddings
+        self.label_ids = np.asarray(label_ids, dtype=np.int64)
+        self.offsets = offsets
+        self.sentences = np.flatnonzero(np.diff(offsets) > 0)
+
+    def __len__(self):
+        return len(self.sentences)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)[self.sentences]
+
+    def __getitem__(self, index):
+        sentence = self.sentences[index]
+        start, end = int(self.offsets[sentence]), int(self.offsets[sentence + 1])
+        return torch.from_numpy(self.embeddings[start:end].astype(np.float32)), torch.from_numpy(self.label_ids[start:end])
+
+
+def collate(items):
+    """Pad a list of (embeddings, labels) sentences. Return the embeddings,
+    the labels (-100 on padding) and the mask of words.
+    """
+
+    lengths = torch.tensor([len(labels) for _, labels in items])
+    embeddings = nn.utils.rnn.pad_sequence([embeddings for embeddings, _ in items], batch_first=True)
+    labels = nn.utils.rnn.pad_sequence([labels for _, labels in items], batch_first=True, padding_value=IGNORE_INDEX)
+    mask = torch.arange(int(lengths.max())) < lengths[:, None]
+    return embeddings, labels, mask
+
+
+class CRF(nn.Module):
+    """A linear-chain CRF over the emission scores of a batch of sentences,
+    padded at the end (`mask` is True on words).
+    """
+
+    def __init__(self, n_labels):
+        super().__init__()
+        self.start = nn.Parameter(torch.zeros(n_labels))
+        self.end = nn.Parameter(torch.zeros(n_labels))
+        self.transitions = nn.Parameter(torch.zeros(n_labels, n_labels))  # from, to
+
+    def log_likelihood(self, emissions, labels, mask):
+        """Return the log-likelihood of the labels of every sentence."""
+
+        labels = labels.masked_fill(~mask, 0)
+        batch = torch.arange(len(labels))
+        gold = self.start[labels[:, 0]] + emissions[batch, 0, labels[:, 0]]
+        scores = self.start + emissions[:, 0]
+        for t in range(1, emissions.shape[1]):
+            step = self.transitions[labels[:, t - 1], labels[:, t]] + emissions[batch, t, labels[:, t]]
+            gold = gold + step * mask[:, t]
+            next_scores = torch.logsumexp(scores[:, :, None] + self.transitions + emissions[:, t, None, :], dim=1)
+            scores = torch.where(mask[:, t, None], next_scores, scores)
+        last = labels[batch, mask.sum(dim=1) - 1]
+        gold = gold + self.end[last]
+        return gold - torch.logsumexp(scores + self.end, dim=1)
+
+    def decode(self, emissions, mask):
+        """Return the best label ids of every sentence (Viterbi)."""
+
+        scores = self.start + emissions[:, 0]
+        backpointers = []
+        for t in range(1, emissions.shape[1]):
+            next_scores, best = (scores[:, :, None] + self.transitions).max(dim=1)
+            backpointers.append(best)
+            scores = torch.where(mask[:, t, None], next_scores + emissions[:, t], scores)
+        scores = scores + self.end
+
+        lengths = mask.sum(dim=1).tolist()
+        best_last = scores.argmax(dim=1).tolist()
+        backpointers = torch.stack(backpointers, dim=1).tolist() if backpointers else [[] for _ in lengths]
+        paths = []
+        for length, label, pointers in zip(lengths, best_last, backpointers):
+            path = [label]
+            for t in range(length - 2, -1, -1):
+                label = pointers[t][label]
+                path.append(label)
+            paths.append(path[::-1])
+        return paths
+
+
+class TaggingHead(nn.Module):
+    """A tagger on word embeddings: `head` is one of `HEADS`, a linear layer
+    optionally preceded by a BiLSTM of `lstm_size` units per direction and
+    followed by a CRF.
+    """
+
+    def __init__(self, input_size, n_labels, head="linear", lstm_size=256, dropout=0.1):
+        super().__init__()
+        if head not in HEADS:
+            raise ValueError(f"unknown head {head}, expected one of {HEADS}")
+        self.head = head
+        self.dropout = nn.Dropout(dropout)
+        self.lstms = None
+        if head.startswith("bilstm"):
+            # forward and backward LSTMs, see `forward`
+            self.lstms = nn.ModuleList(nn.LSTM(input_size, lstm_size, batch_first=True) for _ in range(2))
+            input_size = 2 * lstm_size
+        self.linear = nn.Linear(input_size, n_labels)
+        self.crf = CRF(n_labels) if head.endswith("crf") else None
+
+    def forward(self, embeddings, mask):
+        """Return the emission scores of every word."""
+
+        hidden = self.dropout(embeddings)
+        if self.lstms is not None:
+            # the backward of packed sequences is very slow on CPU: padded
+            # batches are used instead, the backward LSTM reading every
+            # sentence reversed within its length so that it starts on words
+            lengths = mask.sum(dim=1, keepdim=True)
+            positions = torch.arange(mask.shape[1]).expand_as(mask)
+            reverse = torch.where(mask, lengths - 1 - positions, positions)[:, :, None]
+            forward_lstm, backward_lstm = self.lstms
+            forward, _ = forward_lstm(hidden)
+            backward, _ = backward_lstm(hidden.gather(1, reverse.expand_as(hidden)))
+            backward = backward.gather(1, reverse.expand_as(backward))
+            hidden = self.dropout(torch.cat([forward, backward], dim=-1))
+        return self.linear(hidden)
+
+    def loss(self, emissions, labels, mask):
+        if self.crf is not None:
+            return -self.crf.log_likelihood(emissions, labels, mask).mean()
+        return nn.functional.cross_entropy(emissions.reshape(-1, emissions.shape[-1]), labels.reshape(-1))
+
+    def decode(self, emissions, mask):
+        """Return the predicted label ids of every sentence."""
+
+        if self.crf is not None:
+            return self.crf.decode(emissions, mask)
+        return [ids[:length] for ids, length in zip(emissions.argmax(dim=-1).tolist(), mask.sum(dim=1).tolist())]
+
+
+@torch.no_grad()
+def predict(head, dataset, batch_size=64):
+    """Return the predicted label ids of all the words of `dataset`, as a flat
+    array in the order of its sentences.
+    """
+
+    head.eval()
+    batch_sampler = LengthBucketBatchSampler(dataset.lengths, batch_size=batch_size, shuffle=False)
+    loader = torch.utils.data.DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=collate)
+    predictions = [None] * len(dataset)
+    for indices, (embeddings, _, mask) in zip(batch_sampler, loader):
+        for i, ids in zip(indices, head.decode(head(embeddings, mask), mask)):
+            predictions[i] = ids
+    return np.array([label_id for ids in predictions for label_id in ids], dtype=np.int64)
+
+
+def evaluate(head, dataset, label_list, batch_size=64):
+    """Return the seqeval scores of `head` on `dataset` (see `score_flat`)."""
+
+    gold = np.concatenate([dataset.label_ids[dataset.offsets[s]: dataset.offsets[s + 1]] for s in dataset.sentences])
+    return score_flat(gold, predict(head, dataset, batch_size=batch_size), dataset.lengths, label_list)
+
+
+def train_head(head, train_dataset, dev_dataset, label_list, epochs=10, batch_size=32, learning_rate=1e-3, seed=0):
+    """Train `head` and keep the weights of the epoch with the best F1-score
+    on `dev_dataset`. Return the scores of these weights.
+    """
+
+    batch_sampler = LengthBucketBatchSampler(train_dataset.lengths, batch_size=batch_size, seed=seed)
+    loader = torch.utils.data.DataLoader(train_dataset, batch_sampler=batch_sampler, collate_fn=collate)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=learning_rate)
+    best_results, best_state = None, None
+    for epoch in range(epochs):
+        head.train()
+        total = 0.0
+        for embeddings, labels, mask in loader:
+            loss = head.loss(head(embeddings, mask), labels, mask)
+            optimizer.zero_grad()
+            loss.backward()
+            nn.utils.clip_grad_norm_(head.parameters(), 5.0)
+            optimizer.step()
+            total += loss.item()
+        results = evaluate(head, dev_dataset, label_list)
+        print(f"epoch {epoch + 1}: loss={total / len(loader):.4f}, dev F1={results['overall_f1'] * 100:.2f}", flush=True)
+        if best_results is None or results["overall_f1"] > best_results["overall_f1"]:
+            best_results = results
+            best_state = {key: value.detach().clone() for key, value in head.state_dict().items()}
+    head.load_state_dict(best_state)
+    return best_results
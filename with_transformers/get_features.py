@@ -1,14 +1,90 @@
-def print_features(filepath):
-    with open(filepath, encoding="utf-8") as f:
-        ner_tags = set()
-        for line in f:
-            if line.startswith("-DOCSTART-") or line == "" or line == "\n":
-                continue
-            else:
-                # FTM tokens are tab separated
-                splits = line.split('\t')
-                ner_tags.add(splits[3].rstrip())
-        # last example
-        print(ner_tags)
-        
-print_features("path/du/fichier")
+"""Print the label set and statistics of a CoNLL corpus loaded with a builder
+script (`conll.py` by default).
+
+Statistics are computed with pyarrow on the Arrow cache of the dataset, so
+once the corpus has been loaded (e.g. by the notebook), the files are not
+read again.
+
+    python get_features.py -d train=hipe/train.conll -d validation=hipe/dev.conll -c tokens=0 -c ner_tags=3
+    python get_features.py hipe.py -d train=hipe/train.conll --json
+"""
+
+import argparse
+import json
+
+import numpy as np
+import pyarrow.compute as pc
+from datasets import ClassLabel, load_dataset
+
+
+def split_statistics(dataset):
+    """Return the number of sentences and tokens of a split, the
+    distribution of sentence lengths and the counts of every label of its
+    label columns.
+    """
+
+    table = dataset.data.table if hasattr(dataset.data, "table") else dataset.data
+    lengths = pc.list_value_length(table.column("tokens")).to_numpy(zero_copy_only=False)
+    statistics = {
+        "sentences": len(lengths),
+        "tokens": int(lengths.sum()),
+        "sentence_length": {
+            "min": int(lengths.min()) if len(lengths) else 0,
+            "mean": float(lengths.mean()) if len(lengths) else 0.0,
+            "p95": float(np.percentile(lengths, 95)) if len(lengths) else 0.0,
+            "max": int(lengths.max(initial=0)),
+        },
+        "labels": {},
+    }
+    for name, feature in dataset.features.items():
+        if name in ("id", "tokens"):
+            continue
+        values = pc.list_flatten(table.column(name))
+        counts = {entry["values"].as_py(): entry["counts"].as_py() for entry in pc.value_counts(values)}
+        label_feature = getattr(feature, "feature", None)
+        if isinstance(label_feature, ClassLabel):
+            counts = {label: counts.get(i, 0) for i, label in enumerate(label_feature.names)}
+        statistics["labels"][name] = dict(sorted(counts.items(), key=lambda item: -item[1]))
+    return statistics
+
+
+def print_statistics(split, statistics):
+    lengths = statistics["sentence_length"]
+    print(f"# {split}: {statistics['sentences']} sentences, {statistics['tokens']} tokens")
+    print(
+        f"sentence length: min={lengths['min']} mean={lengths['mean']:.1f}"
+        f" p95={lengths['p95']:.0f} max={lengths['max']}"
+    )
+    for name, counts in statistics["labels"].items():
+        total = sum(counts.values()) or 1
+        print(f"{name}: {len(counts)} labels")
+        for label, count in counts.items():
+            print(f"  {label:<20} {count:>9} {count / total * 100:>6.2f}%")
+    print()
+
+
+def main(script="conll.py", name=None, data_files=(), columns=(), output_json=False):
+    data_files = dict(spec.split("=", 1) for spec in data_files)
+    config_kwargs = {}
+    if columns:
+        config_kwargs["columns"] = {key: int(value) for key, value in (spec.split("=", 1) for spec in columns)}
+    datasets = load_dataset(script, name, data_files=data_files, **config_kwargs)
+
+    statistics = {split: split_statistics(dataset) for split, dataset in datasets.items()}
+    if output_json:
+        print(json.dumps(statistics, ensure_ascii=False, indent=2))
+        return
+    for split, values in statistics.items():
+        print_statistics(split, values)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("script", nargs="?", default="conll.py", help="Builder script (default: %(default)s).")
+    parser.add_argument("-n", "--name", help="Config of the builder (e.g. HIPE, Presto, FTB).")
+    parser.add_argument("-d", "--data-file", dest="data_files", action="append", default=[], help="A split and its files, as split=path (path may be a glob).")
+    parser.add_argument("-c", "--column", dest="columns", action="append", default=[], help="A feature and the index of its column, as name=index (default with conll.py: tokens=0, ner_tags=-1).")
+    parser.add_argument("--json", dest="output_json", action="store_true", help="Print the statistics as JSON.")
+    args = parser.parse_args()
+
+    main(**vars(args))
@@ -0,0 +1,293 @@
+"""Pre-tokenized datasets for token classification.
+
+A corpus is tokenized once into ragged arrays: every sentence is a slice of
+flat `input_ids`, `word_ids` and `label_ids` arrays, given by `offsets`. The
+arrays are stored on disk and loaded memory-mapped, so that later sessions can
+serve them to a `Trainer` without running the tokenizer again.
+
+Instead of tokenizing every sentence and aligning labels word by word, each
+distinct word is tokenized once and sentences are assembled with numpy. This
+gives the same result as `tokenizer(tokens, is_split_into_words=True)` for
+tokenizers that split words independently of their context, which is the case
+for CamemBERT (and BERT-like) tokenizers.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+
+from windows import owned_spans, window_spans
+
+
+ARRAYS = ("input_ids", "word_ids", "label_ids", "offsets")
+IGNORE_INDEX = -100
+
+
+def _special_tokens(tokenizer):
+    """Return the ids of the special tokens a tokenizer puts before and after
+    a single sequence.
+    """
+
+    encoding = tokenizer(["a"], is_split_into_words=True, return_special_tokens_mask=True)
+    input_ids, special = encoding["input_ids"], encoding["special_tokens_mask"]
+    first = special.index(0)
+    last = len(special) - special[::-1].index(0)
+    return input_ids[:first], input_ids[last:]
+
+
+def _tokenize_vocabulary(tokenizer, vocabulary, batch_size=10000):
+    """Tokenize each distinct word once. Return the flat subword ids and the
+    offsets of every word in them.
+    """
+
+    if tokenizer.is_fast:
+        # the whole vocabulary as a single pre-tokenized sequence: one call to
+        # the Rust tokenizer and no per-word python objects.
+        encoding = tokenizer.backend_tokenizer.encode(vocabulary, is_pretokenized=True, add_special_tokens=False)
+        word_ids = np.fromiter((-1 if i is None else i for i in encoding.word_ids), dtype=np.int64)
+        counts = np.bincount(word_ids[word_ids >= 0], minlength=len(vocabulary))
+        word_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(counts, out=word_offsets[1:])
+        flat = np.asarray(encoding.ids, dtype=np.int32)[word_ids >= 0]
+        return flat, word_offsets
+
+    pieces = []
+    for start in range(0, len(vocabulary), batch_size):
+        batch = vocabulary[start: start + batch_size]
+        pieces.extend(tokenizer(batch, add_special_tokens=False)["input_ids"])
+    counts = np.fromiter((len(word_pieces) for word_pieces in pieces), dtype=np.int64, count=len(pieces))
+    word_offsets = np.zeros(len(pieces) + 1, dtype=np.int64)
+    np.cumsum(counts, out=word_offsets[1:])
+    flat = np.fromiter(itertools.chain.from_iterable(pieces), dtype=np.int32, count=int(word_offsets[-1]))
+    return flat, word_offsets
+
+
+def tokenize_corpus(tokenizer, tokens, tags, label_all_tokens=True):
+    """Tokenize a corpus and align its labels with subwords.
+
+    `tokens` is a sequence of sentences (lists of words) and `tags` the
+    matching sequence of label id lists. Special tokens get the label -100, as
+    do subwords that do not start a word unless `label_all_tokens` is True, in
+    which case they get the label of their word.
+
+    Return a dictionary of ragged arrays: input_ids, word_ids (-1 for special
+    tokens), label_ids and offsets (sentence i is `offsets[i]:offsets[i+1]`).
+    """
+
+    sentence_lengths = np.fromiter((len(sentence) for sentence in tokens), dtype=np.int64)
+    words = list(itertools.chain.from_iterable(tokens))
+    word_tags = np.fromiter(itertools.chain.from_iterable(tags), dtype=np.int32, count=len(words))
+
+    word2code = {}
+    codes = np.fromiter(
+        (word2code.setdefault(word, len(word2code)) for word in words), dtype=np.int64, count=len(words)
+    )
+    pieces, piece_offsets = _tokenize_vocabulary(tokenizer, list(word2code))
+    prefix, suffix = _special_tokens(tokenizer)
+    n_special = len(prefix) + len(suffix)
+
+    # subwords of every word of the corpus, in order
+    n_pieces = np.diff(piece_offsets)[codes]
+    word_start = np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces)
+    within_word = np.arange(word_start.size) - word_start
+    content_ids = pieces[np.repeat(piece_offsets[codes], n_pieces) + within_word]
+
+    # position of each word in its sentence, and of each subword in the output
+    sentence_of_word = np.repeat(np.arange(sentence_lengths.size), sentence_lengths)
+    first_word = np.cumsum(sentence_lengths) - sentence_lengths
+    word_index = np.arange(len(words)) - first_word[sentence_of_word]
+    sentence_of_piece = np.repeat(sentence_of_word, n_pieces)
+    positions = np.arange(content_ids.size) + sentence_of_piece * n_special + len(prefix)
+
+    n_subwords = np.bincount(sentence_of_piece, minlength=sentence_lengths.size) + n_special
+    offsets = np.zeros(sentence_lengths.size + 1, dtype=np.int64)
+    np.cumsum(n_subwords, out=offsets[1:])
+
+    input_ids = np.empty(offsets[-1], dtype=np.int32)
+    word_ids = np.full(offsets[-1], -1, dtype=np.int32)
+    label_ids = np.full(offsets[-1], IGNORE_INDEX, dtype=np.int32)
+    for k, token_id in enumerate(prefix):
+        input_ids[offsets[:-1] + k] = token_id
+    for k, token_id in enumerate(suffix):
+        input_ids[offsets[1:] - len(suffix) + k] = token_id
+    input_ids[positions] = content_ids
+    word_ids[positions] = np.repeat(word_index, n_pieces)
+    piece_labels = np.repeat(word_tags, n_pieces)
+    if not label_all_tokens:
+        piece_labels[within_word > 0] = IGNORE_INDEX
+    label_ids[positions] = piece_labels
+
+    return {"input_ids": input_ids, "word_ids": word_ids, "label_ids": label_ids, "offsets": offsets}
+
+
+def cache_key(tokenizer, fingerprint, label_all_tokens=True):
+    """Return the name of the cache entry of a corpus identified by
+    `fingerprint` (e.g. the `_fingerprint` of a `datasets.Dataset`).
+    """
+
+    description = [
+        fingerprint,
+        type(tokenizer).__name__,
+        tokenizer.name_or_path,
+        len(tokenizer),
+        label_all_tokens,
+    ]
+    return hashlib.sha1(json.dumps(description).encode("utf-8")).hexdigest()
+
+
+def save(directory, arrays):
+    """Write ragged arrays to `directory`, atomically."""
+
+    directory = pathlib.Path(directory)
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tmp_directory = pathlib.Path(tempfile.mkdtemp(dir=directory.parent, prefix=f".{directory.name}-"))
+    try:
+        for name in ARRAYS:
+            np.save(tmp_directory / f"{name}.npy", arrays[name])
+        if directory.exists():
+            shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_directory, directory)
+    except OSError:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+
+
+def load(directory):
+    """Load memory-mapped ragged arrays from `directory`, None if absent."""
+
+    directory = pathlib.Path(directory)
+    if not all((directory / f"{name}.npy").exists() for name in ARRAYS):
+        return None
+    return {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+
+
+class PretokenizedDataset(torch.utils.data.Dataset):
+    """A token classification dataset served from ragged arrays.
+
+    Items are dictionaries with input_ids, attention_mask and labels, as
+    expected by `DataCollatorForTokenClassification`. Sequences longer than
+    `max_length` are truncated, keeping their special tokens, unless `overlap`
+    is given: they are then split into windows of `max_length` tokens sharing
+    about `overlap` subwords, each subword being labelled in only one window
+    (see `windows.py`).
+    """
+
+    def __init__(self, arrays, max_length=None, n_prefix=1, n_suffix=1, overlap=None):
+        self.input_ids = arrays["input_ids"]
+        self.word_ids = arrays["word_ids"]
+        self.label_ids = arrays["label_ids"]
+        self.offsets = arrays["offsets"]
+        self.max_length = max_length
+        self.n_prefix = n_prefix
+        self.n_suffix = n_suffix
+        self.overlap = overlap
+        self.windows = self._make_windows()
+
+    @classmethod
+    def from_dataset(
+        cls,
+        dataset,
+        tokenizer,
+        cache_dir=None,
+        label_all_tokens=True,
+        max_length=None,
+        overlap=None,
+        tags_column="ner_tags",
+    ):
+        """Build (or load from `cache_dir`) the pre-tokenized version of a
+        `datasets.Dataset` with "tokens" and `tags_column` columns.
+        """
+
+        arrays = None
+        if cache_dir is not None:
+            key = cache_key(tokenizer, dataset._fingerprint, label_all_tokens)
+            entry = pathlib.Path(cache_dir) / key
+            arrays = load(entry)
+        if arrays is None:
+            arrays = tokenize_corpus(
+                tokenizer, dataset["tokens"], dataset[tags_column], label_all_tokens=label_all_tokens
+            )
+            if cache_dir is not None:
+                save(entry, arrays)
+                arrays = load(entry)
+        if max_length is None:
+            max_length = tokenizer.model_max_length
+        prefix, suffix = _special_tokens(tokenizer)
+        return cls(arrays, max_length=max_length, n_prefix=len(prefix), n_suffix=len(suffix), overlap=overlap)
+
+    def _make_windows(self):
+        """Return the windows of the dataset as rows of (sentence, start, end,
+        own_start, own_end), positions being relative to the subwords of the
+        sentence without special tokens.
+        """
+
+        n_special = self.n_prefix + self.n_suffix
+        content_lengths = np.diff(self.offsets) - n_special
+        sentences = np.arange(len(content_lengths))
+        if self.max_length is None:
+            budget = int(content_lengths.max(initial=0))
+        else:
+            budget = self.max_length - n_special
+        ends = np.minimum(content_lengths, budget)
+        zeros = np.zeros_like(content_lengths)
+        windows = np.stack([sentences, zeros, ends, zeros, ends], axis=1)
+        if self.overlap is None:
+            return windows
+
+        long_sentences = np.flatnonzero(content_lengths > budget)
+        rows = [windows[content_lengths <= budget]]
+        for sentence in long_sentences:
+            spans = window_spans(np.ones(content_lengths[sentence], dtype=np.int64), budget, self.overlap)
+            rows.append(
+                np.array(
+                    [(sentence, start, end, own_start, own_end)
+                     for (start, end), (own_start, own_end) in zip(spans, owned_spans(spans))],
+                    dtype=np.int64,
+                )
+            )
+        windows = np.concatenate(rows)
+        return windows[np.lexsort((windows[:, 1], windows[:, 0]))]
+
+    def sentence_windows(self):
+        """Yield, for every sentence, the indices of its windows."""
+
+        boundaries = np.searchsorted(self.windows[:, 0], np.arange(len(self.offsets)))
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            yield range(start, end)
+
+    def __len__(self):
+        return len(self.windows)
+
+    @property
+    def lengths(self):
+        """The number of subwords of every item, special tokens included."""
+
+        return self.windows[:, 2] - self.windows[:, 1] + self.n_prefix + self.n_suffix
+
+    def __getitem__(self, index):
+        sentence, start, end, own_start, own_end = (int(value) for value in self.windows[index])
+        sentence_start, sentence_end = int(self.offsets[sentence]), int(self.offsets[sentence + 1])
+        content_start = sentence_start + self.n_prefix
+        prefix = slice(sentence_start, content_start)
+        suffix = slice(sentence_end - self.n_suffix, sentence_end)
+
+        input_ids = np.concatenate([
+            self.input_ids[prefix],
+            self.input_ids[content_start + start: content_start + end],
+            self.input_ids[suffix],
+        ])
+        labels = np.full(len(input_ids), IGNORE_INDEX, dtype=np.int64)
+        owned = slice(self.n_prefix + own_start - start, self.n_prefix + own_end - start)
+        labels[owned] = self.label_ids[content_start + own_start: content_start + own_end]
+        return {
+            "input_ids": input_ids.tolist(),
+            "attention_mask": [1] * len(input_ids),
+            "labels": labels.tolist(),
+        }
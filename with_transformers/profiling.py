@@ -0,0 +1,305 @@
+"""Instrumentation of the training pipeline.
+
+A `Profiler` accumulates the wall time of the stages of a run (read, tokenize,
+collate, forward, backward, optimizer, eval), the number of samples and tokens
+of training batches, their padding ratio and the peak resident memory of the
+process. Its summary can be printed or exported to JSON, and torch.profiler
+traces of a few training steps can be recorded along.
+
+Stages of training are timed with hooks in the main process, so training
+loops need no change and data loader workers do not hide anything:
+
+- collate: the wait for the next training batch (sampling, collation,
+  transfer to the device), from the end of an optimizer step to the next
+  forward;
+- forward: forward pre- and post-hooks of the model, forwards in eval mode or
+  without gradients being counted in "eval";
+- backward: from the end of a training forward to the next optimizer step,
+  so it also holds the loss and gradient clipping;
+- optimizer: global optimizer step pre- and post-hooks of torch.
+
+Other stages are timed by the caller with `with profiler.stage(name):`.
+Stages are exclusive: the time recorded within a stage, by a nested stage or
+by hooks, is left out of it, so that the stages add up to the run time.
+`Profiler.attach(trainer)` instruments a 🤗 `Trainer`, and
+`TrainingNERModel(profiler=...)` a simpletransformers model.
+"""
+
+import contextlib
+import json
+import resource
+import sys
+import time
+
+import torch
+from torch.optim.optimizer import register_optimizer_step_post_hook, register_optimizer_step_pre_hook
+
+from transformers import TrainerCallback
+
+
+STAGES = ("read", "tokenize", "collate", "forward", "backward", "optimizer", "eval")
+
+
+def peak_rss_mib():
+    """Return the peak resident set size of the process, in MiB."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+class Profiler:
+    """Record the time spent in every stage of a run and the throughput of
+    training.
+
+    Args:
+      trace_dir: if given, torch.profiler traces of a few training steps are
+        written there (TensorBoard format), a step ending with every optimizer
+        step.
+      trace_schedule: the `wait`, `warmup`, `active` and `repeat` arguments of
+        `torch.profiler.schedule`.
+    """
+
+    def __init__(self, trace_dir=None, trace_schedule=(1, 1, 3, 1)):
+        self.trace_dir = trace_dir
+        self.trace_schedule = trace_schedule
+        self.seconds = {stage: 0.0 for stage in STAGES}
+        self.calls = {stage: 0 for stage in STAGES}
+        self.n_samples = 0
+        self.n_tokens = 0
+        self.n_padded = 0
+        self.n_steps = 0
+        self.start_time = None
+        self.end_time = None
+        self.train_seconds = 0.0
+        self.torch_profiler = None
+        self.handles = []
+        self._train_start = None
+        self._wait_start = None
+        self._forward_start = None
+        self._backward_start = None
+        self._optimizer_start = None
+        self._recorded = 0.0  # seconds recorded in all stages
+
+    def add(self, stage, seconds, calls=1):
+        if stage not in self.seconds:
+            self.seconds[stage] = 0.0
+            self.calls[stage] = 0
+        self.seconds[stage] += seconds
+        self.calls[stage] += calls
+        self._recorded += seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage `name`, except the time recorded
+        in other stages meanwhile.
+        """
+
+        start, recorded = time.perf_counter(), self._recorded
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start - (self._recorded - recorded))
+
+    def count_batch(self, attention_mask):
+        """Count the samples, tokens and padded tokens of a training batch."""
+
+        self.n_samples += int(attention_mask.shape[0])
+        self.n_tokens += int(attention_mask.sum())
+        self.n_padded += int(attention_mask.numel())
+
+    # hooks
+
+    def _forward_pre_hook(self, module, args, kwargs):
+        now = time.perf_counter()
+        if module.training and torch.is_grad_enabled():
+            if self._backward_start is not None:  # gradient accumulation
+                self.add("backward", now - self._backward_start)
+                self._backward_start = None
+            elif self._wait_start is not None:
+                self.add("collate", now - self._wait_start)
+            self._wait_start = None
+            attention_mask = kwargs.get("attention_mask", args[1] if len(args) > 1 else None)
+            if attention_mask is not None:
+                self.count_batch(attention_mask)
+        self._forward_start = now
+
+    def _forward_hook(self, module, args, output):
+        now = time.perf_counter()
+        if self._forward_start is None:
+            return
+        if module.training and torch.is_grad_enabled():
+            self.add("forward", now - self._forward_start)
+            self._backward_start = now
+        else:
+            self.add("eval", now - self._forward_start)
+            if self._wait_start is not None:
+                self._wait_start = now
+        self._forward_start = None
+
+    def _optimizer_pre_hook(self, optimizer, args, kwargs):
+        now = time.perf_counter()
+        if self._backward_start is not None:
+            self.add("backward", now - self._backward_start)
+            self._backward_start = None
+        self._optimizer_start = now
+
+    def _optimizer_post_hook(self, optimizer, args, kwargs):
+        if self._optimizer_start is None:
+            return
+        self.add("optimizer", time.perf_counter() - self._optimizer_start)
+        self._optimizer_start = None
+        self.n_steps += 1
+        if self.torch_profiler is not None:
+            self.torch_profiler.step()
+        self._wait_start = time.perf_counter()
+
+    def instrument(self, model):
+        """Time the training of `model` until `release` is called: its passes,
+        the steps of its optimizer and the wait for its batches.
+        """
+
+        if self.start_time is None:
+            self.start()
+        self.handles += [
+            model.register_forward_pre_hook(self._forward_pre_hook, with_kwargs=True),
+            model.register_forward_hook(self._forward_hook),
+            register_optimizer_step_pre_hook(self._optimizer_pre_hook),
+            register_optimizer_step_post_hook(self._optimizer_post_hook),
+        ]
+        self._train_start = self._wait_start = time.perf_counter()
+        if self.trace_dir is not None:
+            wait, warmup, active, repeat = self.trace_schedule
+            self.torch_profiler = torch.profiler.profile(
+                schedule=torch.profiler.schedule(wait=wait, warmup=warmup, active=active, repeat=repeat),
+                on_trace_ready=torch.profiler.tensorboard_trace_handler(str(self.trace_dir)),
+                record_shapes=True,
+                profile_memory=True,
+            )
+            self.torch_profiler.start()
+
+    def release(self):
+        """Remove the hooks set by `instrument`."""
+
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        if self.torch_profiler is not None:
+            self.torch_profiler.stop()
+            self.torch_profiler = None
+        if self._train_start is not None:
+            self.train_seconds += time.perf_counter() - self._train_start
+        self._train_start = self._wait_start = self._backward_start = None
+
+    def attach(self, trainer):
+        """Instrument the training of a 🤗 `Trainer`."""
+
+        trainer.add_callback(ProfilerCallback(self))
+
+    # run
+
+    def start(self):
+        """Start the clock of the whole run."""
+
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        self.release()
+        self.end_time = time.perf_counter()
+
+    def state(self):
+        """Return what was recorded, to be merged into the profiler of another
+        process with `merge`.
+        """
+
+        return {
+            "seconds": self.seconds,
+            "calls": self.calls,
+            "samples": self.n_samples,
+            "tokens": self.n_tokens,
+            "padded": self.n_padded,
+            "steps": self.n_steps,
+            "train_seconds": self.train_seconds,
+        }
+
+    def merge(self, state):
+        """Add the stages and counts recorded by another profiler (see
+        `state`), e.g. in a training process, to those of this one.
+        """
+
+        for stage, seconds in state["seconds"].items():
+            if state["calls"][stage]:
+                self.add(stage, seconds, calls=state["calls"][stage])
+        self.n_samples += state["samples"]
+        self.n_tokens += state["tokens"]
+        self.n_padded += state["padded"]
+        self.n_steps += state["steps"]
+        self.train_seconds += state["train_seconds"]
+
+    # report
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.perf_counter()) - self.start_time
+
+    def summary(self):
+        elapsed = self.elapsed
+        stages = {stage: seconds for stage, seconds in self.seconds.items() if self.calls[stage]}
+        stages["other"] = max(0.0, elapsed - sum(stages.values()))
+        return {
+            "seconds": elapsed,
+            "train_seconds": self.train_seconds,
+            "steps": self.n_steps,
+            "stages": {
+                stage: {
+                    "seconds": seconds,
+                    "calls": self.calls.get(stage, 0),
+                    "share": seconds / elapsed if elapsed else 0.0,
+                }
+                for stage, seconds in stages.items()
+            },
+            "samples": self.n_samples,
+            "tokens": self.n_tokens,
+            "samples_per_second": self.n_samples / self.train_seconds if self.train_seconds else 0.0,
+            "tokens_per_second": self.n_tokens / self.train_seconds if self.train_seconds else 0.0,
+            "padding_ratio": 1.0 - self.n_tokens / self.n_padded if self.n_padded else 0.0,
+            "peak_rss_mib": peak_rss_mib(),
+        }
+
+    def to_json(self, path):
+        with open(path, "w", encoding="utf-8") as output_stream:
+            json.dump(self.summary(), output_stream, indent=2)
+
+    def __str__(self):
+        summary = self.summary()
+        lines = [f"{'stage':<10} {'seconds':>9} {'calls':>7} {'share':>7}"]
+        for stage, values in summary["stages"].items():
+            lines.append(
+                f"{stage:<10} {values['seconds']:>9.2f} {values['calls']:>7} {values['share'] * 100:>6.1f}%"
+            )
+        lines.append(
+            f"{summary['seconds']:.1f} s ({summary['train_seconds']:.1f} s of training, {summary['steps']} steps), "
+            f"{summary['samples_per_second']:.1f} samples/s, {summary['tokens_per_second']:.0f} tokens/s, "
+            f"padding ratio={summary['padding_ratio'] * 100:.1f}%, peak RSS={summary['peak_rss_mib']:.0f} MiB"
+        )
+        return "\n".join(lines)
+
+
+class ProfilerCallback(TrainerCallback):
+    """Instrument the training of a `Trainer` with a `Profiler`, print its
+    summary at the end and write it to `<output_dir>/profile.json`.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self.profiler.instrument(model)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.profiler.release()
+        print(self.profiler)
+        if state.is_world_process_zero:
+            self.profiler.to_json(f"{args.output_dir}/profile.json")
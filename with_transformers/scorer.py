@@ -0,0 +1,167 @@
+"""Entity-level precision, recall and F1-score computed with numpy.
+
+The scores are those of seqeval in its default (conlleval-compatible) mode,
+used by the `seqeval` metric of 🤗 Datasets and by simpletransformers, but
+computed on arrays of label ids: the -100 mask is applied with numpy, the
+chunk boundaries of seqeval's `get_entities` are found with vectorized
+comparisons of each label with the previous one, and entities are matched by
+sorting integer keys, so no python loop runs over tokens.
+"""
+
+import numpy as np
+
+IGNORE_INDEX = -100
+
+# codes of the chunk tags (first letter of a label) handled by seqeval
+O, B, I, E, S, DOT, OTHER = range(7)
+_TAG_CODES = {"O": O, "B": B, "I": I, "E": E, "S": S, ".": DOT}
+
+
+def _label_codes(label_list):
+    """Return the tag and type codes of every label id, and the type names.
+    An extra label "O" is added at the end, used between sentences.
+    """
+
+    type_names = []
+    type2code = {}
+    tags, types = [], []
+    for label in list(label_list) + ["O"]:
+        # as in seqeval.metrics.sequence_labeling.get_entities
+        tags.append(_TAG_CODES.get(label[0], OTHER))
+        type_ = label[1:].split("-", maxsplit=1)[-1] or "_"
+        if type_ not in type2code:
+            type2code[type_] = len(type_names)
+            type_names.append(type_)
+        types.append(type2code[type_])
+    return np.array(tags, dtype=np.int8), np.array(types, dtype=np.int64), type_names
+
+
+def entities(label_ids, lengths, tag_codes, type_codes):
+    """Return the entities of a flat array of label ids, made of sentences of
+    the given lengths, as arrays of types, starts and ends (inclusive). As in
+    seqeval, positions are those of the concatenation of the sentences, each
+    one being followed by an "O".
+    """
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    outside = len(tag_codes) - 1
+    stream = np.full(len(label_ids) + len(lengths) + 1, outside, dtype=np.int64)
+    # one "O" after every sentence: token j of sentence s goes to j + s
+    stream[np.arange(len(label_ids)) + np.repeat(np.arange(len(lengths)), lengths)] = label_ids
+
+    tag = tag_codes[stream]
+    type_ = type_codes[stream]
+    prev_tag = np.concatenate([[O], tag[:-1]])
+    prev_type = np.concatenate([[type_codes[outside]], type_[:-1]])
+    new_type = prev_type != type_
+
+    end = (
+        np.isin(prev_tag, (E, S))
+        | (np.isin(prev_tag, (B, I)) & np.isin(tag, (B, S, O)))
+        | ((prev_tag != O) & (prev_tag != DOT) & new_type)
+    )
+    start = (
+        np.isin(tag, (B, S))
+        | (np.isin(prev_tag, (E, S, O)) & np.isin(tag, (E, I)))
+        | ((tag != O) & (tag != DOT) & new_type)
+    )
+
+    # a chunk ending before i began at the last start before i (0 if none)
+    ends = np.flatnonzero(end)
+    starts = np.concatenate([[0], np.flatnonzero(start)])
+    begins = starts[np.searchsorted(starts, ends, side="left") - 1]
+    return prev_type[ends], begins, ends - 1
+
+
+def _counts(true_ids, pred_ids, lengths, label_list):
+    tag_codes, type_codes, type_names = _label_codes(label_list)
+    true_types, true_starts, true_ends = entities(true_ids, lengths, tag_codes, type_codes)
+    pred_types, pred_starts, pred_ends = entities(pred_ids, lengths, tag_codes, type_codes)
+
+    size = len(true_ids) + len(lengths) + 1
+    true_keys = (true_types * size + true_starts) * size + true_ends
+    pred_keys = (pred_types * size + pred_starts) * size + pred_ends
+    matched = np.intersect1d(true_keys, pred_keys) // (size * size)
+
+    n_types = len(type_names)
+    n_true = np.bincount(true_types, minlength=n_types)
+    n_pred = np.bincount(pred_types, minlength=n_types)
+    n_matched = np.bincount(matched, minlength=n_types)
+    return type_names, n_true, n_pred, n_matched
+
+
+def _prf(n_matched, n_pred, n_true):
+    precision = n_matched / n_pred if n_pred else 0.0
+    recall = n_matched / n_true if n_true else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def score_flat(true_ids, pred_ids, lengths, label_list):
+    """Score flat arrays of gold and predicted label ids (indices in
+    `label_list`), made of sentences of the given lengths.
+
+    Return a dictionary shaped like the output of the `seqeval` metric of 🤗
+    Datasets: precision, recall, f1 and number of every entity type, and
+    overall_precision, overall_recall, overall_f1 (micro-averaged) and
+    overall_accuracy (of tokens).
+    """
+
+    true_ids = np.asarray(true_ids, dtype=np.int64)
+    pred_ids = np.asarray(pred_ids, dtype=np.int64)
+    type_names, n_true, n_pred, n_matched = _counts(true_ids, pred_ids, lengths, label_list)
+
+    results = {}
+    for name, true_count, pred_count, matched_count in zip(type_names, n_true, n_pred, n_matched):
+        if true_count == 0 and pred_count == 0:
+            continue
+        precision, recall, f1 = _prf(matched_count, pred_count, true_count)
+        results[name] = {"precision": precision, "recall": recall, "f1": f1, "number": int(true_count)}
+    precision, recall, f1 = _prf(n_matched.sum(), n_pred.sum(), n_true.sum())
+    results["overall_precision"] = precision
+    results["overall_recall"] = recall
+    results["overall_f1"] = f1
+    results["overall_accuracy"] = float(np.mean(true_ids == pred_ids)) if len(true_ids) else 0.0
+    return results
+
+
+def score(predictions, labels, label_list, ignore_index=IGNORE_INDEX):
+    """Score padded 2D arrays of predicted and gold label ids (e.g. the
+    argmax of the logits and the labels given to `compute_metrics`), positions
+    whose gold label is `ignore_index` being left out. See `score_flat`.
+    """
+
+    predictions = np.asarray(predictions)
+    labels = np.asarray(labels)
+    mask = labels != ignore_index
+    return score_flat(labels[mask], predictions[mask], mask.sum(axis=1), label_list)
+
+
+def score_tags(true_tags, pred_tags):
+    """Score lists of gold and predicted tag lists (strings), as seqeval does.
+    See `score_flat`.
+    """
+
+    label2id = {}
+    lengths = np.fromiter((len(tags) for tags in true_tags), dtype=np.int64, count=len(true_tags))
+    true_ids = [label2id.setdefault(tag, len(label2id)) for tags in true_tags for tag in tags]
+    pred_ids = [label2id.setdefault(tag, len(label2id)) for tags in pred_tags for tag in tags]
+    if len(pred_ids) != len(true_ids):
+        raise ValueError("gold and predicted tags have different lengths")
+    return score_flat(true_ids, pred_ids, lengths, list(label2id))
+
+
+def report(results):
+    """Return a text table of the results of `score_flat`."""
+
+    lines = [f"{'':<12} {'P':>6} {'R':>6} {'F':>6} {'number':>7}"]
+    for name, result in sorted(item for item in results.items() if isinstance(item[1], dict)):
+        lines.append(
+            f"{name:<12} {result['precision'] * 100:>6.2f} {result['recall'] * 100:>6.2f}"
+            f" {result['f1'] * 100:>6.2f} {result['number']:>7}"
+        )
+    lines.append(
+        f"{'overall':<12} {results['overall_precision'] * 100:>6.2f} {results['overall_recall'] * 100:>6.2f}"
+        f" {results['overall_f1'] * 100:>6.2f}"
+    )
+    return "\n".join(lines)
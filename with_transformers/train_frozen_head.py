@@ -0,0 +1,119 @@
+"""Train a lightweight tagging head (linear, CRF, BiLSTM or BiLSTM-CRF) on the
+embeddings of a frozen encoder, computed once per corpus and cached.
+
+The first run of a corpus with an encoder runs the encoder over it (see
+`frozen.py`); later runs, with another head or another label column, only
+read the cached embeddings.
+"""
+
+import argparse
+import pathlib
+import time
+
+import torch
+from datasets import load_dataset
+from transformers import AutoModel, AutoTokenizer
+
+import frozen
+from scorer import report
+
+
+HERE = pathlib.Path(__file__).resolve().parent
+HIPE = HERE / "hipe"
+
+
+def main(
+    model_checkpoint="camembert-base",
+    train_path=HIPE / "train.conll",
+    dev_path=HIPE / "dev.conll",
+    test_path=None,
+    tag_column=-1,
+    head="linear",
+    cache_dir="frozen_cache",
+    layer=-1,
+    encode_batch_size=16,
+    epochs=10,
+    batch_size=32,
+    learning_rate=1e-3,
+    lstm_size=256,
+    output=None,
+):
+    paths = {"train": train_path, "validation": dev_path}
+    if test_path:
+        paths["test"] = test_path
+    # the tags of every split are ids in the label set of all of them
+    corpora = load_dataset(
+        str(HERE / "conll.py"),
+        data_files={split: str(path) for split, path in paths.items()},
+        columns={"tokens": 0, "ner_tags": tag_column},
+    )
+    label_list = corpora["train"].features["ner_tags"].feature.names
+
+    tokenizer = model = None
+    datasets = {}
+    for split, path in paths.items():
+        tokens = corpora[split]["tokens"]
+        entry = pathlib.Path(cache_dir) / frozen.cache_key(path, model_checkpoint, layer=layer)
+        if frozen.load(entry) is None:
+            if model is None:
+                tokenizer = AutoTokenizer.from_pretrained(model_checkpoint)
+                model = AutoModel.from_pretrained(model_checkpoint)
+            start = time.perf_counter()
+            frozen.encode_corpus(model, tokenizer, tokens, entry, batch_size=encode_batch_size, layer=layer)
+            print(f"{split}: encoded {sum(map(len, tokens))} words in {time.perf_counter() - start:.1f} s", flush=True)
+        embeddings, offsets = frozen.load(entry)
+        label_ids = [tag for sentence_tags in corpora[split]["ner_tags"] for tag in sentence_tags]
+        datasets[split] = frozen.EmbeddingDataset(embeddings, offsets, label_ids)
+
+    torch.manual_seed(0)
+    tagger = frozen.TaggingHead(datasets["train"].embeddings.shape[1], len(label_list), head=head, lstm_size=lstm_size)
+    start = time.perf_counter()
+    results = frozen.train_head(
+        tagger,
+        datasets["train"],
+        datasets["validation"],
+        label_list,
+        epochs=epochs,
+        batch_size=batch_size,
+        learning_rate=learning_rate,
+    )
+    print(f"trained the {head} head in {time.perf_counter() - start:.1f} s")
+    print("dev:")
+    print(report(results))
+    if "test" in datasets:
+        print("test:")
+        print(report(frozen.evaluate(tagger, datasets["test"], label_list)))
+
+    if output:
+        torch.save(
+            {
+                "model_checkpoint": model_checkpoint,
+                "layer": layer,
+                "head": head,
+                "lstm_size": lstm_size,
+                "label_list": label_list,
+                "state_dict": tagger.state_dict(),
+            },
+            output,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-m", "--model-checkpoint", default="camembert-base", help="Encoder (default: %(default)s).")
+    parser.add_argument("--train", dest="train_path", default=HIPE / "train.conll", help="Training CoNLL file (default: HIPE train).")
+    parser.add_argument("--dev", dest="dev_path", default=HIPE / "dev.conll", help="Development CoNLL file, for model selection (default: HIPE dev).")
+    parser.add_argument("--test", dest="test_path", help="Test CoNLL file (optional).")
+    parser.add_argument("--tag-column", type=int, default=-1, help="Column of the tags in the CoNLL files (default: %(default)s).")
+    parser.add_argument("--head", choices=frozen.HEADS, default="linear", help="Tagging head (default: %(default)s).")
+    parser.add_argument("--cache-dir", default="frozen_cache", help="Folder of the cached embeddings (default: %(default)s).")
+    parser.add_argument("--layer", type=int, default=-1, help="Hidden layer of the encoder used as embeddings (default: %(default)s, the last one).")
+    parser.add_argument("--encode-batch-size", type=int, default=16, help="Number of sentences given to the encoder at once (default: %(default)s).")
+    parser.add_argument("-e", "--epochs", type=int, default=10, help="Number of training epochs (default: %(default)s).")
+    parser.add_argument("--batch-size", type=int, default=32, help="Number of sentences per training batch (default: %(default)s).")
+    parser.add_argument("--learning-rate", type=float, default=1e-3, help="Learning rate of the head (default: %(default)s).")
+    parser.add_argument("--lstm-size", type=int, default=256, help="Units per direction of the BiLSTM heads (default: %(default)s).")
+    parser.add_argument("-o", "--output", help="File where the trained head is saved (optional).")
+    args = parser.parse_args()
+
+    main(**vars(args))
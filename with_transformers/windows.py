@@ -0,0 +1,92 @@
+"""Sliding windows over sequences longer than what a model accepts.
+
+A long sequence is split into overlapping windows that each fit the model.
+Every position is then "owned" by exactly one window: the one where it has the
+most context on both sides, the owner of positions in the overlap of two
+consecutive windows changing at the middle of the overlap. Training labels are
+kept only for owned positions, and predictions are merged by taking, for every
+position, the output of its owner. The cost stays linear in the length of the
+sequence and no token is dropped.
+"""
+
+import numpy as np
+import torch
+
+
+def window_spans(costs, budget, overlap):
+    """Return the `(start, end)` spans of windows covering a sequence.
+
+    `costs` gives the size of every unit of the sequence (e.g. 1 per subword,
+    or the number of subwords of every word), a window holds at most `budget`
+    of it and consecutive windows share about `overlap` of it. A unit larger
+    than `budget` gets a window of its own.
+    """
+
+    costs = np.asarray(costs, dtype=np.int64)
+    n = len(costs)
+    if n == 0:
+        return [(0, 0)]
+    cumulative = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(costs, out=cumulative[1:])
+
+    spans = []
+    start = 0
+    while True:
+        end = int(np.searchsorted(cumulative, cumulative[start] + budget, side="right")) - 1
+        end = max(end, start + 1)
+        spans.append((start, end))
+        if end >= n:
+            return spans
+        # first unit such that units [next_start, end) fit in the overlap
+        next_start = int(np.searchsorted(cumulative, cumulative[end] - overlap, side="left"))
+        start = min(max(next_start, start + 1), end)
+
+
+def owned_spans(spans):
+    """Return the `(start, end)` span of positions owned by every window."""
+
+    boundaries = [spans[0][0]]
+    for (_, end), (next_start, _) in zip(spans, spans[1:]):
+        boundaries.append((next_start + end) // 2 if next_start < end else next_start)
+    boundaries.append(spans[-1][1])
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def merge(spans, window_values):
+    """Merge the values computed on every window (arrays or lists whose first
+    dimension is the length of the window) into the values of the whole
+    sequence, taking the values of each position from its owner.
+    """
+
+    parts = []
+    for (start, _), (own_start, own_end), values in zip(spans, owned_spans(spans), window_values):
+        parts.append(values[own_start - start: own_end - start])
+    if isinstance(parts[0], list):
+        return [value for part in parts for value in part]
+    return np.concatenate(parts)
+
+
+@torch.no_grad()
+def predict_logits(model, dataset, collator, batch_size=16):
+    """Return the logits of every subword of every sentence of a windowed
+    `PretokenizedDataset` (special tokens excluded), the logits of windows
+    being merged back into one array per sentence.
+    """
+
+    model.eval()
+    window_logits = []
+    for start in range(0, len(dataset), batch_size):
+        items = [dataset[i] for i in range(start, min(start + batch_size, len(dataset)))]
+        batch = collator(items)
+        batch.pop("labels", None)
+        batch = {key: value.to(model.device) for key, value in batch.items()}
+        logits = model(**batch).logits.cpu().numpy()
+        for item, item_logits in zip(items, logits):
+            n = len(item["input_ids"])
+            window_logits.append(item_logits[dataset.n_prefix: n - dataset.n_suffix])
+
+    sentence_logits = []
+    for sentence, indices in enumerate(dataset.sentence_windows()):
+        spans = [dataset.windows[i][1:3] for i in indices]
+        sentence_logits.append(merge(spans, [window_logits[i] for i in indices]))
+    return sentence_logits